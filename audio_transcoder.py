@@ -0,0 +1,153 @@
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from config import logger, TRANSCODE_CONFIG
+
+def _transcode_file(ffmpeg_path, source, target, bitrate, timeout):
+    """Пережать файл в MP3 с заданным битрейтом (выполняется в пуле процессов)"""
+    partial = f"{target}.{os.getpid()}.part"
+    command = [
+        ffmpeg_path, "-y", "-loglevel", "error",
+        "-i", source,
+        "-vn", "-map_metadata", "0",
+        "-codec:a", "libmp3lame", "-b:a", f"{bitrate}k",
+        "-f", "mp3", partial
+    ]
+
+    try:
+        result = subprocess.run(command, capture_output=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        return {"success": False, "error": "Таймаут ffmpeg"}
+
+    if result.returncode != 0:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        error = result.stderr.decode('utf-8', errors='replace').strip()[-300:]
+        return {"success": False, "error": error or f"код {result.returncode}"}
+
+    os.replace(partial, target)
+    return {"success": True, "path": target}
+
+class AudioTranscoder:
+    """Пережатие больших треков перед отправкой в Telegram"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def is_available(self) -> bool:
+        """Проверить, включено ли пережатие и доступен ли ffmpeg"""
+        return TRANSCODE_CONFIG["enabled"] and shutil.which(TRANSCODE_CONFIG["ffmpeg_path"]) is not None
+
+    def needs_transcoding(self, file_size: int, duration: int) -> bool:
+        """Проверить, превышает ли трек пороги размера или длительности"""
+        if not TRANSCODE_CONFIG["enabled"]:
+            return False
+        return (
+            file_size > TRANSCODE_CONFIG["size_threshold_mb"] * 1024 * 1024
+            or (duration or 0) > TRANSCODE_CONFIG["duration_threshold_sec"]
+        )
+
+    def get_cached_path(self, track, bitrate=None):
+        """Получить путь к пережатому файлу в кэше (None, если его нет)"""
+        if not TRANSCODE_CONFIG["enabled"]:
+            return None
+        path = self._cache_path(track, bitrate)
+        if path and os.path.exists(path):
+            os.utime(path)  # Для вытеснения давно не использованных файлов
+            return path
+        return None
+
+    def transcode(self, source, track, cancel_event=None, bitrate=None):
+        """Пережать скачанный трек, вернуть путь к файлу в кэше или None"""
+        if not self.is_available():
+            logger.warning("Пережатие недоступно: выключено в настройках или не найден ffmpeg")
+            return None
+
+        bitrate = bitrate or TRANSCODE_CONFIG["bitrate_kbps"]
+        target = self._cache_path(track, bitrate)
+        if not target:
+            return None
+
+        os.makedirs(TRANSCODE_CONFIG["cache_dir"], exist_ok=True)
+        future = self._get_executor().submit(
+            _transcode_file,
+            TRANSCODE_CONFIG["ffmpeg_path"], source, target, bitrate,
+            TRANSCODE_CONFIG["timeout_sec"]
+        )
+
+        # Ждем результат, периодически проверяя отмену. Отмененное пережатие
+        # доводится до конца в пуле и остается в кэше для следующих запросов
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                logger.info(f"Ожидание пережатия отменено: {target}")
+                return None
+            try:
+                result = future.result(timeout=0.5)
+                break
+            except FutureTimeoutError:
+                continue
+            except Exception as e:
+                logger.error(f"Ошибка пережатия: {e}")
+                return None
+
+        if not result["success"]:
+            logger.error(f"Ошибка пережатия: {result['error']}")
+            return None
+
+        logger.info(f"Трек пережат до {bitrate} кбит/с: {target}")
+        self._prune_cache()
+        return result["path"]
+
+    def shutdown(self):
+        """Остановить пул процессов"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self):
+        """Получить пул процессов (создается при первом пережатии)"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=TRANSCODE_CONFIG["workers"])
+            return self._executor
+
+    def _cache_path(self, track, bitrate=None):
+        """Путь к файлу кэша по ID трека и битрейту"""
+        track_id = track.get('id')
+        if track_id is None:
+            return None
+        bitrate = bitrate or TRANSCODE_CONFIG["bitrate_kbps"]
+        filename = f"{track.get('owner_id', 0)}_{track_id}_{bitrate}k.mp3"
+        return os.path.join(TRANSCODE_CONFIG["cache_dir"], filename)
+
+    def _prune_cache(self):
+        """Удалить давно не использованные файлы, если кэш превысил лимит"""
+        cache_dir = TRANSCODE_CONFIG["cache_dir"]
+        limit = TRANSCODE_CONFIG["cache_max_mb"] * 1024 * 1024
+
+        try:
+            entries = []
+            for name in os.listdir(cache_dir):
+                if not name.endswith(".mp3"):
+                    continue
+                path = os.path.join(cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= limit:
+                    break
+                os.unlink(path)
+                total -= size
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша пережатия: {e}")
+
+# Глобальный экземпляр
+audio_transcoder = AudioTranscoder()
@@ -0,0 +1,79 @@
+"""Диспетчеризация нажатий кнопок: handle_callback_query и callback_router.resolve по типам callback_data
+
+    python benchmarks/bench_callback_router.py [--calls 20000] [--tree /tmp/old]
+
+Обработчики и построение клавиатур заменены заглушками, поэтому измеряется только выбор обработчика.
+"""
+import asyncio
+import time
+import types
+
+from common import best, setup
+
+args = setup(__doc__, calls=20_000)
+
+import config
+config.SUBSCRIPTION_CONFIG["admin_id"] = [1]
+
+import handlers
+import utils
+from vk_manager import vk_manager
+
+async def noop(*args, **kwargs):
+    return None
+
+async def run_blocking(func, *args, **kwargs):
+    return func(*args, **kwargs)
+
+for name, obj in list(vars(handlers).items()):
+    if isinstance(obj, types.FunctionType) and obj.__module__ == "handlers" and asyncio.iscoroutinefunction(obj):
+        setattr(handlers, name, noop)
+for name in ("get_audio_info_text", "create_audio_keyboard", "get_admin_keyboard", "get_price_periods_keyboard"):
+    setattr(utils, name, lambda *args, **kwargs: None)
+utils.run_blocking = run_blocking
+vk_manager.get_playlist_tracks = lambda *args: {"success": False, "error": "bench"}
+vk_manager.check_token_validity = lambda: {"valid": False, "error_msg": "bench"}
+
+import callbacks
+
+class User:
+    id = 1
+
+class Query:
+    from_user = User()
+
+    def __init__(self, data: str):
+        self.data = data
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, *args, **kwargs):
+        pass
+
+class Context:
+    user_data = {"current_audio_list": [{}] * 100}
+
+class Update:
+    def __init__(self, data: str):
+        self.callback_query = Query(data)
+
+CASES = ["play_audio_3", "play_audio_page_10", "main_menu", "my_music", "admin", "admin_users:active:123",
+         "playlist_5", "check_token", "stars_month", "noop", "unknown_x"]
+router = getattr(callbacks, "callback_router", None)
+
+def dispatch(data: str):
+    update, context = Update(data), Context()
+
+    async def run():
+        for _ in range(args.calls):
+            await callbacks.handle_callback_query(update, context)
+    asyncio.run(run())
+
+print(f"{'callback_data':26} {'handle мкс':>10} {'resolve мкс':>12}")
+for data in CASES:
+    handle = best(lambda: dispatch(data)) / args.calls * 1e6
+    resolve = ""
+    if router is not None:
+        resolve = f"{best(lambda: [router.resolve(data) for _ in range(args.calls)]) / args.calls * 1e6:12.2f}"
+    print(f"{data:26} {handle:10.2f} {resolve}")
@@ -0,0 +1,28 @@
+"""Горячие методы менеджера на подписках в памяти: is_subscribed, get_time_left, get_statistics
+
+    python benchmarks/bench_epoch_times.py [--users 1000] [--calls 100000]
+"""
+
+from common import MemoryStorage, best, seed_data, setup
+
+args = setup(__doc__, users=1000, calls=100_000)
+
+from subscription_manager import SubscriptionManager
+
+manager = SubscriptionManager("unused.json", storage=MemoryStorage(seed_data(args.users, args.users)))
+subscribers = [10**9 + i % args.users for i in range(args.calls)]
+free_users = [2 * 10**9 + i % args.users for i in range(args.calls)]
+print(f"{args.users} подписчиков и {args.users} бесплатных пользователей, {args.calls} вызовов")
+
+def measure(label: str, func, ids: list):
+    elapsed = best(lambda: [func(user_id) for user_id in ids])
+    print(f"  {label:24} {elapsed * 1e3:8.1f} мс  {elapsed / len(ids) * 1e6:6.2f} мкс/вызов")
+
+measure("is_subscribed", manager.is_subscribed, subscribers)
+measure("get_time_left", manager.get_time_left, subscribers)
+measure("can_make_free_request", manager.can_make_free_request, free_users)
+measure("get_free_requests_info", manager.get_free_requests_info, free_users)
+
+calls = max(1, args.calls // args.users)
+elapsed = best(lambda: [manager.get_statistics() for _ in range(calls)])
+print(f"  {'get_statistics':24} {elapsed * 1e3:8.1f} мс  {elapsed / calls * 1e6:6.2f} мкс/вызов")
@@ -0,0 +1,47 @@
+"""Журнал изменений: запись одного изменения, запуск с журналом на N событий и сворачивание
+
+    python benchmarks/bench_journal.py [--events 1000000] [--users 100000] [--calls 50000]
+"""
+import json
+import os
+import time
+from datetime import datetime
+
+from common import best, setup
+
+args = setup(__doc__, events=1_000_000, users=100_000, calls=50_000)
+
+from subscription_manager import SubscriptionManager
+from subscription_storage import JournalSubscriptionStorage
+
+# Стоимость одного изменения: одна строка в конце журнала, без перезаписи снимка
+storage = JournalSubscriptionStorage("live.json", compact_bytes=10**12)
+manager = SubscriptionManager("live.json", storage=storage)
+started = time.perf_counter()
+for k in range(args.calls):
+    manager.use_free_request(k % args.users)
+elapsed = time.perf_counter() - started
+manager.close()
+print(f"use_free_request с журналом: {elapsed / args.calls * 1e6:.1f} мкс/оп ({args.calls / elapsed:,.0f} оп/с)")
+
+# Журнал на events событий по users пользователям, в формате записей JournalSubscriptionStorage
+now = int(time.time())
+with open("big.json.journal", "w", encoding="utf-8") as f:
+    for i in range(args.events):
+        record = {
+            "subscription_until": datetime.fromtimestamp(now + i % 86400).isoformat(),
+            "active": True, "notified_24h": False, "notified_2h": False,
+        }
+        f.write(json.dumps({"op": "user", "id": str(i % args.users), "v": record}, separators=(",", ":")) + "\n")
+print(f"журнал: {args.events} событий, {os.path.getsize('big.json.journal') / 2**20:.0f} МБ")
+
+replay = best(lambda: JournalSubscriptionStorage("big.json").load(), repeat=1)
+print(f"  запуск с журналом (снимок + журнал): {replay:.2f} с")
+
+storage = JournalSubscriptionStorage("big.json")
+storage._data = storage.load()
+compact = best(storage.compact, repeat=1)
+print(f"  сворачивание журнала в снимок: {compact:.2f} с")
+
+startup = best(lambda: JournalSubscriptionStorage("big.json").load())
+print(f"  запуск после сворачивания: {startup:.2f} с")
@@ -0,0 +1,38 @@
+"""Холодный старт с файла данных: JSON с отступами, компактный JSON и бинарный снимок
+
+    python benchmarks/bench_snapshot.py [--users 100000] [--repeat 3]
+
+Бесплатных пользователей вдвое меньше, чем подписчиков.
+"""
+import os
+import time
+
+from common import MemoryStorage, best, seed_data, setup
+
+args = setup(__doc__, users=100_000, repeat=3)
+
+from subscription_manager import SubscriptionManager
+from subscription_storage import BinarySubscriptionStorage, JSONSubscriptionStorage
+
+# Отложенная запись, чтобы создание менеджера не перезаписывало файл
+options = dict(write_behind=True, flush_interval=3600, flush_every=10**9)
+storages = {
+    "json indent": (JSONSubscriptionStorage("indent.json", **options), 2),
+    "json compact": (JSONSubscriptionStorage("compact.json", **options), None),
+    "binary": (BinarySubscriptionStorage("data.snap", **options), None),
+}
+
+data = SubscriptionManager("unused.json", storage=MemoryStorage(seed_data(args.users, args.users // 2))).data
+writes = {}
+for label, (storage, indent) in storages.items():
+    started = time.perf_counter()
+    storage._write(data, indent=indent)
+    writes[label] = time.perf_counter() - started
+del data
+
+print(f"{args.users} подписчиков и {args.users // 2} бесплатных пользователей")
+for label, (storage, _) in storages.items():
+    load = best(storage.load, args.repeat)
+    start = best(lambda: SubscriptionManager("unused.json", storage=storage), args.repeat)
+    print(f"  {label:12} файл {os.path.getsize(storage.db_file) / 1e6:6.1f} МБ  запись {writes[label] * 1e3:6.0f} мс  "
+          f"load {load * 1e3:6.0f} мс  создание менеджера {start * 1e3:6.0f} мс")
@@ -0,0 +1,36 @@
+"""Память и поиск в таблице пользователей: байт на пользователя и время проверок по случайным id
+
+    python benchmarks/bench_user_table.py [--users 1000000] [--free-users 500000] [--lookups 200000]
+"""
+import random
+import tracemalloc
+
+from common import MemoryStorage, best, seed_data, setup
+
+args = setup(__doc__, users=1_000_000, free_users=500_000, lookups=200_000)
+
+from subscription_manager import SubscriptionManager
+
+tracemalloc.start()
+storage = MemoryStorage(seed_data(args.users, args.free_users))
+manager = SubscriptionManager("unused.json", storage=storage)
+# Хранилище отпускает загруженные данные: остается только то, что держит менеджер
+storage.data = None
+used = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+total = args.users + args.free_users
+print(f"{args.users} подписчиков и {args.free_users} бесплатных пользователей: "
+      f"{used / 2**20:.0f} МБ, {used / total:.0f} байт на пользователя")
+
+rng = random.Random(1)
+subscribers = [10**9 + rng.randrange(args.users) for _ in range(args.lookups)]
+free_users = [2 * 10**9 + rng.randrange(args.free_users) for _ in range(args.lookups)]
+
+def measure(label: str, func, ids: list):
+    elapsed = best(lambda: [func(user_id) for user_id in ids])
+    print(f"  {label:24} {elapsed / len(ids) * 1e6:6.2f} мкс/вызов")
+
+measure("is_subscribed", manager.is_subscribed, subscribers)
+measure("get_user", manager.get_user, subscribers)
+measure("get_time_left", manager.get_time_left, subscribers)
+measure("can_make_free_request", manager.can_make_free_request, free_users)
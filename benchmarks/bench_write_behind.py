@@ -0,0 +1,37 @@
+"""Пропускная способность use_free_request: синхронная запись JSON и отложенная запись
+
+    python benchmarks/bench_write_behind.py [--users 100000] [--calls 50000]
+"""
+import os
+import shutil
+import time
+
+from common import seed_data, setup, write_json
+
+args = setup(__doc__, users=100_000, calls=50_000, sync_calls=20)
+
+from subscription_manager import SubscriptionManager
+from subscription_storage import JSONSubscriptionStorage
+
+write_json("seed.json", seed_data(args.users, args.users))
+print(f"{args.users} подписчиков и {args.users} бесплатных пользователей, "
+      f"файл {os.path.getsize('seed.json') / 1e6:.1f} МБ")
+
+def run(label: str, calls: int, **storage_options):
+    filename = f"{label}.json"
+    shutil.copy("seed.json", filename)
+    manager = SubscriptionManager(filename, storage=JSONSubscriptionStorage(filename, **storage_options))
+
+    started = time.perf_counter()
+    for k in range(calls):
+        manager.use_free_request(2 * 10**9 + k % args.users)
+    elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    manager.close()
+    closed = time.perf_counter() - started
+    print(f"  {label:10} {calls / elapsed:12,.1f} оп/с  {elapsed / calls * 1e3:9.3f} мс/оп  "
+          f"запись при закрытии {closed:.2f} с")
+
+run("sync", args.sync_calls)
+run("behind", args.calls, write_behind=True, flush_interval=2.0, flush_every=100_000)
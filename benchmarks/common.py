@@ -0,0 +1,98 @@
+"""Общие функции микробенчмарков
+
+Каждый бенчмарк запускается из корня репозитория (python benchmarks/bench_*.py)
+и работает во временной директории, которая удаляется после запуска.
+С --tree модули бота берутся из другого дерева исходников, например из
+рабочей копии старой версии (git worktree add /tmp/old <коммит>): так
+сравниваются числа до и после изменения, если в старой версии есть
+используемые бенчмарком методы.
+"""
+import argparse
+import atexit
+import gc
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def setup(description: str, **options) -> argparse.Namespace:
+    """Разобрать аргументы, подключить дерево исходников и перейти во временную директорию
+
+    options - параметры бенчмарка со значениями по умолчанию (--имя-параметра в командной строке).
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--tree", default=str(ROOT), help="Дерево исходников бота")
+    for name, default in options.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(Path(args.tree).resolve()))
+    work = tempfile.mkdtemp(prefix="vk-bot-bench-")
+    atexit.register(shutil.rmtree, work, ignore_errors=True)
+    os.chdir(work)
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:BENCH")
+    logging.disable(logging.INFO)
+    return args
+
+def best(func, repeat: int = 3) -> float:
+    """Лучшее время вызова func из repeat попыток, секунд"""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+def seed_data(users: int, free_users: int = 0, now: int = None) -> dict:
+    """Данные подписок в формате файла: users подписчиков и free_users пользователей без подписки
+
+    Половина подписок истекла; у бесплатных пользователей по несколько запросов.
+    """
+    now = int(time.time()) if now is None else now
+    iso = lambda seconds: datetime.fromtimestamp(seconds).isoformat()
+    data = {"users": {}, "free_requests": {}, "pending_payments": {}}
+    for i in range(users):
+        until = now + (i % 60 - 30) * 86400 + 3600
+        data["users"][str(10**9 + i)] = {
+            "subscription_until": iso(until),
+            "active": until > now,
+            "notified_24h": False,
+            "notified_2h": False,
+        }
+    for i in range(free_users):
+        data["free_requests"][str(2 * 10**9 + i)] = {
+            "used": i % 5, "first_request": iso(now - i % 86400), "last_reset": iso(now - i % 86400), "epoch": 0,
+        }
+    return data
+
+def write_json(path: str, data: dict, indent: int = 2):
+    """Записать данные в JSON-файл так же, как их записывает бот"""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+
+class MemoryStorage:
+    """Хранилище без диска: load отдает готовые данные, сохранение ничего не делает"""
+
+    shared = False
+
+    def __init__(self, data: dict):
+        self.data = data
+
+    def load(self) -> dict:
+        return self.data
+
+    def close(self):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith(("save", "delete")):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
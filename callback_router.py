@@ -0,0 +1,140 @@
+import functools
+import time
+from config import SUBSCRIPTION_CONFIG
+
+class _TrieNode:
+    """Узел сжатого префиксного дерева: ребра по первому символу метки"""
+
+    __slots__ = ("edges", "route")
+
+    def __init__(self):
+        self.edges = {}  # первый символ -> (метка ребра, узел)
+        self.route = None
+
+class CallbackRouter:
+    """Маршрутизация callback_data к обработчикам
+
+    Точные значения ищутся в словаре, префиксы - в сжатом префиксном дереве
+    (ребро хранит общий участок префиксов, поэтому поиск проходит несколько
+    ребер, а не каждый символ); побеждает точное совпадение, затем самый длинный префикс,
+    поэтому порядок регистрации не важен ("play_audio_page_" и "play_audio_").
+    Обработчик - корутина handler(query, context, arg), где arg - часть
+    callback_data после префикса (для точных маршрутов - пустая строка).
+    """
+
+    def __init__(self):
+        self._exact = {}
+        self._trie = _TrieNode()
+        self._timings = {}
+
+    def exact(self, data: str, admin_only: bool = False):
+        """Декоратор: обработчик для callback_data, равного data"""
+        def register(handler):
+            self._exact[data] = (data, self._guard(handler) if admin_only else handler)
+            return handler
+        return register
+
+    def prefix(self, prefix: str, admin_only: bool = False):
+        """Декоратор: обработчик для callback_data, начинающегося с prefix"""
+        def register(handler):
+            self._insert(prefix, (prefix + "*", self._guard(handler) if admin_only else handler))
+            return handler
+        return register
+
+    def resolve(self, data: str):
+        """Найти маршрут: (имя маршрута, обработчик, аргумент) или None"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route[0], route[1], ""
+
+        found, depth = None, 0
+        node, position, size = self._trie, 0, len(data)
+        while position < size:
+            edge = node.edges.get(data[position])
+            if edge is None:
+                break
+            label, node = edge
+            if not data.startswith(label, position):
+                break
+            position += len(label)
+            if node.route is not None:
+                found, depth = node.route, position
+        if found is None:
+            return None
+        return found[0], found[1], data[depth:]
+
+    async def dispatch(self, query, context) -> bool:
+        """Выполнить обработчик маршрута; False, если маршрут не найден"""
+        route = self.resolve(query.data)
+        if route is None:
+            return False
+
+        name, handler, arg = route
+        started = time.perf_counter()
+        failed = True
+        try:
+            await handler(query, context, arg)
+            failed = False
+        finally:
+            self._record(name, time.perf_counter() - started, failed)
+        return True
+
+    def snapshot(self) -> list:
+        """Время обработки по маршрутам, начиная с самых затратных по сумме"""
+        rows = [
+            {
+                "route": name,
+                "count": count,
+                "errors": errors,
+                "avg_ms": total / count * 1000,
+                "max_ms": peak * 1000,
+                "total_s": total,
+            }
+            for name, (count, errors, total, peak) in self._timings.items()
+        ]
+        rows.sort(key=lambda row: row["total_s"], reverse=True)
+        return rows
+
+    def _insert(self, prefix: str, route: tuple):
+        """Добавить префикс в дерево, разделяя ребра на общем участке"""
+        node, position = self._trie, 0
+        while position < len(prefix):
+            edge = node.edges.get(prefix[position])
+            if edge is None:
+                child = _TrieNode()
+                node.edges[prefix[position]] = (prefix[position:], child)
+                node = child
+                break
+
+            label, child = edge
+            common = 0
+            limit = min(len(label), len(prefix) - position)
+            while common < limit and label[common] == prefix[position + common]:
+                common += 1
+            if common < len(label):
+                # Новый префикс расходится с меткой посередине: вставляем промежуточный узел
+                middle = _TrieNode()
+                middle.edges[label[common]] = (label[common:], child)
+                node.edges[prefix[position]] = (label[:common], middle)
+                child = middle
+            node, position = child, position + common
+        node.route = route
+
+    def _record(self, name: str, elapsed: float, failed: bool):
+        """Учесть время одного вызова маршрута"""
+        count, errors, total, peak = self._timings.get(name, (0, 0, 0.0, 0.0))
+        self._timings[name] = (count + 1, errors + failed, total + elapsed, max(peak, elapsed))
+
+    @staticmethod
+    def _guard(handler):
+        """Обернуть обработчик проверкой прав администратора"""
+        @functools.wraps(handler)
+        async def guarded(query, context, arg):
+            if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
+                await query.answer("❌ Нет доступа", show_alert=True)
+                return
+            await handler(query, context, arg)
+        return guarded
+
+# Глобальный экземпляр
+callback_router = CallbackRouter()
@@ -41,6 +41,14 @@ PAGE_SIZE = 10
 # Пути к файлам
 TOKEN_FILE = 'vk_token.txt'
 
+# Настройки загрузки аудио
+DOWNLOAD_CONFIG = {
+    "chunk_size": 8192,  # Размер блока при скачивании
+    "progress_interval": 3.0,  # Не чаще одного обновления прогресса за N секунд
+    "max_resume_attempts": 3,  # Сколько раз докачивать файл после обрыва
+    "resume_delay": 1.0,  # Пауза перед докачкой (умножается на номер попытки)
+}
+
 # Конфигурация подписок
 SUBSCRIPTION_CONFIG = {
     "admin_id": [7708249698, 6344982306],  # Ваши ID администраторов
@@ -48,6 +56,9 @@ SUBSCRIPTION_CONFIG = {
     "admin_channel_id": "-1003427114624",  # Канал для уведомлений
     "support_link": "https://t.me/KarloBoss",  # Ссылка на поддержку
     "payment_provider_token": os.getenv('PAYMENT_PROVIDER_TOKEN', ''),  # Токен платежной системы
+    "expiry_sweep_interval": 60,  # Как часто снимать флаг active с истекших подписок (сек)
+    "stats_reconcile_interval": 3600,  # Как часто сверять счетчики статистики полным проходом (сек)
+    "pending_payment_ttl_days": 14,  # Удалять непроверенные платежи старше N дней (0 - не удалять)
 }
 
 # Конфигурация бесплатных запросов
@@ -56,9 +67,110 @@ FREE_REQUESTS_CONFIG = {
     "requests_reset_days": 30,  # Сброс через 30 дней
 }
 
+# Очистка устаревших данных подписок (фоновый поток истечения подписок, раз в interval_hours)
+RETENTION_CONFIG = {
+    # Очистка удаляет данные, поэтому включается явно: RETENTION_ENABLED=1
+    "enabled": os.getenv('RETENTION_ENABLED', '0') == '1',
+    "interval_hours": 24,
+    # Удалять счетчики бесплатных запросов без обращений дольше N дней (0 - не удалять;
+    # меньше периода сброса не бывает: такой счетчик и так обнулился бы при обращении)
+    "free_requests_idle_days": 90,
+    # Переносить в архив подписки, истекшие больше N дней назад (0 - не переносить)
+    "archive_expired_days": 180,
+    "archive_file": "subscriptions_archive.jsonl",
+}
+
+# Хранилище подписок: "json" (файл целиком), "journal" (снимок json_file и журнал
+# изменений), "sqlite" (построчные обновления) или "redis" (общее для нескольких
+# процессов бота). При первом запуске с sqlite и redis данные импортируются из json_file
+SUBSCRIPTION_STORAGE_CONFIG = {
+    "backend": os.getenv('SUBSCRIPTION_BACKEND', 'json'),
+    "json_file": "subscriptions.json",
+    "sqlite_file": "subscriptions.db",
+    # Формат снимка json/journal: json или binary (быстрая загрузка больших баз;
+    # JSON-файл тогда используется для первоначального импорта)
+    "snapshot_format": os.getenv('SUBSCRIPTION_SNAPSHOT_FORMAT', 'json'),
+    "binary_file": "subscriptions.snap",
+    # Redis и совместимые серверы (Valkey, KeyDB)
+    "redis_url": os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+    "redis_prefix": os.getenv('REDIS_PREFIX', 'vkbot:'),
+    # Общая база SQLite для нескольких процессов на одной машине (redis общий всегда)
+    "shared": os.getenv('SUBSCRIPTION_SHARED', '0') == '1',
+    "shared_cache_ttl": 1.0,  # Сколько секунд доверять прочитанной из общего хранилища записи
+    # Отложенная запись JSON: изменения сбрасываются фоновым потоком. При сбое
+    # теряются изменения за последние flush_interval секунд, а файл пишется без отступов
+    "write_behind": os.getenv('SUBSCRIPTION_WRITE_BEHIND', '0') == '1',
+    "flush_interval": 2.0,  # Не чаще одной записи за N секунд
+    "flush_every": 100,  # ...или сразу после N изменений
+    # Журнал изменений
+    "journal_file": "subscriptions.journal",
+    "journal_compact_mb": 16,  # Сворачивать журнал в снимок после N МБ
+    "journal_fsync": False,  # fsync после каждой записи журнала
+}
+
 # Функции, требующие подписки
 SUBSCRIPTION_REQUIRED_FEATURES = ["search_music"]  # Только поиск требует подписки
 
+# Настройки пережатия больших треков (требуется ffmpeg)
+TRANSCODE_CONFIG = {
+    "enabled": os.getenv('TRANSCODE_ENABLED', '0') == '1',
+    "ffmpeg_path": os.getenv('FFMPEG_PATH', 'ffmpeg'),
+    "bitrate_kbps": 128,  # Целевой битрейт
+    "size_threshold_mb": 20,  # Пережимать файлы больше N МБ
+    "duration_threshold_sec": 900,  # ...или длиннее N секунд
+    "workers": 2,  # Размер пула процессов
+    "timeout_sec": 300,  # Максимальное время пережатия одного трека
+    "cache_dir": "transcode_cache",  # Кэш пережатых файлов
+    "cache_max_mb": 1024,  # Максимальный размер кэша
+}
+
+# Настройки Telegram Bot API
+# Локальный сервер Bot API (https://github.com/tdlib/telegram-bot-api) должен
+# иметь доступ к временным файлам бота: в режиме local_mode файлы передаются
+# ему по пути, а не загружаются через multipart, и лимит размера - 2000 МБ
+TELEGRAM_API_CONFIG = {
+    "base_url": os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot'),
+    "base_file_url": os.getenv('TELEGRAM_API_BASE_FILE_URL', 'https://api.telegram.org/file/bot'),
+    "local_mode": os.getenv('TELEGRAM_API_LOCAL_MODE', '0') == '1',
+    "upload_limit_mb": 50,  # Лимит публичного api.telegram.org
+    "local_upload_limit_mb": 2000,  # Лимит локального сервера
+}
+
+# Настройки выполнения бота
+RUNTIME_CONFIG = {
+    "concurrent_updates": int(os.getenv('BOT_CONCURRENT_UPDATES', '64')),  # Сколько обновлений обрабатывать одновременно
+    "blocking_workers": int(os.getenv('BOT_BLOCKING_WORKERS', '32')),  # Потоки для вызовов VK API, загрузок и файлов
+}
+
+# Получение обновлений через вебхук вместо long polling (по умолчанию - polling).
+# TLS обычно завершает балансировщик или обратный прокси перед встроенным сервером
+WEBHOOK_CONFIG = {
+    "enabled": os.getenv('WEBHOOK_ENABLED', '0') == '1',
+    "listen": os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+    "port": int(os.getenv('WEBHOOK_PORT', '8443')),
+    "path": os.getenv('WEBHOOK_PATH', '/telegram'),
+    "url": os.getenv('WEBHOOK_URL'),  # Публичный адрес; если задан, бот сам вызывает setWebhook
+    "secret_token": os.getenv('WEBHOOK_SECRET_TOKEN'),  # Общий для всех экземпляров бота
+    "cert_file": os.getenv('WEBHOOK_CERT_FILE'),  # TLS на самом сервере (необязательно)
+    "key_file": os.getenv('WEBHOOK_KEY_FILE'),
+    "queue_size": int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),  # При заполненной очереди - ответ 503
+    "workers": int(os.getenv('WEBHOOK_WORKERS', '64')),  # Сколько обновлений обрабатывать одновременно
+    "max_connections": 40,  # Параметр setWebhook: соединений от Telegram
+    "max_body_kb": 1024,  # Максимальный размер тела запроса
+    "drain_timeout_sec": 10,  # Сколько ждать обработки очереди при остановке
+}
+
+# Рассылка уведомлений пользователям (Telegram допускает около 30 сообщений в секунду)
+NOTIFICATION_CONFIG = {
+    "rate_per_second": 20,  # Не больше N сообщений в секунду
+    "burst": 5,  # Сколько сообщений можно отправить подряд без паузы
+    "max_retries": 3,  # Повторы при ответе RetryAfter (flood control)
+    "batch_size": 100,  # Обрабатывать доставленные сообщения порциями по N (например, сохранять флаги)
+    # Уведомления админам: до N событий за окно уходят по отдельности, остальные - одной сводкой
+    "admin_digest_threshold": 5,
+    "admin_digest_window": 60,  # Длина окна (сек)
+}
+
 # Токен бота
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 if not TELEGRAM_BOT_TOKEN:
@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+from config import logger, DOWNLOAD_CONFIG
+
+class DownloadManager:
+    """Учет активных загрузок пользователей и их отмена"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = {}
+
+    def start(self, user_id) -> threading.Event:
+        """Зарегистрировать новую загрузку, отменив предыдущую загрузку пользователя"""
+        token = threading.Event()
+        with self._lock:
+            previous = self._tokens.get(user_id)
+            self._tokens[user_id] = token
+
+        if previous is not None and not previous.is_set():
+            previous.set()
+            logger.info(f"Предыдущая загрузка пользователя {user_id} отменена")
+
+        return token
+
+    def cancel(self, user_id) -> bool:
+        """Отменить активную загрузку пользователя"""
+        with self._lock:
+            token = self._tokens.pop(user_id, None)
+
+        if token is None or token.is_set():
+            return False
+
+        token.set()
+        logger.info(f"Загрузка пользователя {user_id} отменена")
+        return True
+
+    def finish(self, user_id, token):
+        """Снять загрузку с учета после завершения"""
+        with self._lock:
+            if self._tokens.get(user_id) is token:
+                del self._tokens[user_id]
+
+class DownloadProgress:
+    """Прогресс одной загрузки: счетчики байт и ограничение частоты уведомлений"""
+
+    def __init__(self, on_update=None, interval=None):
+        self.downloaded = 0
+        self.total = 0
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self._on_update = on_update
+        self._interval = DOWNLOAD_CONFIG["progress_interval"] if interval is None else interval
+        self._last_notified = self.started_at
+
+    @property
+    def elapsed(self) -> float:
+        """Время загрузки в секундах"""
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return max(end - self.started_at, 1e-6)
+
+    @property
+    def percent(self):
+        """Процент загрузки (None, если размер неизвестен)"""
+        if not self.total:
+            return None
+        return min(100, self.downloaded * 100 // self.total)
+
+    @property
+    def rate(self) -> float:
+        """Средняя скорость в байтах в секунду"""
+        return self.downloaded / self.elapsed
+
+    def set_total(self, total):
+        """Установить ожидаемый размер файла"""
+        self.total = total or 0
+
+    def restart(self):
+        """Начать учет байт заново (файл скачивается с начала)"""
+        self.downloaded = 0
+
+    def add(self, size):
+        """Учесть скачанный блок"""
+        self.downloaded += size
+
+        if self._on_update is None:
+            return
+
+        # Промежуточные состояния не копятся: уведомление получает
+        # только актуальное состояние, не чаще одного раза за интервал
+        now = time.monotonic()
+        if now - self._last_notified < self._interval:
+            return
+        self._last_notified = now
+
+        try:
+            self._on_update(self)
+        except Exception as e:
+            logger.debug(f"Ошибка обновления прогресса загрузки: {e}")
+
+    def finish(self):
+        """Зафиксировать окончание загрузки"""
+        if self.finished_at is None:
+            self.finished_at = time.monotonic()
+
+class ProgressMessage:
+    """Сообщение о загрузке, которое обновляется из потока загрузки
+
+    Одновременно выполняется не больше одного редактирования. Пока оно идет,
+    хранится только последний текст: промежуточные значения пропускаются,
+    и позднее редактирование не перезаписывает более новое.
+    """
+
+    def __init__(self, message, loop):
+        self.message = message
+        self._loop = loop
+        self._pending = None
+        self._task = None
+        self._closed = False
+
+    def update(self, text: str):
+        """Запланировать редактирование (вызывается из любого потока)"""
+        self._loop.call_soon_threadsafe(self._schedule, text)
+
+    def _schedule(self, text: str):
+        if self._closed:
+            return
+        self._pending = text
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self._pending is not None and not self._closed:
+                text, self._pending = self._pending, None
+                try:
+                    await self.message.edit_text(text)
+                except Exception as e:
+                    logger.debug(f"Ошибка обновления прогресса загрузки: {e}")
+        finally:
+            self._task = None
+
+    async def close(self):
+        """Прекратить обновления и дождаться редактирования, которое уже отправлено"""
+        self._closed = True
+        self._pending = None
+        if self._task is not None:
+            await self._task
+
+class DownloadMetrics:
+    """Агрегированная статистика скорости загрузок"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.downloads = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.total_bytes = 0
+        self.total_seconds = 0.0
+        self.peak_rate = 0.0
+
+    def record(self, progress: DownloadProgress, status: str):
+        """Учесть завершенную загрузку (status: success, failed или cancelled)"""
+        progress.finish()
+        with self._lock:
+            self.total_bytes += progress.downloaded
+            self.total_seconds += progress.elapsed
+            if status == "success":
+                self.downloads += 1
+                self.peak_rate = max(self.peak_rate, progress.rate)
+            elif status == "cancelled":
+                self.cancelled += 1
+            else:
+                self.failed += 1
+
+        logger.info(
+            f"Загрузка ({status}): {progress.downloaded} байт за {progress.elapsed:.1f} с, "
+            f"{progress.rate / 1024:.0f} КБ/с"
+        )
+
+    def snapshot(self) -> dict:
+        """Получить сводку по загрузкам"""
+        with self._lock:
+            return {
+                "downloads": self.downloads,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "total_bytes": self.total_bytes,
+                "avg_rate": self.total_bytes / self.total_seconds if self.total_seconds else 0.0,
+                "peak_rate": self.peak_rate,
+            }
+
+# Глобальные экземпляры
+download_manager = DownloadManager()
+download_metrics = DownloadMetrics()
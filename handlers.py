@@ -4,12 +4,19 @@ from telegram.ext import CallbackContext
 from config import logger, PROGRAM_INFO, SUBSCRIPTION_CONFIG, FREE_REQUESTS_CONFIG
 from vk_manager import vk_manager
 from subscription_manager import subscription_manager
-from utils import get_audio_info_text, create_audio_keyboard, format_subscription_period, get_time_left_text
+from download_manager import download_manager, download_metrics, DownloadProgress, ProgressMessage
+from callback_router import callback_router
+from audio_transcoder import audio_transcoder
+from notifier import notification_sender, admin_notifier
+from utils import get_audio_info_text, create_audio_keyboard, format_subscription_period, get_time_left_text, get_download_progress_text
+from utils import get_upload_limit_bytes, load_upload_file, run_blocking, run_cancellable
+import asyncio
 import tempfile
 import os
+import time
 from datetime import datetime
 
-def start(update: Update, context: CallbackContext):
+async def start(update: Update, context: CallbackContext):
     """Обработчик команды /start"""
     welcome_text = (
         f"🎵 Добро пожаловать в {PROGRAM_INFO['name']}!\n\n"
@@ -29,9 +36,9 @@ def start(update: Update, context: CallbackContext):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    update.message.reply_text(welcome_text, reply_markup=reply_markup)
+    await update.message.reply_text(welcome_text, reply_markup=reply_markup)
 
-def help_command(update: Update, context: CallbackContext):
+async def help_command(update: Update, context: CallbackContext):
     """Обработчик команды /help"""
     help_text = (
         "VK Moosic Player Bot - Помощь\n\n"
@@ -44,35 +51,35 @@ def help_command(update: Update, context: CallbackContext):
         "Для работы с ботом необходим VK токен с доступом к аудио.\n"
         "Для поиска музыки доступно 10 бесплатных запросов, затем требуется подписка."
     )
-    update.message.reply_text(help_text)
+    await update.message.reply_text(help_text)
 
-def token_command(update: Update, context: CallbackContext):
+async def token_command(update: Update, context: CallbackContext):
     """Обработчик команды /token"""
-    update.message.reply_text(
+    await update.message.reply_text(
         "🔑 Пожалуйста, отправьте ваш VK токен. "
         "Вы можете получить его здесь: https://vkhost.github.io/\n\n"
         "⚠️ Никому не передавайте ваш токен!"
     )
     context.user_data['awaiting_token'] = True
 
-def subscription_command(update: Update, context: CallbackContext):
+async def subscription_command(update: Update, context: CallbackContext):
     """Обработчик команды /subscription"""
-    show_subscription_menu(update.message, context)
+    await show_subscription_menu(update.message, context)
 
-def handle_token(update: Update, context: CallbackContext):
+async def handle_token(update: Update, context: CallbackContext):
     """Обработчик ввода токена"""
     token = update.message.text.strip()
 
     if not token:
-        update.message.reply_text("❌ Токен не может быть пустым")
+        await update.message.reply_text("❌ Токен не может быть пустым")
         return
 
     old_token = vk_manager.token
     vk_manager.set_token(token)
 
-    validity = vk_manager.check_token_validity()
+    validity = await run_blocking(vk_manager.check_token_validity)
     if not validity["valid"]:
-        update.message.reply_text(f"❌ Токен невалиден: {validity.get('error_msg')}")
+        await update.message.reply_text(f"❌ Токен невалиден: {validity.get('error_msg')}")
         vk_manager.token = old_token
         return
 
@@ -80,19 +87,19 @@ def handle_token(update: Update, context: CallbackContext):
     first_name = user_info.get('first_name', '')
     last_name = user_info.get('last_name', '')
 
-    vk_manager.save_token_to_file()
+    await run_blocking(vk_manager.save_token_to_file)
 
-    update.message.reply_text(
+    await update.message.reply_text(
         f"✅ Токен успешно установлен!\n"
         f"👤 Пользователь: {first_name} {last_name}\n\n"
         "Теперь вы можете использовать главное меню: /menu"
     )
 
-def menu_command(update: Update, context: CallbackContext):
+async def menu_command(update: Update, context: CallbackContext):
     """Обработчик команды /menu"""
-    show_main_menu(update, context)
+    await show_main_menu(update, context)
 
-def show_main_menu(update: Update, context: CallbackContext):
+async def show_main_menu(update: Update, context: CallbackContext):
     """Показать главное меню"""
     if not vk_manager.token:
         keyboard = [
@@ -100,21 +107,21 @@ def show_main_menu(update: Update, context: CallbackContext):
             [InlineKeyboardButton("💎 Подписка", callback_data="subscription_required")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text(
+        await update.message.reply_text(
             "❌ Токен не установлен. Сначала установите VK токен.",
             reply_markup=reply_markup
         )
         return
 
     # Проверяем валидность токена
-    validity = vk_manager.check_token_validity()
+    validity = await run_blocking(vk_manager.check_token_validity)
     if not validity["valid"]:
         keyboard = [
             [InlineKeyboardButton("🔑 Установить токен", callback_data="set_token")],
             [InlineKeyboardButton("💎 Подписка", callback_data="subscription_required")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text(
+        await update.message.reply_text(
             f"❌ Токен невалиден: {validity.get('error_msg')}",
             reply_markup=reply_markup
         )
@@ -151,7 +158,7 @@ def show_main_menu(update: Update, context: CallbackContext):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    update.message.reply_text(
+    await update.message.reply_text(
         f"👤 {first_name} {last_name}\n"
         f"💎 Подписка: {subscription_status}\n"
         f"🔍 Бесплатные запросы: {requests_status}\n"
@@ -159,7 +166,7 @@ def show_main_menu(update: Update, context: CallbackContext):
         reply_markup=reply_markup
     )
 
-def show_main_menu_from_query(query, context: CallbackContext):
+async def show_main_menu_from_query(query, context: CallbackContext):
     """Показать главное меню из callback query"""
     if not vk_manager.token:
         keyboard = [
@@ -168,19 +175,19 @@ def show_main_menu_from_query(query, context: CallbackContext):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "❌ Токен не установлен. Сначала установите VK токен.",
                 reply_markup=reply_markup
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="❌ Токен не установлен. Сначала установите VK токен.",
                 reply_markup=reply_markup
             )
         return
 
-    validity = vk_manager.check_token_validity()
+    validity = await run_blocking(vk_manager.check_token_validity)
     if not validity["valid"]:
         keyboard = [
             [InlineKeyboardButton("🔑 Установить токен", callback_data="set_token")],
@@ -188,12 +195,12 @@ def show_main_menu_from_query(query, context: CallbackContext):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 f"❌ Токен невалиден: {validity.get('error_msg')}",
                 reply_markup=reply_markup
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Токен невалиден: {validity.get('error_msg')}",
                 reply_markup=reply_markup
@@ -232,7 +239,7 @@ def show_main_menu_from_query(query, context: CallbackContext):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             f"👤 {first_name} {last_name}\n"
             f"💎 Подписка: {subscription_status}\n"
             f"🔍 Бесплатные запросы: {requests_status}\n"
@@ -240,7 +247,7 @@ def show_main_menu_from_query(query, context: CallbackContext):
             reply_markup=reply_markup
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=f"👤 {first_name} {last_name}\n"
                  f"💎 Подписка: {subscription_status}\n"
@@ -249,7 +256,7 @@ def show_main_menu_from_query(query, context: CallbackContext):
             reply_markup=reply_markup
         )
 
-def show_program_info(query):
+async def show_program_info(query):
     """Показать информацию о программе"""
     info_text = (
         f"🤖 {PROGRAM_INFO['name']} v{PROGRAM_INFO['version']}\n"
@@ -266,16 +273,16 @@ def show_program_info(query):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(info_text, reply_markup=reply_markup, parse_mode='HTML')
+        await query.edit_message_text(info_text, reply_markup=reply_markup, parse_mode='HTML')
     except:
-        context.bot.send_message(
+        await query.get_bot().send_message(
             chat_id=query.message.chat_id,
             text=info_text,
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
 
-def show_info(query):
+async def show_info(query):
     """Показать информацию о программе"""
     info_text = (
         f"🤖 {PROGRAM_INFO['name']} v{PROGRAM_INFO['version']}\n"
@@ -292,16 +299,16 @@ def show_info(query):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(info_text, reply_markup=reply_markup, parse_mode='HTML')
+        await query.edit_message_text(info_text, reply_markup=reply_markup, parse_mode='HTML')
     except:
-        context.bot.send_message(
+        await query.get_bot().send_message(
             chat_id=query.message.chat_id,
             text=info_text,
             reply_markup=reply_markup,
             parse_mode='HTML'
         )
 
-def show_token_management(query):
+async def show_token_management(query):
     """Показать меню управления токеном"""
     keyboard = [
         [InlineKeyboardButton("🔄 Проверить токен", callback_data="check_token")],
@@ -311,28 +318,28 @@ def show_token_management(query):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "⚙️ Управление токеном:",
             reply_markup=reply_markup
         )
     except:
-        context.bot.send_message(
+        await query.get_bot().send_message(
             chat_id=query.message.chat_id,
             text="⚙️ Управление токеном:",
             reply_markup=reply_markup
         )
 
-def show_my_music(query, context: CallbackContext):
+async def show_my_music(query, context: CallbackContext):
     """Показать мою музыку"""
-    result = vk_manager.get_my_audio_list()
+    result = await run_blocking(vk_manager.get_my_audio_list)
     if not result["success"]:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -342,12 +349,12 @@ def show_my_music(query, context: CallbackContext):
     audio_list = result["audio_list"]
     if not audio_list:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "🎵 У вас нет аудиозаписей",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="🎵 У вас нет аудиозаписей",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -362,25 +369,25 @@ def show_my_music(query, context: CallbackContext):
     keyboard = create_audio_keyboard(audio_list, prefix="play_audio")
 
     try:
-        query.edit_message_text(text, reply_markup=keyboard)
+        await query.edit_message_text(text, reply_markup=keyboard)
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=keyboard
         )
 
-def show_friends_list(query, context: CallbackContext):
+async def show_friends_list(query, context: CallbackContext):
     """Показать список друзей"""
-    result = vk_manager.get_friends_list()
+    result = await run_blocking(vk_manager.get_friends_list)
     if not result["success"]:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -390,12 +397,12 @@ def show_friends_list(query, context: CallbackContext):
     friends = result["friends"]
     if not friends:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "👥 У вас нет друзей или доступ ограничен",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="👥 У вас нет друзей или доступ ограничен",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -413,28 +420,28 @@ def show_friends_list(query, context: CallbackContext):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "👥 Выберите друга для просмотра музыки:",
             reply_markup=reply_markup
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="👥 Выберите друга для просмотра музыки:",
             reply_markup=reply_markup
         )
 
-def show_groups_list(query, context: CallbackContext):
+async def show_groups_list(query, context: CallbackContext):
     """Показать список групп"""
-    result = vk_manager.get_groups_list()
+    result = await run_blocking(vk_manager.get_groups_list)
     if not result["success"]:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -444,12 +451,12 @@ def show_groups_list(query, context: CallbackContext):
     groups = result["groups"]
     if not groups:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "👥 У вас нет групп или доступ ограничен",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="👥 У вас нет групп или доступ ограничен",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -466,28 +473,28 @@ def show_groups_list(query, context: CallbackContext):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "👥 Выберите группу для просмотра музыки:",
             reply_markup=reply_markup
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="👥 Выберите группу для просмотра музыки:",
             reply_markup=reply_markup
         )
 
-def show_playlists(query, context: CallbackContext):
+async def show_playlists(query, context: CallbackContext):
     """Показать список плейлистов"""
-    result = vk_manager.get_playlists()
+    result = await run_blocking(vk_manager.get_playlists)
     if not result["success"]:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -497,12 +504,12 @@ def show_playlists(query, context: CallbackContext):
     playlists = result["playlists"]
     if not playlists:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "📋 У вас нет плейлистов",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="📋 У вас нет плейлистов",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -520,28 +527,28 @@ def show_playlists(query, context: CallbackContext):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "📋 Выберите плейлист:",
             reply_markup=reply_markup
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="📋 Выберите плейлист:",
             reply_markup=reply_markup
         )
 
-def show_recommendations(query, context: CallbackContext):
+async def show_recommendations(query, context: CallbackContext):
     """Показать рекомендации"""
-    result = vk_manager.get_recommendations()
+    result = await run_blocking(vk_manager.get_recommendations)
     if not result["success"]:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -551,12 +558,12 @@ def show_recommendations(query, context: CallbackContext):
     audio_list = result["audio_list"]
     if not audio_list:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "🎵 Нет рекомендаций",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="🎵 Нет рекомендаций",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -571,25 +578,25 @@ def show_recommendations(query, context: CallbackContext):
     keyboard = create_audio_keyboard(audio_list, prefix="play_audio")
 
     try:
-        query.edit_message_text(text, reply_markup=keyboard)
+        await query.edit_message_text(text, reply_markup=keyboard)
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=keyboard
         )
 
-def show_algorithmic_mixes(query, context: CallbackContext):
+async def show_algorithmic_mixes(query, context: CallbackContext):
     """Показать алгоритмические подборки"""
-    result = vk_manager.get_recommendations()
+    result = await run_blocking(vk_manager.get_recommendations)
     if not result["success"]:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Ошибка: {result.get('error')}",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -599,12 +606,12 @@ def show_algorithmic_mixes(query, context: CallbackContext):
     audio_list = result["audio_list"]
     if not audio_list:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "🤖 Нет алгоритмических подборок",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="🤖 Нет алгоритмических подборок",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -619,27 +626,27 @@ def show_algorithmic_mixes(query, context: CallbackContext):
     keyboard = create_audio_keyboard(audio_list, prefix="play_audio")
 
     try:
-        query.edit_message_text(text, reply_markup=keyboard)
+        await query.edit_message_text(text, reply_markup=keyboard)
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=keyboard
         )
 
-def handle_search_request(query, context: CallbackContext):
+async def handle_search_request(query, context: CallbackContext):
     """Обработчик запроса поиска музыки с проверкой бесплатных запросов"""
     user_id = query.from_user.id
 
     # Проверяем подписку
     if subscription_manager.is_subscribed(user_id):
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "🔍 Введите поисковый запрос:",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="🔍 Введите поисковый запрос:",
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
@@ -663,21 +670,21 @@ def handle_search_request(query, context: CallbackContext):
         )
 
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 text,
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=text,
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
             )
     else:
         # Нет бесплатных запросов - предлагаем подписку
-        show_subscription_required_with_free_info(query, context, requests_info)
+        await show_subscription_required_with_free_info(query, context, requests_info)
 
-def handle_search_query(update: Update, context: CallbackContext):
+async def handle_search_query(update: Update, context: CallbackContext):
     """Обработчик ввода поискового запроса с учетом бесплатных запросов"""
     if not context.user_data.get('awaiting_search_query'):
         return
@@ -687,7 +694,7 @@ def handle_search_query(update: Update, context: CallbackContext):
     # Проверяем подписку
     if subscription_manager.is_subscribed(user_id):
         # Пользователь с подпиской - обычная обработка
-        process_search_with_subscription(update, context)
+        await process_search_with_subscription(update, context)
         context.user_data['awaiting_search_query'] = False
         return
 
@@ -696,12 +703,12 @@ def handle_search_query(update: Update, context: CallbackContext):
 
     if requests_info['remaining'] > 0:
         # Используем один бесплатный запрос
-        updated_status = subscription_manager.use_free_request(user_id)
+        updated_status = await run_blocking(subscription_manager.use_free_request, user_id)
 
         # Показываем пользователю, что запрос использован
         remaining = updated_status["remaining"]
 
-        message = update.message.reply_text(
+        message = await update.message.reply_text(
             f"🔍 Ищу музыку...\n"
             f"📊 Использовано {FREE_REQUESTS_CONFIG['max_free_requests'] - remaining}/"
             f"{FREE_REQUESTS_CONFIG['max_free_requests']} бесплатных запросов"
@@ -709,7 +716,7 @@ def handle_search_query(update: Update, context: CallbackContext):
 
         # Выполняем поиск
         search_query = update.message.text.strip()
-        result = vk_manager.search_audio(search_query)
+        result = await run_blocking(vk_manager.search_audio, search_query)
 
         if result["success"]:
             audio_list = result.get("results", [])
@@ -726,24 +733,25 @@ def handle_search_query(update: Update, context: CallbackContext):
                 # Добавляем кнопку для подписки если мало запросов
                 keyboard = create_audio_keyboard(audio_list, prefix="play_audio")
 
+                # Разметка клавиатуры неизменяемая, поэтому кнопка добавляется в новую
                 if remaining <= 3 and remaining > 0:
-                    keyboard.inline_keyboard.append([
+                    keyboard = InlineKeyboardMarkup(list(keyboard.inline_keyboard) + [[
                         InlineKeyboardButton(
                             f"💎 Подписка (осталось {remaining} запросов)",
                             callback_data="subscribe"
                         )
-                    ])
+                    ]])
                 elif remaining == 0:
-                    keyboard.inline_keyboard.append([
+                    keyboard = InlineKeyboardMarkup(list(keyboard.inline_keyboard) + [[
                         InlineKeyboardButton(
                             "💎 Запросы закончились - оформите подписку",
                             callback_data="subscribe"
                         )
-                    ])
+                    ]])
 
-                message.edit_text(text, reply_markup=keyboard)
+                await message.edit_text(text, reply_markup=keyboard)
             else:
-                message.edit_text(
+                await message.edit_text(
                     f"🎵 Ничего не найдено по запросу: '{search_query}'\n\n"
                     f"📊 Осталось бесплатных запросов: {remaining}",
                     reply_markup=InlineKeyboardMarkup([
@@ -752,7 +760,7 @@ def handle_search_query(update: Update, context: CallbackContext):
                     ])
                 )
         else:
-            message.edit_text(
+            await message.edit_text(
                 f"❌ Ошибка поиска: {result.get('error')}\n\n"
                 f"📊 Осталось бесплатных запросов: {remaining}",
                 reply_markup=InlineKeyboardMarkup([
@@ -762,21 +770,21 @@ def handle_search_query(update: Update, context: CallbackContext):
             )
     else:
         # Нет бесплатных запросов
-        show_subscription_required_with_free_info_message(update.message, context, requests_info)
+        await show_subscription_required_with_free_info_message(update.message, context, requests_info)
 
     context.user_data['awaiting_search_query'] = False
 
-def process_search_with_subscription(update: Update, context: CallbackContext):
+async def process_search_with_subscription(update: Update, context: CallbackContext):
     """Обработка поиска для пользователей с подпиской"""
     search_query = update.message.text.strip()
 
-    message = update.message.reply_text("🔍 Ищу музыку...")
+    message = await update.message.reply_text("🔍 Ищу музыку...")
 
     # Выполняем поиск
-    result = vk_manager.search_audio(search_query)
+    result = await run_blocking(vk_manager.search_audio, search_query)
 
     if not result["success"]:
-        message.edit_text(
+        await message.edit_text(
             f"❌ Ошибка поиска: {result.get('error')}",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]])
         )
@@ -784,7 +792,7 @@ def process_search_with_subscription(update: Update, context: CallbackContext):
 
     audio_list = result.get("results", [])
     if not audio_list:
-        message.edit_text(
+        await message.edit_text(
             f"🎵 Ничего не найдено по запросу: '{search_query}'",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="search_music")]])
         )
@@ -800,13 +808,13 @@ def process_search_with_subscription(update: Update, context: CallbackContext):
 
     keyboard = create_audio_keyboard(audio_list, prefix="play_audio")
 
-    message.edit_text(text, reply_markup=keyboard, parse_mode='HTML')
+    await message.edit_text(text, reply_markup=keyboard, parse_mode='HTML')
 
-def play_audio_track(query, context: CallbackContext, audio_index):
+async def play_audio_track(query, context: CallbackContext, audio_index):
     """Воспроизвести аудиозапись"""
     audio_list = context.user_data.get('current_audio_list', [])
     if not audio_list or audio_index >= len(audio_list):
-        query.answer("❌ Аудиозапись не найдена")
+        await query.answer("❌ Аудиозапись не найдена")
         return
 
     track = audio_list[audio_index]
@@ -815,38 +823,71 @@ def play_audio_track(query, context: CallbackContext, audio_index):
     url = track.get('url')
 
     if not url:
-        query.answer("❌ Невозможно воспроизвести (отсутствует URL)")
+        await query.answer("❌ Невозможно воспроизвести (отсутствует URL)")
         return
 
     # Показываем сообщение о загрузке
     loading_message = None
     try:
-        loading_message = query.edit_message_text(f"📥 Загружаю: {artist} - {title}...")
+        loading_message = await query.edit_message_text(f"📥 Загружаю: {artist} - {title}...")
     except:
-        loading_message = context.bot.send_message(
+        loading_message = await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=f"📥 Загружаю: {artist} - {title}..."
         )
 
+    # Новая загрузка отменяет предыдущую загрузку пользователя
+    user_id = query.from_user.id
+    cancel_token = download_manager.start(user_id)
+
+    progress_message = ProgressMessage(loading_message, asyncio.get_running_loop())
+
+    def report_progress(progress):
+        # Вызывается из потока загрузки не чаще progress_interval: редактирование
+        # сообщения планируется в цикле событий, загрузка его не ждет
+        if cancel_token.is_set() or not loading_message:
+            return
+        progress_message.update(get_download_progress_text(artist, title, progress))
+
     # Создаем временный файл
     with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as tmp_file:
         temp_filename = tmp_file.name
 
     try:
-        # Скачиваем аудио
-        logger.info(f"Скачиваю аудио: {url[:50]}...")
-        success = vk_manager.download_audio(url, temp_filename)
-        
+        # Пережатый ранее трек берем из кэша без повторной загрузки
+        upload_filename = await run_blocking(audio_transcoder.get_cached_path, track)
+        if upload_filename:
+            logger.info(f"Пережатый трек найден в кэше: {upload_filename}")
+            success = True
+        else:
+            # Скачиваем аудио
+            logger.info(f"Скачиваю аудио: {url[:50]}...")
+            try:
+                success = await run_blocking(
+                    vk_manager.download_audio, url, temp_filename,
+                    cancel_event=cancel_token,
+                    progress=DownloadProgress(on_update=report_progress)
+                )
+            finally:
+                # Следующие правки сообщения о загрузке идут только после последнего прогресса
+                await progress_message.close()
+            upload_filename = temp_filename
+
+        # Пользователь ушел с экрана загрузки - ничего не отправляем
+        if cancel_token.is_set():
+            logger.info(f"Загрузка отменена: {artist} - {title}")
+            return
+
         if not success:
             logger.error(f"Ошибка загрузки аудио: {artist} - {title}")
             error_text = f"❌ Ошибка загрузки: {artist} - {title}\n\nПопробуйте другой трек."
             try:
-                query.edit_message_text(
+                await query.edit_message_text(
                     error_text,
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{context.user_data.get('audio_source', 'main_menu')}")]])
                 )
             except:
-                context.bot.send_message(
+                await context.bot.send_message(
                     chat_id=query.message.chat_id,
                     text=error_text,
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{context.user_data.get('audio_source', 'main_menu')}")]])
@@ -854,64 +895,113 @@ def play_audio_track(query, context: CallbackContext, audio_index):
             return
 
         # Проверяем размер файла
-        file_size = os.path.getsize(temp_filename)
+        file_size = os.path.getsize(upload_filename)
         logger.info(f"Файл скачан, размер: {file_size} байт")
         
         if file_size == 0:
             logger.error("Файл пустой")
             error_text = f"❌ Файл пустой: {artist} - {title}"
             try:
-                query.edit_message_text(
+                await query.edit_message_text(
                     error_text,
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{context.user_data.get('audio_source', 'main_menu')}")]])
                 )
             except:
-                context.bot.send_message(
+                await context.bot.send_message(
                     chat_id=query.message.chat_id,
                     text=error_text,
                     reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{context.user_data.get('audio_source', 'main_menu')}")]])
                 )
             return
 
-        # Отправляем аудиофайл
-        with open(temp_filename, 'rb') as audio_file:
-            audio_source = context.user_data.get('audio_source', 'main_menu')
-            
-            # Отправляем аудио
-            context.bot.send_audio(
-                chat_id=query.message.chat_id,
-                audio=audio_file,
-                title=title,
-                performer=artist,
-                caption=f"🎵 {artist} - {title}",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{audio_source}")]])
-            )
-            
-            # Удаляем сообщение о загрузке
+        # Большие и длинные треки пережимаем до целевого битрейта
+        if upload_filename == temp_filename and audio_transcoder.needs_transcoding(file_size, track.get('duration', 0)):
             try:
-                if loading_message:
-                    context.bot.delete_message(
-                        chat_id=query.message.chat_id,
-                        message_id=loading_message.message_id
-                    )
+                await loading_message.edit_text(f"🎚 Сжимаю: {artist} - {title}...")
             except Exception as e:
-                logger.error(f"Ошибка удаления сообщения о загрузке: {e}")
+                logger.debug(f"Ошибка обновления сообщения о загрузке: {e}")
+
+            transcoded_filename = await run_blocking(
+                audio_transcoder.transcode, temp_filename, track, cancel_event=cancel_token
+            )
+            if cancel_token.is_set():
+                logger.info(f"Пережатие отменено: {artist} - {title}")
+                return
+            if transcoded_filename:
+                upload_filename = transcoded_filename
+                file_size = os.path.getsize(upload_filename)
+                logger.info(f"Размер после пережатия: {file_size} байт")
+
+        upload_limit = get_upload_limit_bytes()
+        if file_size > upload_limit:
+            logger.error(f"Файл превышает лимит отправки: {file_size} > {upload_limit}")
+            error_text = (
+                f"❌ Файл слишком большой: {artist} - {title}\n\n"
+                f"Размер {file_size / (1024 * 1024):.1f} МБ, "
+                f"лимит {upload_limit // (1024 * 1024)} МБ."
+            )
+            try:
+                await query.edit_message_text(
+                    error_text,
+                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{context.user_data.get('audio_source', 'main_menu')}")]])
+                )
+            except:
+                await context.bot.send_message(
+                    chat_id=query.message.chat_id,
+                    text=error_text,
+                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{context.user_data.get('audio_source', 'main_menu')}")]])
+                )
+            return
+
+        if cancel_token.is_set():
+            logger.info(f"Отправка отменена: {artist} - {title}")
+            return
+
+        # Отправляем аудиофайл (через локальный сервер Bot API - по пути к файлу)
+        audio_file = await load_upload_file(upload_filename)
+        audio_source = context.user_data.get('audio_source', 'main_menu')
+
+        # Отправляем аудио; отмена прерывает и уже начатую отправку
+        sent = await run_cancellable(context.bot.send_audio(
+            chat_id=query.message.chat_id,
+            audio=audio_file,
+            filename=os.path.basename(upload_filename),
+            title=title,
+            performer=artist,
+            caption=f"🎵 {artist} - {title}",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{audio_source}")]])
+        ), cancel_token)
+        if sent is None:
+            logger.info(f"Отправка прервана: {artist} - {title}")
+            return
+
+        # Удаляем сообщение о загрузке
+        try:
+            if loading_message:
+                await context.bot.delete_message(
+                    chat_id=query.message.chat_id,
+                    message_id=loading_message.message_id
+                )
+        except Exception as e:
+            logger.error(f"Ошибка удаления сообщения о загрузке: {e}")
 
     except Exception as e:
         logger.error(f"Ошибка при отправке аудио: {e}")
         error_text = f"❌ Ошибка отправки аудио: {str(e)[:100]}"
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 error_text,
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{context.user_data.get('audio_source', 'main_menu')}")]])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=error_text,
                 reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад к списку", callback_data=f"{context.user_data.get('audio_source', 'main_menu')}")]])
             )
     finally:
+        download_manager.finish(user_id, cancel_token)
+
         # Удаляем временный файл
         try:
             if os.path.exists(temp_filename):
@@ -921,7 +1011,7 @@ def play_audio_track(query, context: CallbackContext, audio_index):
             logger.error(f"Ошибка удаления временного файла: {e}")
 
 # Функции для работы с подписками
-def show_subscription_menu(message, context: CallbackContext):
+async def show_subscription_menu(message, context: CallbackContext):
     """Показать меню подписки"""
     keyboard = [
         [InlineKeyboardButton("💳 Оформить подписку", callback_data="subscribe")],
@@ -930,19 +1020,19 @@ def show_subscription_menu(message, context: CallbackContext):
         [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
     ]
 
-    message.reply_text(
+    await message.reply_text(
         "💎 <b>Управление подписки</b>\n\n"
         "Здесь вы можете оформить или продлить подписку.",
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
 
-def show_subscription_required(query, context: CallbackContext):
+async def show_subscription_required(query, context: CallbackContext):
     """Показать сообщение о необходимости подписки"""
     user_id = query.from_user.id
 
     if subscription_manager.is_subscribed(user_id):
-        query.answer("✅ У вас уже есть активная подписка", show_alert=True)
+        await query.answer("✅ У вас уже есть активная подписка", show_alert=True)
         return
 
     # Получаем информацию о запросах
@@ -967,20 +1057,20 @@ def show_subscription_required(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def show_subscription_required_with_free_info(query, context: CallbackContext, requests_info):
+async def show_subscription_required_with_free_info(query, context: CallbackContext, requests_info):
     """Показать сообщение о необходимости подписки с информацией о бесплатных запросах"""
     used = requests_info.get("used", 0)
 
@@ -1002,20 +1092,20 @@ def show_subscription_required_with_free_info(query, context: CallbackContext, r
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def show_subscription_required_with_free_info_message(message, context: CallbackContext, requests_info):
+async def show_subscription_required_with_free_info_message(message, context: CallbackContext, requests_info):
     """Показать сообщение о необходимости подписки для обычного сообщения"""
     used = requests_info.get("used", 0)
 
@@ -1036,13 +1126,13 @@ def show_subscription_required_with_free_info_message(message, context: Callback
         [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
     ]
 
-    message.reply_text(
+    await message.reply_text(
         text,
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
 
-def check_user_subscription(query, context: CallbackContext):
+async def check_user_subscription(query, context: CallbackContext):
     """Проверить статус подписки пользователя"""
     user_id = query.from_user.id
 
@@ -1077,20 +1167,20 @@ def check_user_subscription(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def show_subscription_info(query, context: CallbackContext):
+async def show_subscription_info(query, context: CallbackContext):
     """Показать информацию о подписке"""
     text = (
         "💎 <b>Информация о подписке</b>\n\n"
@@ -1119,20 +1209,20 @@ def show_subscription_info(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def show_my_requests_info(query, context: CallbackContext):
+async def show_my_requests_info(query, context: CallbackContext):
     """Показать информацию о моих запросах"""
     user_id = query.from_user.id
     requests_info = subscription_manager.get_free_requests_info(user_id)
@@ -1174,13 +1264,13 @@ def show_my_requests_info(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
@@ -1188,7 +1278,7 @@ def show_my_requests_info(query, context: CallbackContext):
         )
 
 # Дополнительные функции для работы с подписками
-def show_payment_methods(query, context: CallbackContext):
+async def show_payment_methods(query, context: CallbackContext):
     """Показать методы оплаты для подписки"""
     text = "💳 <b>Выберите способ оплаты:</b>\n\n"
 
@@ -1209,34 +1299,34 @@ def show_payment_methods(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def show_stars_subscription(query, context: CallbackContext):
+async def show_stars_subscription(query, context: CallbackContext):
     """Показать варианты подписки за звезды"""
     prices = subscription_manager.get_prices_stars()
     durations = subscription_manager.get_subscription_durations()
 
     if not prices:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "❌ Извините, оплата звездами временно недоступна.",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton("🔙 Назад", callback_data="subscribe")]
                 ])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="❌ Извините, оплата звездами временно недоступна.",
                 reply_markup=InlineKeyboardMarkup([
@@ -1256,20 +1346,20 @@ def show_stars_subscription(query, context: CallbackContext):
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="subscribe")])
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def show_bank_subscription(query, context: CallbackContext):
+async def show_bank_subscription(query, context: CallbackContext):
     """Показать варианты подписки за банковский перевод"""
     prices = subscription_manager.get_prices_bank()
     durations = subscription_manager.get_subscription_durations()
@@ -1277,14 +1367,14 @@ def show_bank_subscription(query, context: CallbackContext):
 
     if not prices:
         try:
-            query.edit_message_text(
+            await query.edit_message_text(
                 "❌ Извините, оплата банковской картой временно недоступна.",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton("🔙 Назад", callback_data="subscribe")]
                 ])
             )
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text="❌ Извините, оплата банковской картой временно недоступна.",
                 reply_markup=InlineKeyboardMarkup([
@@ -1311,26 +1401,26 @@ def show_bank_subscription(query, context: CallbackContext):
     keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="subscribe")])
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def process_stars_payment(query, context: CallbackContext, period):
+async def process_stars_payment(query, context: CallbackContext, period):
     """Обработка выбора периода для оплаты звездами"""
     prices = subscription_manager.get_prices_stars()
     price = prices.get(period)
 
     if not price:
-        query.answer("❌ Ошибка: неверный период подписки", show_alert=True)
+        await query.answer("❌ Ошибка: неверный период подписки", show_alert=True)
         return
 
     durations = subscription_manager.get_subscription_durations()
@@ -1377,26 +1467,26 @@ def process_stars_payment(query, context: CallbackContext, period):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def process_bank_payment(query, context: CallbackContext, period):
+async def process_bank_payment(query, context: CallbackContext, period):
     """Обработка выбора периода для оплаты банковским переводом"""
     prices = subscription_manager.get_prices_bank()
     price = prices.get(period)
 
     if not price:
-        query.answer("❌ Ошибка: неверный период подписки", show_alert=True)
+        await query.answer("❌ Ошибка: неверный период подписки", show_alert=True)
         return
 
     durations = subscription_manager.get_subscription_durations()
@@ -1454,23 +1544,23 @@ def process_bank_payment(query, context: CallbackContext, period):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def handle_screenshot_submission(update: Update, context: CallbackContext):
+async def handle_screenshot_submission(update: Update, context: CallbackContext):
     """Обработчик отправки скриншота оплаты"""
     if not update.message.photo:
-        update.message.reply_text(
+        await update.message.reply_text(
             "❌ Пожалуйста, отправьте скриншот (фото) чека об оплате.",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("✖️ Отмена", callback_data="pay_bank")]
@@ -1480,7 +1570,7 @@ def handle_screenshot_submission(update: Update, context: CallbackContext):
 
     # Проверяем, есть ли ожидающий платеж
     if 'pending_bank_payment' not in context.user_data:
-        update.message.reply_text(
+        await update.message.reply_text(
             "❌ Нет активного запроса на оплату. Начните сначала.",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("💳 Оформить подписку", callback_data="subscribe")]
@@ -1492,7 +1582,8 @@ def handle_screenshot_submission(update: Update, context: CallbackContext):
     screenshot = update.message.photo[-1]
 
     # Добавляем платеж в ожидание
-    payment_id = subscription_manager.add_pending_payment(
+    payment_id = await run_blocking(
+        subscription_manager.add_pending_payment,
         user_id=payment_data['user_id'],
         period=payment_data['period'],
         amount=payment_data['price'],
@@ -1500,33 +1591,34 @@ def handle_screenshot_submission(update: Update, context: CallbackContext):
         username=payment_data['username']
     )
 
-    # Отправляем уведомление админам
-    for admin_id in SUBSCRIPTION_CONFIG["admin_id"]:
-        try:
-            context.bot.send_photo(
-                chat_id=admin_id,
-                photo=screenshot.file_id,
-                caption=(
-                    f"📸 <b>Новый платеж на проверку</b>\n\n"
-                    f"🧾 <b>ID платежа:</b> <code>{payment_id}</code>\n"
-                    f"👤 <b>Пользователь:</b> {payment_data['user_id']}\n"
-                    f"📝 <b>Username:</b> @{payment_data['username']}\n"
-                    f"⏳ <b>Период:</b> {payment_data['period_text']}\n"
-                    f"💰 <b>Сумма:</b> {payment_data['price']}₽\n"
-                    f"📅 <b>Дней:</b> {payment_data['days']}\n\n"
-                    f"Для подтверждения используйте команду:\n"
-                    f"<code>/confirm {payment_id}</code>"
-                ),
-                parse_mode='HTML',
-                reply_markup=InlineKeyboardMarkup([
-                    [
-                        InlineKeyboardButton("✅ Подтвердить", callback_data=f"admin_confirm_{payment_id}"),
-                        InlineKeyboardButton("❌ Отклонить", callback_data=f"admin_reject_{payment_id}")
-                    ]
-                ])
-            )
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+    # Уведомление админам уходит из очереди в фоне: пользователь не ждет доставки,
+    # а при всплеске платежей админы получают одну сводку вместо десятков сообщений
+    admin_notifier.notify(context.bot, {
+        "method": "send_photo",
+        "photo": screenshot.file_id,
+        "caption": (
+            f"📸 <b>Новый платеж на проверку</b>\n\n"
+            f"🧾 <b>ID платежа:</b> <code>{payment_id}</code>\n"
+            f"👤 <b>Пользователь:</b> {payment_data['user_id']}\n"
+            f"📝 <b>Username:</b> @{payment_data['username']}\n"
+            f"⏳ <b>Период:</b> {payment_data['period_text']}\n"
+            f"💰 <b>Сумма:</b> {payment_data['price']}₽\n"
+            f"📅 <b>Дней:</b> {payment_data['days']}\n\n"
+            f"Для подтверждения используйте команду:\n"
+            f"<code>/confirm {payment_id}</code>"
+        ),
+        "parse_mode": 'HTML',
+        "reply_markup": InlineKeyboardMarkup([
+            [
+                InlineKeyboardButton("✅ Подтвердить", callback_data=f"admin_confirm_{payment_id}"),
+                InlineKeyboardButton("❌ Отклонить", callback_data=f"admin_reject_{payment_id}")
+            ]
+        ]),
+        "summary": (
+            f"🧾 <code>{payment_id}</code> - {payment_data['user_id']} "
+            f"(@{payment_data['username']}), {payment_data['period_text']}, {payment_data['price']}₽"
+        ),
+    })
 
     # Отправляем подтверждение пользователю
     text = (
@@ -1544,7 +1636,7 @@ def handle_screenshot_submission(update: Update, context: CallbackContext):
         [InlineKeyboardButton("📋 Проверить статус", callback_data="check_subscription")]
     ]
 
-    update.message.reply_text(
+    await update.message.reply_text(
         text,
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
@@ -1553,82 +1645,112 @@ def handle_screenshot_submission(update: Update, context: CallbackContext):
     # Очищаем данные о платеже
     context.user_data.pop('pending_bank_payment', None)
 
-def handle_admin_command(update: Update, context: CallbackContext):
+async def handle_admin_command(update: Update, context: CallbackContext):
     """Обработчик админских команд"""
     user_id = update.message.from_user.id
     if user_id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        update.message.reply_text("❌ У вас нет доступа к админ-командам.")
+        await update.message.reply_text("❌ У вас нет доступа к админ-командам.")
         return
 
     if not context.args:
-        show_admin_menu(update.message)
+        await show_admin_menu(update.message)
         return
 
     command = context.args[0].lower()
 
     if command == "stats":
-        show_admin_stats(update.message)
+        await show_admin_stats(update.message)
 
     elif command == "users":
-        show_admin_users(update.message, context)
+        await show_admin_users(update.message, context)
 
     elif command == "pending":
-        show_admin_pending(update.message, context)
+        if len(context.args) < 2:
+            await show_admin_pending(update.message, context)
+            return
+        try:
+            target_user_id = int(context.args[1])
+            await show_admin_user_pending(update.message, target_user_id)
+        except ValueError:
+            await update.message.reply_text("❌ Ошибка: USER_ID должен быть числом")
+
+    elif command == "archive":
+        if len(context.args) < 2:
+            await update.message.reply_text("Использование: /admin archive USER_ID")
+            return
+        try:
+            target_user_id = int(context.args[1])
+            await show_admin_archived_user(update.message, target_user_id)
+        except ValueError:
+            await update.message.reply_text("❌ Ошибка: USER_ID должен быть числом")
+
+    elif command == "retention":
+        # Очистка проходит по всем записям, поэтому выполняется в пуле потоков
+        report = await run_blocking(subscription_manager.apply_retention)
+        await update.message.reply_text(get_retention_report_text(report), parse_mode='HTML')
 
     elif command == "confirm":
         if len(context.args) < 2:
-            update.message.reply_text("Использование: /confirm PAYMENT_ID")
+            await update.message.reply_text("Использование: /confirm PAYMENT_ID")
             return
         payment_id = context.args[1]
-        confirm_payment_admin(update.message, context, payment_id)
+        await confirm_payment_admin(update.message, context, payment_id)
 
     elif command == "reject":
         if len(context.args) < 2:
-            update.message.reply_text("Использование: /reject PAYMENT_ID")
+            await update.message.reply_text("Использование: /reject PAYMENT_ID")
             return
         payment_id = context.args[1]
-        reject_payment_admin(update.message, context, payment_id)
+        await reject_payment_admin(update.message, context, payment_id)
 
     elif command == "add":
         if len(context.args) < 3:
-            update.message.reply_text("Использование: /add USER_ID DAYS")
+            await update.message.reply_text("Использование: /add USER_ID DAYS")
             return
         try:
             target_user_id = int(context.args[1])
             days = int(context.args[2])
-            add_subscription_admin(update.message, target_user_id, days)
+            await add_subscription_admin(update.message, target_user_id, days)
         except ValueError:
-            update.message.reply_text("❌ Ошибка: USER_ID и DAYS должны быть числами")
+            await update.message.reply_text("❌ Ошибка: USER_ID и DAYS должны быть числами")
 
     elif command == "prices":
-        show_admin_prices(update.message)
+        await show_admin_prices(update.message)
 
     elif command == "reset_requests":
         if len(context.args) < 2:
-            update.message.reply_text("Использование: /reset_requests USER_ID")
+            await update.message.reply_text("Использование: /reset_requests USER_ID или /reset_requests all")
+            return
+        if context.args[1] == "all":
+            await run_blocking(subscription_manager.reset_all_free_requests)
+            await update.message.reply_text("✅ Запросы сброшены всем пользователям")
             return
         try:
             target_user_id = int(context.args[1])
-            subscription_manager.reset_free_requests(target_user_id)
-            update.message.reply_text(f"✅ Запросы сброшены для пользователя {target_user_id}")
+            await run_blocking(subscription_manager.reset_free_requests, target_user_id)
+            await update.message.reply_text(f"✅ Запросы сброшены для пользователя {target_user_id}")
         except ValueError:
-            update.message.reply_text("❌ Ошибка: USER_ID должен быть числом")
+            await update.message.reply_text("❌ Ошибка: USER_ID должен быть числом")
 
     else:
-        update.message.reply_text(
+        await update.message.reply_text(
             "🔐 <b>Доступные команды:</b>\n\n"
             "/admin stats - Статистика\n"
             "/admin users - Список пользователей\n"
             "/admin pending - Ожидающие платежи\n"
+            "/admin pending USER_ID - Ожидающие платежи пользователя\n"
+            "/admin archive USER_ID - Подписка из архива\n"
+            "/admin retention - Очистить устаревшие данные\n"
             "/admin confirm ID - Подтвердить платеж\n"
             "/admin reject ID - Отклонить платеж\n"
             "/admin add USER_ID DAYS - Добавить подписку\n"
             "/admin prices - Управление ценами\n"
-            "/admin reset_requests USER_ID - Сбросить запросы",
+            "/admin reset_requests USER_ID - Сбросить запросы\n"
+            "/admin reset_requests all - Сбросить запросы всем",
             parse_mode='HTML'
         )
 
-def show_admin_menu(message):
+async def show_admin_menu(message):
     """Показать админ-меню"""
     keyboard = [
         [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
@@ -1639,14 +1761,14 @@ def show_admin_menu(message):
         [InlineKeyboardButton("🔄 Сброс запросов", callback_data="admin_reset_requests")]
     ]
 
-    message.reply_text(
+    await message.reply_text(
         "🔐 <b>Админ-панель</b>\n\n"
         "Выберите действие:",
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
 
-def show_admin_stats(message):
+async def show_admin_stats(message):
     """Показать статистику админу"""
     stats = subscription_manager.get_statistics()
 
@@ -1661,157 +1783,257 @@ def show_admin_stats(message):
         f"💎 Доход (приблизительно): <b>{stats['active'] * 500}₽/месяц</b>"
     )
 
-    message.reply_text(text, parse_mode='HTML')
+    downloads = download_metrics.snapshot()
+    text += (
+        f"\n\n📥 Загрузок: <b>{downloads['downloads']}</b> "
+        f"(ошибок {downloads['failed']}, отменено {downloads['cancelled']})\n"
+        f"⚡ Средняя скорость: <b>{downloads['avg_rate'] / 1024:.0f} КБ/с</b>, "
+        f"пиковая: <b>{downloads['peak_rate'] / 1024:.0f} КБ/с</b>"
+    )
 
-def show_admin_users(message, context: CallbackContext):
-    """Показать список пользователей админу"""
-    users = subscription_manager.get_all_users()
+    # Самые затратные callback-маршруты по суммарному времени обработки
+    routes = callback_router.snapshot()[:5]
+    if routes:
+        text += "\n\n⏱ <b>Callback-маршруты:</b>\n"
+        for row in routes:
+            text += (
+                f"<code>{row['route']}</code>: {row['count']} вызовов, "
+                f"ср. {row['avg_ms']:.0f} мс, макс. {row['max_ms']:.0f} мс, ошибок {row['errors']}\n"
+            )
 
-    if not users:
-        message.reply_text("👥 <b>Нет пользователей</b>", parse_mode='HTML')
-        return
+    await message.reply_text(text, parse_mode='HTML')
+
+def get_admin_users_view(status="all", cursor=None):
+    """Текст и клавиатура страницы списка пользователей с фильтром"""
+    rows, next_cursor = subscription_manager.get_users_page(status, cursor, limit=20)
+    summary = subscription_manager.get_users_summary()
+    max_free = FREE_REQUESTS_CONFIG["max_free_requests"]
+    titles = {"all": "Все", "active": "Активные", "expired": "Истекшие", "free": "Бесплатные"}
+
+    text = f"👥 <b>Список пользователей: {titles[status].lower()}</b>\n\n"
+    if not rows:
+        text += "Нет пользователей\n"
+
+    now = time.time()
+    for row in rows:
+        until = row["subscription_until"]
+        if until is None:
+            status_icon, time_info = "⚪", "без подписки"
+        elif until >= now:
+            status_icon, time_info = "🟢", f"{int(until - now) // 86400}д"
+        else:
+            status_icon, time_info = "🔴", "истекла"
+        remaining = max(0, max_free - row["free_used"])
 
-    text = "👥 <b>Список пользователей:</b>\n\n"
-    now = datetime.now()
+        text += f"{status_icon} ID: <code>{row['user_id']}</code> ({time_info}) 📊 {remaining}/{max_free}\n"
 
-    active_count = 0
-    expired_count = 0
+    text += (
+        f"\n📈 <b>Итого:</b> {summary['active']} активных, {summary['expired']} истекших, "
+        f"{summary['free']} только с бесплатными запросами"
+    )
 
-    for user_id, user_data in list(users.items())[:20]:  # Ограничиваем показ
-        status = "🟢" if user_data.get('active') else "🔴"
+    # Кнопки фильтров с количеством; текущий фильтр отмечен
+    filter_buttons = [
+        InlineKeyboardButton(
+            f"{'• ' if name == status else ''}{title} ({summary[name]})",
+            callback_data=f"admin_users:{name}"
+        )
+        for name, title in titles.items()
+    ]
+    keyboard = [filter_buttons[:2], filter_buttons[2:]]
+    if next_cursor:
+        keyboard.append([InlineKeyboardButton("➡️ Дальше", callback_data=f"admin_users:{status}:{next_cursor}")])
+    keyboard.append([InlineKeyboardButton("➕ Добавить подписку", callback_data="admin_add_sub")])
+    return text, keyboard
 
-        try:
-            until = datetime.fromisoformat(user_data['subscription_until'])
-            if until > now:
-                days_left = (until - now).days
-                time_info = f"{days_left}д"
-                active_count += 1
-            else:
-                time_info = "истекла"
-                expired_count += 1
-        except:
-            time_info = "ошибка"
+async def show_admin_users(message, context: CallbackContext):
+    """Показать список пользователей админу"""
+    text, keyboard = get_admin_users_view()
+    keyboard.append([InlineKeyboardButton("🔄 Обновить", callback_data="admin_users")])
+
+    await message.reply_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='HTML'
+    )
+
+def get_pending_payment_text(payment_id, payment):
+    """Описание ожидающего платежа для админа"""
+    username = payment.get('username', 'без username')
+    timestamp = datetime.fromtimestamp(payment['timestamp'])
+    time_ago = int((datetime.now() - timestamp).total_seconds()) // 60  # минут назад
+
+    return (
+        f"🧾 <b>ID:</b> <code>{payment_id}</code>\n"
+        f"👤 Пользователь: <code>{payment['user_id']}</code> (@{username})\n"
+        f"⏳ Период: {payment['period']}\n"
+        f"💰 Сумма: {payment['amount']}₽\n"
+        f"⏰ Отправлен: {time_ago} минут назад\n"
+        + "─" * 30 + "\n"
+    )
 
-        # Получаем информацию о запросах
-        requests_info = subscription_manager.get_free_requests_info(int(user_id))
-        requests_text = f"📊 {requests_info['remaining']}/10"
+def get_admin_pending_view(cursor=None):
+    """Текст и клавиатура страницы ожидающих платежей (от старых к новым)"""
+    page, next_cursor = subscription_manager.get_pending_payments_page(cursor, limit=10)
 
-        text += f"{status} ID: <code>{user_id}</code> ({time_info}) {requests_text}\n"
+    if not page:
+        return "⏳ <b>Нет ожидающих платежей</b>", [
+            [InlineKeyboardButton("🔄 Обновить", callback_data="admin_pending")]
+        ]
 
-    if len(users) > 20:
-        text += f"\n... и еще {len(users) - 20} пользователей"
+    total = subscription_manager.get_statistics()["pending"]
+    text = f"⏳ <b>Ожидающие платежи</b> (всего {total}):\n\n"
 
-    text += f"\n\n📈 <b>Итого:</b> {active_count} активных, {expired_count} истекших"
+    for payment_id, payment in page:
+        text += get_pending_payment_text(payment_id, payment)
 
-    keyboard = [
-        [InlineKeyboardButton("➕ Добавить подписку", callback_data="admin_add_sub")],
-        [InlineKeyboardButton("🔄 Обновить", callback_data="admin_users")]
-    ]
+    keyboard = []
+    if next_cursor:
+        # Курсор - время и ID последнего платежа страницы, следующая страница начинается после него
+        keyboard.append([InlineKeyboardButton("➡️ Дальше", callback_data=f"admin_pending:{next_cursor}")])
+    keyboard.append([
+        InlineKeyboardButton("🔄 Обновить", callback_data="admin_pending"),
+        InlineKeyboardButton("✅ Подтвердить все", callback_data="admin_confirm_all")
+    ])
+    return text, keyboard
+
+async def show_admin_pending(message, context: CallbackContext):
+    """Показать ожидающие платежи админу"""
+    text, keyboard = get_admin_pending_view()
 
-    message.reply_text(
+    await message.reply_text(
         text,
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
 
-def show_admin_pending(message, context: CallbackContext):
-    """Показать ожидающие платежи админу"""
-    pending = subscription_manager.data.get("pending_payments", {})
+async def show_admin_user_pending(message, user_id):
+    """Показать админу ожидающие платежи одного пользователя"""
+    payments = subscription_manager.get_user_pending_payments(user_id)
 
-    if not pending:
-        message.reply_text("⏳ <b>Нет ожидающих платежей</b>", parse_mode='HTML')
+    if not payments:
+        await message.reply_text(f"⏳ <b>У пользователя {user_id} нет ожидающих платежей</b>", parse_mode='HTML')
         return
 
-    text = "⏳ <b>Ожидающие платежи:</b>\n\n"
-
-    for payment_id, payment in list(pending.items())[:10]:  # Ограничиваем показ
-        user_id = payment['user_id']
-        period = payment['period']
-        amount = payment['amount']
-        username = payment.get('username', 'без username')
-        timestamp = datetime.fromisoformat(payment['timestamp'])
-        time_ago = (datetime.now() - timestamp).seconds // 60  # минут назад
+    text = f"⏳ <b>Ожидающие платежи пользователя {user_id}:</b>\n\n"
+    for payment_id, payment in payments:
+        text += get_pending_payment_text(payment_id, payment)
 
-        text += f"🧾 <b>ID:</b> <code>{payment_id}</code>\n"
-        text += f"👤 Пользователь: <code>{user_id}</code> (@{username})\n"
-        text += f"⏳ Период: {period}\n"
-        text += f"💰 Сумма: {amount}₽\n"
-        text += f"⏰ Отправлен: {time_ago} минут назад\n"
-        text += "─" * 30 + "\n"
+    await message.reply_text(text, parse_mode='HTML')
 
-    if len(pending) > 10:
-        text += f"\n... и еще {len(pending) - 10} платежей"
+async def show_admin_archived_user(message, user_id):
+    """Показать админу подписку пользователя, перенесенную в архив"""
+    user = await run_blocking(subscription_manager.get_archived_user, user_id)
 
-    keyboard = [
-        [
-            InlineKeyboardButton("🔄 Обновить", callback_data="admin_pending"),
-            InlineKeyboardButton("✅ Подтвердить все", callback_data="admin_confirm_all")
-        ]
-    ]
+    if not user:
+        await message.reply_text(f"🗄 <b>Пользователя {user_id} нет в архиве</b>", parse_mode='HTML')
+        return
 
-    message.reply_text(
-        text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+    until = datetime.fromtimestamp(user["subscription_until"])
+    archived_at = datetime.fromisoformat(user["archived_at"])
+    await message.reply_text(
+        f"🗄 <b>Архив: пользователь {user_id}</b>\n\n"
+        f"📅 Подписка истекла: {until.strftime('%d.%m.%Y %H:%M')}\n"
+        f"📦 Перенесена в архив: {archived_at.strftime('%d.%m.%Y %H:%M')}",
         parse_mode='HTML'
     )
 
-def confirm_payment_admin(message, context: CallbackContext, payment_id):
+def get_retention_report_text(report):
+    """Отчет об очистке устаревших данных для админа"""
+    return (
+        f"🧹 <b>Очистка данных завершена</b>\n\n"
+        f"🆓 Удалено счетчиков бесплатных запросов: {report['free_requests_removed']}\n"
+        f"🗄 Подписок перенесено в архив: {report['users_archived']}\n"
+        f"⏳ Удалено просроченных платежей: {report['pending_payments_expired']}\n"
+        f"💾 Освобождено: {report['bytes_reclaimed'] / 1024:.1f} КБ"
+    )
+
+def get_payment_confirmed_text(subscription_until):
+    """Текст уведомления пользователю о подтвержденном платеже"""
+    return (
+        f"✅ <b>Ваш платеж подтвержден!</b>\n\n"
+        f"Подписка активирована до: {subscription_until.strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"Теперь вы можете использовать поиск музыки без ограничений."
+    )
+
+def get_expiry_reminder_text(flag, subscription_until):
+    """Текст напоминания об окончании подписки"""
+    left = "24 часа" if flag == "notified_24h" else "2 часа"
+    return (
+        f"⏰ <b>Подписка скоро закончится</b>\n\n"
+        f"До окончания осталось меньше {left}: подписка действует до "
+        f"{datetime.fromtimestamp(subscription_until).strftime('%d.%m.%Y %H:%M')}.\n\n"
+        f"Продлите подписку, чтобы не потерять доступ к поиску музыки."
+    )
+
+async def send_expiry_reminders(bot, reminders):
+    """Разослать напоминания об окончании подписки и отметить доставленные"""
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("💎 Продлить подписку", callback_data="subscription_required")]
+    ])
+    messages = [
+        {
+            "chat_id": reminder["user_id"],
+            "text": get_expiry_reminder_text(reminder["flag"], reminder["subscription_until"]),
+            "parse_mode": 'HTML',
+            "reply_markup": keyboard,
+        }
+        for reminder in reminders
+    ]
+    by_chat = {reminder["user_id"]: reminder for reminder in reminders}
+
+    # Флаги сохраняются порциями по мере доставки
+    return notification_sender.send_many(bot, messages, on_batch=lambda delivered: (
+        subscription_manager.mark_reminders_sent([by_chat[message["chat_id"]] for message in delivered])
+    ))
+
+async def confirm_payment_admin(message, context: CallbackContext, payment_id):
     """Подтвердить платеж админом"""
     payment = subscription_manager.get_pending_payment(payment_id)
 
     if not payment:
-        message.reply_text(f"❌ Платеж с ID {payment_id} не найден.")
+        await message.reply_text(f"❌ Платеж с ID {payment_id} не найден.")
         return
 
-    user_id = payment['user_id']
-    period = payment['period']
-
-    # Получаем длительность подписки
-    durations = subscription_manager.get_subscription_durations()
-    days = durations.get(period, 30)
-
-    # Активируем подписку
-    subscription_until = subscription_manager.add_user(user_id, days)
+    # Активируем подписку и удаляем платеж из ожидания одной транзакцией
+    result = (await run_blocking(subscription_manager.confirm_pending_payments, [payment_id]))[0]
+    if not result["success"]:
+        await message.reply_text(f"❌ Ошибка подтверждения платежа: {result['error']}")
+        return
 
-    # Удаляем из ожидания
-    subscription_manager.remove_pending_payment(payment_id)
+    user_id = result['user_id']
+    subscription_until = result['subscription_until']
 
     # Отправляем уведомление пользователю
-    try:
-        context.bot.send_message(
-            chat_id=user_id,
-            text=(
-                f"✅ <b>Ваш платеж подтвержден!</b>\n\n"
-                f"Подписка активирована до: {subscription_until.strftime('%d.%m.%Y %H:%M')}\n\n"
-                f"Теперь вы можете использовать поиск музыки без ограничений."
-            ),
-            parse_mode='HTML'
-        )
-    except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
+    await notification_sender.send(
+        context.bot,
+        chat_id=user_id,
+        text=get_payment_confirmed_text(subscription_until),
+        parse_mode='HTML'
+    )
 
-    message.reply_text(
+    await message.reply_text(
         f"✅ Платеж подтвержден!\n"
         f"Пользователь: {user_id}\n"
         f"Подписка до: {subscription_until.strftime('%d.%m.%Y %H:%M')}"
     )
 
-def reject_payment_admin(message, context: CallbackContext, payment_id):
+async def reject_payment_admin(message, context: CallbackContext, payment_id):
     """Отклонить платеж админом"""
     payment = subscription_manager.get_pending_payment(payment_id)
 
     if not payment:
-        message.reply_text(f"❌ Платеж с ID {payment_id} не найден.")
+        await message.reply_text(f"❌ Платеж с ID {payment_id} не найден.")
         return
 
     user_id = payment['user_id']
 
     # Удаляем из ожидания
-    subscription_manager.remove_pending_payment(payment_id)
+    await run_blocking(subscription_manager.remove_pending_payment, payment_id)
 
     # Отправляем уведомление пользователю
     try:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=user_id,
             text=(
                 f"❌ <b>Ваш платеж отклонен</b>\n\n"
@@ -1823,16 +2045,16 @@ def reject_payment_admin(message, context: CallbackContext, payment_id):
     except Exception as e:
         logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
 
-    message.reply_text(f"❌ Платеж отклонен. Пользователь уведомлен.")
+    await message.reply_text(f"❌ Платеж отклонен. Пользователь уведомлен.")
 
-def add_subscription_admin(message, user_id, days):
+async def add_subscription_admin(message, user_id, days):
     """Добавить подписку вручную админом"""
     try:
-        subscription_until = subscription_manager.add_user(user_id, days)
+        subscription_until = await run_blocking(subscription_manager.add_user, user_id, days)
 
         # Отправляем уведомление пользователю
         try:
-            message._bot.send_message(
+            await message.get_bot().send_message(
                 chat_id=user_id,
                 text=(
                     f"🎁 <b>Вам добавлена подписка!</b>\n\n"
@@ -1848,7 +2070,7 @@ def add_subscription_admin(message, user_id, days):
         except Exception as e:
             logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
 
-        message.reply_text(
+        await message.reply_text(
             f"✅ Подписка добавлена!\n"
             f"Пользователь: {user_id}\n"
             f"Дней: {days}\n"
@@ -1856,9 +2078,9 @@ def add_subscription_admin(message, user_id, days):
         )
     except Exception as e:
         logger.error(f"Ошибка добавления подписки: {e}")
-        message.reply_text(f"❌ Ошибка: {e}")
+        await message.reply_text(f"❌ Ошибка: {e}")
 
-def show_admin_prices(message):
+async def show_admin_prices(message):
     """Показать и управлять ценами админу"""
     prices_stars = subscription_manager.get_prices_stars()
     prices_bank = subscription_manager.get_prices_bank()
@@ -1881,14 +2103,14 @@ def show_admin_prices(message):
         [InlineKeyboardButton("🔙 Назад", callback_data="admin")]
     ]
 
-    message.reply_text(
+    await message.reply_text(
         text,
         reply_markup=InlineKeyboardMarkup(keyboard),
         parse_mode='HTML'
     )
 
 # Функция для обработки успешных платежей звездами
-def handle_successful_payment(update: Update, context: CallbackContext):
+async def handle_successful_payment(update: Update, context: CallbackContext):
     """Обработчик успешной оплаты звездами"""
     payment = update.message.successful_payment
     payload = payment.invoice_payload
@@ -1911,7 +2133,7 @@ def handle_successful_payment(update: Update, context: CallbackContext):
         # Проверяем, что оплатил тот же пользователь
         if user_id != update.message.from_user.id:
             logger.error(f"ID пользователя не совпадает: {user_id} != {update.message.from_user.id}")
-            update.message.reply_text("❌ Ошибка: неверный пользователь.")
+            await update.message.reply_text("❌ Ошибка: неверный пользователь.")
             return
 
         # Получаем длительность подписки
@@ -1919,7 +2141,7 @@ def handle_successful_payment(update: Update, context: CallbackContext):
         days = durations.get(period, 30)
 
         # Активируем подписку
-        subscription_until = subscription_manager.add_user(user_id, days)
+        subscription_until = await run_blocking(subscription_manager.add_user, user_id, days)
 
         # Отправляем подтверждение
         text = (
@@ -1933,7 +2155,7 @@ def handle_successful_payment(update: Update, context: CallbackContext):
             [InlineKeyboardButton("🔙 В меню", callback_data="main_menu")]
         ]
 
-        update.message.reply_text(
+        await update.message.reply_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
@@ -1943,23 +2165,23 @@ def handle_successful_payment(update: Update, context: CallbackContext):
 
     except Exception as e:
         logger.error(f"Ошибка обработки платежа: {e}")
-        update.message.reply_text(
+        await update.message.reply_text(
             "❌ Произошла ошибка при обработке платежа. "
             "Пожалуйста, свяжитесь с поддержкой.",
             parse_mode='HTML'
         )
 
 # Функция для обработки предварительной проверки платежа
-def handle_pre_checkout(update: Update, context: CallbackContext):
+async def handle_pre_checkout(update: Update, context: CallbackContext):
     """Обработчик предварительной проверки платежа"""
     query = update.pre_checkout_query
 
     # Всегда подтверждаем запрос
-    query.answer(ok=True)
+    await query.answer(ok=True)
 
     logger.info(f"Предварительная проверка платежа: {query.invoice_payload}")
 
-def handle_message(update: Update, context: CallbackContext):
+async def handle_message(update: Update, context: CallbackContext):
     """Обработчик всех сообщений (для админских команд и ввода токена)"""
     user_id = update.message.from_user.id
 
@@ -1975,14 +2197,12 @@ def handle_message(update: Update, context: CallbackContext):
                 payment_type = edit_data['type']
                 period = edit_data['period']
 
-                if payment_type == "stars":
-                    subscription_manager.data["prices"]["stars"][period] = new_price
-                else:
-                    subscription_manager.data["prices"]["bank"][period] = new_price
-
-                subscription_manager.save()
+                await run_blocking(
+                    subscription_manager.set_price,
+                    "stars" if payment_type == "stars" else "bank", period, new_price
+                )
 
-                update.message.reply_text(
+                await update.message.reply_text(
                     f"✅ Цена обновлена: {new_price} {'⭐' if payment_type == 'stars' else '₽'}",
                     reply_markup=InlineKeyboardMarkup([
                         [InlineKeyboardButton("🔙 Назад", callback_data=f"admin_prices_{payment_type}")]
@@ -1992,7 +2212,7 @@ def handle_message(update: Update, context: CallbackContext):
                 context.user_data.pop('admin_price_edit', None)
                 return
             except ValueError:
-                update.message.reply_text("❌ Ошибка: введите целое число")
+                await update.message.reply_text("❌ Ошибка: введите целое число")
                 return
 
         # Обработка добавления подписки
@@ -2000,15 +2220,15 @@ def handle_message(update: Update, context: CallbackContext):
             try:
                 parts = text.split()
                 if len(parts) != 2:
-                    update.message.reply_text("❌ Неверный формат. Используйте: USER_ID DAYS")
+                    await update.message.reply_text("❌ Неверный формат. Используйте: USER_ID DAYS")
                     return
 
                 target_user_id = int(parts[0])
                 days = int(parts[1])
 
-                subscription_until = subscription_manager.add_user(target_user_id, days)
+                subscription_until = await run_blocking(subscription_manager.add_user, target_user_id, days)
 
-                update.message.reply_text(
+                await update.message.reply_text(
                     f"✅ Подписка добавлена!\n"
                     f"Пользователь: {target_user_id}\n"
                     f"Дней: {days}\n"
@@ -2021,23 +2241,17 @@ def handle_message(update: Update, context: CallbackContext):
                 context.user_data.pop('admin_adding_sub', None)
                 return
             except ValueError:
-                update.message.reply_text("❌ Ошибка: введите числа")
+                await update.message.reply_text("❌ Ошибка: введите числа")
                 return
 
         # Обработка изменения реквизитов
         elif 'admin_editing' in context.user_data:
             field = context.user_data['admin_editing']
 
-            if field == 'card':
-                subscription_manager.data["bank_details"]["card"] = text
-            elif field == 'bank':
-                subscription_manager.data["bank_details"]["bank"] = text
-            elif field == 'recipient':
-                subscription_manager.data["bank_details"]["recipient"] = text
-
-            subscription_manager.save()
+            if field in ('card', 'bank', 'recipient'):
+                await run_blocking(subscription_manager.set_bank_detail, field, text)
 
-            update.message.reply_text(
+            await update.message.reply_text(
                 f"✅ {field} обновлен!",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton("🔙 Назад", callback_data="admin_bank_details")]
@@ -2047,53 +2261,72 @@ def handle_message(update: Update, context: CallbackContext):
             context.user_data.pop('admin_editing', None)
             return
 
+        # Обработка сброса запросов пользователя
+        elif context.user_data.get('admin_resetting_requests'):
+            context.user_data.pop('admin_resetting_requests', None)
+            try:
+                target_user_id = int(text)
+            except ValueError:
+                await update.message.reply_text("❌ Ошибка: ID пользователя должен быть числом")
+                return
+
+            await run_blocking(subscription_manager.reset_free_requests, target_user_id)
+
+            await update.message.reply_text(
+                f"✅ Запросы сброшены для пользователя {target_user_id}",
+                reply_markup=InlineKeyboardMarkup([
+                    [InlineKeyboardButton("🔙 Назад", callback_data="admin")]
+                ])
+            )
+            return
+
     # Обработка скриншотов оплаты
     if update.message.photo and ('pending_bank_payment' in context.user_data):
-        handle_screenshot_submission(update, context)
+        await handle_screenshot_submission(update, context)
         return
 
     # Обработка ввода токена
     if context.user_data.get('awaiting_token'):
-        handle_token(update, context)
+        await handle_token(update, context)
         context.user_data.pop('awaiting_token', None)
         return
 
     # Обработка поискового запроса
     if context.user_data.get('awaiting_search_query'):
-        handle_search_query(update, context)
+        await handle_search_query(update, context)
         return
 
     # Если не распознали команду, показываем помощь
-    help_command(update, context)
+    await help_command(update, context)
 
 # Функции для работы с подписками (дополнительные)
-def request_screenshot(query, context: CallbackContext):
+async def request_screenshot(query, context: CallbackContext):
     """Запрос скриншота оплаты"""
     keyboard = [
         [InlineKeyboardButton("✖️ Отменить", callback_data="subscribe")]
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "📸 <b>Отправьте скриншот чека об оплате:</b>\n\n"
             "Просто отправьте фото с квитанцией об оплате.",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="📸 <b>Отправьте скриншот чека об оплате:</b>\n\nПросто отправьте фото с квитанцией об оплате.",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def confirm_payment(query, context: CallbackContext):
+async def confirm_payment(query, context: CallbackContext):
     """Подтверждение оплаты (для внутреннего использования)"""
     payment_data = context.user_data.get('pending_payment')
 
     if not payment_data:
-        query.answer("❌ Нет данных о платеже", show_alert=True)
+        await query.answer("❌ Нет данных о платеже", show_alert=True)
         return
 
     user_id = payment_data['user_id']
@@ -2102,7 +2335,7 @@ def confirm_payment(query, context: CallbackContext):
     days = durations.get(period, 30)
 
     # Активируем подписку
-    subscription_until = subscription_manager.add_user(user_id, days)
+    subscription_until = await run_blocking(subscription_manager.add_user, user_id, days)
 
     # Очищаем данные
     context.user_data.pop('pending_payment', None)
@@ -2120,104 +2353,94 @@ def confirm_payment(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=text,
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def cancel_payment(query, context: CallbackContext):
+async def cancel_payment(query, context: CallbackContext):
     """Отмена оплаты"""
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "❌ Оплата отменена.",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="subscribe")]])
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="❌ Оплата отменена.",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="subscribe")]])
         )
 
 # Обработчики админ callback-ов
-def admin_confirm_payment(query, context: CallbackContext, payment_id):
+async def admin_confirm_payment(query, context: CallbackContext, payment_id):
     """Админ подтверждает платеж"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
     payment = subscription_manager.get_pending_payment(payment_id)
 
     if not payment:
         try:
-            query.edit_message_text(f"❌ Платеж с ID {payment_id} не найден.")
+            await query.edit_message_text(f"❌ Платеж с ID {payment_id} не найден.")
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Платеж с ID {payment_id} не найден."
             )
         return
 
-    user_id = payment['user_id']
-    period = payment['period']
-
-    # Получаем длительность подписки
-    durations = subscription_manager.get_subscription_durations()
-    days = durations.get(period, 30)
-
-    # Активируем подписку
-    subscription_until = subscription_manager.add_user(user_id, days)
+    # Активируем подписку и удаляем платеж из ожидания одной транзакцией
+    result = (await run_blocking(subscription_manager.confirm_pending_payments, [payment_id]))[0]
+    if not result["success"]:
+        await query.answer(f"❌ Ошибка подтверждения платежа: {result['error']}", show_alert=True)
+        return
 
-    # Удаляем из ожидания
-    subscription_manager.remove_pending_payment(payment_id)
+    user_id = result['user_id']
+    subscription_until = result['subscription_until']
 
     # Отправляем уведомление пользователю
-    try:
-        context.bot.send_message(
-            chat_id=user_id,
-            text=(
-                f"✅ <b>Ваш платеж подтвержден!</b>\n\n"
-                f"Подписка активирована до: {subscription_until.strftime('%d.%m.%Y %H:%M')}\n\n"
-                f"Теперь вы можете использовать поиск музыки без ограничений."
-            ),
-            parse_mode='HTML'
-        )
-    except Exception as e:
-        logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
+    await notification_sender.send(
+        context.bot,
+        chat_id=user_id,
+        text=get_payment_confirmed_text(subscription_until),
+        parse_mode='HTML'
+    )
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             f"✅ Платеж подтвержден!\n"
             f"Пользователь: {user_id}\n"
             f"Подписка до: {subscription_until.strftime('%d.%m.%Y %H:%M')}"
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text=f"✅ Платеж подтвержден!\nПользователь: {user_id}\nПодписка до: {subscription_until.strftime('%d.%m.%Y %H:%M')}"
         )
 
-def admin_reject_payment(query, context: CallbackContext, payment_id):
+async def admin_reject_payment(query, context: CallbackContext, payment_id):
     """Админ отклоняет платеж"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
     payment = subscription_manager.get_pending_payment(payment_id)
 
     if not payment:
         try:
-            query.edit_message_text(f"❌ Платеж с ID {payment_id} не найден.")
+            await query.edit_message_text(f"❌ Платеж с ID {payment_id} не найден.")
         except:
-            context.bot.send_message(
+            await context.bot.send_message(
                 chat_id=query.message.chat_id,
                 text=f"❌ Платеж с ID {payment_id} не найден."
             )
@@ -2226,11 +2449,11 @@ def admin_reject_payment(query, context: CallbackContext, payment_id):
     user_id = payment['user_id']
 
     # Удаляем из ожидания
-    subscription_manager.remove_pending_payment(payment_id)
+    await run_blocking(subscription_manager.remove_pending_payment, payment_id)
 
     # Отправляем уведомление пользователю
     try:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=user_id,
             text=(
                 f"❌ <b>Ваш платеж отклонен</b>\n\n"
@@ -2243,61 +2466,96 @@ def admin_reject_payment(query, context: CallbackContext, payment_id):
         logger.error(f"Ошибка уведомления пользователя {user_id}: {e}")
 
     try:
-        query.edit_message_text(f"❌ Платеж отклонен. Пользователь уведомлен.")
+        await query.edit_message_text(f"❌ Платеж отклонен. Пользователь уведомлен.")
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="❌ Платеж отклонен. Пользователь уведомлен."
         )
 
-def admin_reset_requests(query, context: CallbackContext):
+async def admin_reset_requests(query, context: CallbackContext):
     """Админ сбрасывает запросы"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
     context.user_data['admin_resetting_requests'] = True
 
     keyboard = [
+        [InlineKeyboardButton("👥 Сбросить всем", callback_data="admin_reset_requests_all")],
         [InlineKeyboardButton("✖️ Отмена", callback_data="admin")]
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "<b>🔄 Сброс бесплатных запросов:</b>\n\n"
             "Введите ID пользователя для сброса:\n"
-            "Пример: <code>123456789</code>",
+            "Пример: <code>123456789</code>\n\n"
+            "Или сбросьте запросы всем пользователям.",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
-            text="<b>🔄 Сброс бесплатных запросов:</b>\n\nВведите ID пользователя для сброса:\nПример: <code>123456789</code>",
+            text="<b>🔄 Сброс бесплатных запросов:</b>\n\nВведите ID пользователя для сброса:\nПример: <code>123456789</code>\n\nИли сбросьте запросы всем пользователям.",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def admin_edit_stars(query, context: CallbackContext):
+async def admin_reset_all_requests(query, context: CallbackContext, confirmed: bool = False):
+    """Админ сбрасывает запросы всем пользователям"""
+    if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
+        await query.answer("❌ Нет доступа", show_alert=True)
+        return
+
+    if not confirmed:
+        text = (
+            "<b>👥 Сброс запросов всем пользователям</b>\n\n"
+            "Счетчики бесплатных запросов обнулятся у всех пользователей. Продолжить?"
+        )
+        keyboard = [
+            [InlineKeyboardButton("✅ Да, сбросить всем", callback_data="admin_reset_requests_all_confirm")],
+            [InlineKeyboardButton("✖️ Отмена", callback_data="admin")]
+        ]
+    else:
+        context.user_data.pop('admin_resetting_requests', None)
+        await run_blocking(subscription_manager.reset_all_free_requests)
+        text = "✅ Бесплатные запросы сброшены всем пользователям"
+        keyboard = [
+            [InlineKeyboardButton("🔙 Назад", callback_data="admin")]
+        ]
+
+    try:
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='HTML')
+    except:
+        await context.bot.send_message(
+            chat_id=query.message.chat_id,
+            text=text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='HTML'
+        )
+
+async def admin_edit_stars(query, context: CallbackContext):
     """Админ редактирует цены звезд"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
-    query.answer("ℹ️ Выберите период из списка выше")
+    await query.answer("ℹ️ Выберите период из списка выше")
 
-def admin_edit_bank(query, context: CallbackContext):
+async def admin_edit_bank(query, context: CallbackContext):
     """Админ редактирует банковские цены"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
-    query.answer("ℹ️ Выберите период из списка выше")
+    await query.answer("ℹ️ Выберите период из списка выше")
 
-def admin_change_card(query, context: CallbackContext):
+async def admin_change_card(query, context: CallbackContext):
     """Админ меняет номер карты"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
     context.user_data['admin_editing'] = 'card'
@@ -2307,7 +2565,7 @@ def admin_change_card(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "<b>💳 Изменение номера карты:</b>\n\n"
             "Введите новый номер карты:\n"
             "Пример: <code>2202 2006 1234 5678</code>",
@@ -2315,17 +2573,17 @@ def admin_change_card(query, context: CallbackContext):
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="<b>💳 Изменение номера карты:</b>\n\nВведите новый номер карты:\nПример: <code>2202 2006 1234 5678</code>",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def admin_change_bank(query, context: CallbackContext):
+async def admin_change_bank(query, context: CallbackContext):
     """Админ меняет название банка"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
     context.user_data['admin_editing'] = 'bank'
@@ -2335,7 +2593,7 @@ def admin_change_bank(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "<b>🏦 Изменение названия банка:</b>\n\n"
             "Введите новое название банка:\n"
             "Пример: <code>Сбербанк</code>",
@@ -2343,17 +2601,17 @@ def admin_change_bank(query, context: CallbackContext):
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="<b>🏦 Изменение названия банка:</b>\n\nВведите новое название банка:\nПример: <code>Сбербанк</code>",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def admin_change_recipient(query, context: CallbackContext):
+async def admin_change_recipient(query, context: CallbackContext):
     """Админ меняет получателя"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
     context.user_data['admin_editing'] = 'recipient'
@@ -2363,7 +2621,7 @@ def admin_change_recipient(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "<b>👤 Изменение получателя:</b>\n\n"
             "Введите ФИО получателя:\n"
             "Пример: <code>Иван Иванович Иванов</code>",
@@ -2371,17 +2629,17 @@ def admin_change_recipient(query, context: CallbackContext):
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="<b>👤 Изменение получателя:</b>\n\nВведите ФИО получателя:\nПример: <code>Иван Иванович Иванов</code>",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def admin_add_sub(query, context: CallbackContext):
+async def admin_add_sub(query, context: CallbackContext):
     """Админ добавляет подписку"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
     context.user_data['admin_adding_sub'] = True
@@ -2391,7 +2649,7 @@ def admin_add_sub(query, context: CallbackContext):
     ]
 
     try:
-        query.edit_message_text(
+        await query.edit_message_text(
             "<b>➕ Добавление подписки:</b>\n\n"
             "Введите данные в формате:\n"
             "<code>USER_ID DAYS</code>\n\n"
@@ -2400,37 +2658,38 @@ def admin_add_sub(query, context: CallbackContext):
             parse_mode='HTML'
         )
     except:
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=query.message.chat_id,
             text="<b>➕ Добавление подписки:</b>\n\nВведите данные в формате:\n<code>USER_ID DAYS</code>\n\nПример: <code>123456789 30</code>",
             reply_markup=InlineKeyboardMarkup(keyboard),
             parse_mode='HTML'
         )
 
-def admin_confirm_all(query, context: CallbackContext):
+async def admin_confirm_all(query, context: CallbackContext):
     """Админ подтверждает все платежи"""
     if query.from_user.id not in SUBSCRIPTION_CONFIG["admin_id"]:
-        query.answer("❌ Нет доступа", show_alert=True)
+        await query.answer("❌ Нет доступа", show_alert=True)
         return
 
-    pending = subscription_manager.data.get("pending_payments", {}).copy()
-    confirmed_count = 0
-
-    for payment_id, payment in pending.items():
-        try:
-            user_id = payment['user_id']
-            period = payment['period']
-
-            durations = subscription_manager.get_subscription_durations()
-            days = durations.get(period, 30)
-
-            subscription_manager.add_user(user_id, days)
-            subscription_manager.remove_pending_payment(payment_id)
-            confirmed_count += 1
-        except Exception as e:
-            logger.error(f"Ошибка подтверждения платежа {payment_id}: {e}")
-
-    query.answer(f"✅ Подтверждено {confirmed_count} платежей", show_alert=True)
+    # Все платежи подтверждаются одной транзакцией с одним сохранением
+    results = await run_blocking(subscription_manager.confirm_pending_payments)
+    confirmed = [result for result in results if result["success"]]
+    failed = len(results) - len(confirmed)
+
+    # Уведомления уходят в фоне с ограничением частоты, чтобы не задерживать ответ админу
+    notification_sender.send_many(context.bot, [
+        {
+            "chat_id": result["user_id"],
+            "text": get_payment_confirmed_text(result["subscription_until"]),
+            "parse_mode": 'HTML',
+        }
+        for result in confirmed
+    ])
+
+    answer = f"✅ Подтверждено {len(confirmed)} платежей"
+    if failed:
+        answer += f"\n❌ Ошибок: {failed}"
+    await query.answer(answer, show_alert=True)
 
     # Обновляем сообщение
-    show_admin_pending(query.message, context)
+    await show_admin_pending(query.message, context)
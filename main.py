@@ -1,86 +1,129 @@
 # main.py
-import os
+import asyncio
 import sys
 from pathlib import Path
 
 # Добавляем текущую директорию в путь
 sys.path.insert(0, str(Path(__file__).parent))
 
-# Применяем фикс для imghdr
-import fix_imghdr
-
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, MessageHandler, Filters, PreCheckoutQueryHandler
-from config import logger, TELEGRAM_BOT_TOKEN
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, PreCheckoutQueryHandler, filters
+from config import logger, TELEGRAM_BOT_TOKEN, TELEGRAM_API_CONFIG, RUNTIME_CONFIG, WEBHOOK_CONFIG, SUBSCRIPTION_STORAGE_CONFIG
 from vk_manager import vk_manager
 from subscription_manager import subscription_manager
 from handlers import (
     start, help_command, token_command, menu_command, subscription_command,
     handle_token, handle_message, handle_search_query, handle_screenshot_submission,
-    handle_admin_command, handle_pre_checkout, handle_successful_payment
+    handle_admin_command, handle_pre_checkout, handle_successful_payment, send_expiry_reminders
 )
 from callbacks import handle_callback_query
+from utils import run_blocking
+from webhook_server import run_webhook
 
-def error_handler(update, context):
+async def error_handler(update, context):
     """Обработчик ошибок"""
     logger.error(f"Ошибка при обработке обновления: {context.error}")
 
+async def post_init(application: Application):
+    """Запустить фоновые задачи, когда цикл событий приложения уже работает"""
+    loop = asyncio.get_running_loop()
+
+    # Фоновое снятие флага active с истекших подписок и напоминания об их окончании:
+    # поток обработки сроков передает рассылку в цикл событий и не ждет ее
+    subscription_manager.set_reminder_handler(
+        lambda reminders: asyncio.run_coroutine_threadsafe(
+            send_expiry_reminders(application.bot, reminders), loop
+        )
+    )
+    subscription_manager.start_expiry_sweeper()
+
+async def post_shutdown(application: Application):
+    """Остановить поток сроков подписок, пока цикл событий еще принимает напоминания"""
+    await run_blocking(subscription_manager.stop_expiry_sweeper)
+
+def build_application() -> Application:
+    """Создать приложение бота со всеми обработчиками"""
+    # Обновления обрабатываются параллельно: долгая загрузка трека не задерживает
+    # остальных пользователей, а навигация может прервать загрузку того же пользователя
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .base_url(TELEGRAM_API_CONFIG["base_url"])
+        .base_file_url(TELEGRAM_API_CONFIG["base_file_url"])
+        .local_mode(TELEGRAM_API_CONFIG["local_mode"])
+        .concurrent_updates(RUNTIME_CONFIG["concurrent_updates"])
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+    if TELEGRAM_API_CONFIG["local_mode"]:
+        logger.info(f"Используется локальный сервер Bot API: {TELEGRAM_API_CONFIG['base_url']}")
+
+    # Добавление обработчиков команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("token", token_command))
+    application.add_handler(CommandHandler("menu", menu_command))
+    application.add_handler(CommandHandler("subscription", subscription_command))
+    application.add_handler(CommandHandler("admin", handle_admin_command))
+
+    # Добавляем обработчик текстовых сообщений
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+
+    # Добавляем обработчик поискового запроса
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_search_query))
+
+    # Добавляем обработчик фотографий (скриншоты)
+    application.add_handler(MessageHandler(filters.PHOTO, handle_screenshot_submission))
+
+    # Добавляем обработчики платежей
+    application.add_handler(PreCheckoutQueryHandler(handle_pre_checkout))
+    application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, handle_successful_payment))
+
+    # Добавляем обработчик callback запросов
+    application.add_handler(CallbackQueryHandler(handle_callback_query))
+
+    # Добавляем обработчик ошибок
+    application.add_error_handler(error_handler)
+    return application
+
 def main():
     """Основная функция запуска бота"""
     # Загрузка токена из файла при запуске
     vk_manager.load_token_from_file()
-    
-    # Инициализация менеджера подписок
-    subscription_manager.load_data()
-    
+
+    # Хранилище подписок подключается здесь, а не при импорте модулей бота
+    try:
+        subscription_manager.open()
+    except Exception as e:
+        logger.error(
+            f"Не удалось открыть хранилище подписок ({SUBSCRIPTION_STORAGE_CONFIG['backend']}): {e}"
+        )
+        return
+
     # Добавляем admin_id из конфига если нет в данных
     if "admin_id" not in subscription_manager.data:
         from config import SUBSCRIPTION_CONFIG
-        subscription_manager.data["admin_id"] = SUBSCRIPTION_CONFIG["admin_id"]
-        subscription_manager.save()
-    
+        subscription_manager.set_setting("admin_id", SUBSCRIPTION_CONFIG["admin_id"])
+
     if not TELEGRAM_BOT_TOKEN:
         logger.error("TELEGRAM_BOT_TOKEN не установлен")
         return
-    
+
     try:
-        # Создание Updater (для python-telegram-bot 13.15)
-        updater = Updater(token=TELEGRAM_BOT_TOKEN, use_context=True)
-        dispatcher = updater.dispatcher
-        
-        # Добавление обработчиков команд
-        dispatcher.add_handler(CommandHandler("start", start))
-        dispatcher.add_handler(CommandHandler("help", help_command))
-        dispatcher.add_handler(CommandHandler("token", token_command))
-        dispatcher.add_handler(CommandHandler("menu", menu_command))
-        dispatcher.add_handler(CommandHandler("subscription", subscription_command))
-        dispatcher.add_handler(CommandHandler("admin", handle_admin_command))
-        
-        # Добавляем обработчик текстовых сообщений
-        dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_message))
-        
-        # Добавляем обработчик поискового запроса
-        dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_search_query))
-        
-        # Добавляем обработчик фотографий (скриншоты)
-        dispatcher.add_handler(MessageHandler(Filters.photo, handle_screenshot_submission))
-        
-        # Добавляем обработчики платежей
-        dispatcher.add_handler(PreCheckoutQueryHandler(handle_pre_checkout))
-        dispatcher.add_handler(MessageHandler(Filters.successful_payment, handle_successful_payment))
-        
-        # Добавляем обработчик callback запросов
-        dispatcher.add_handler(CallbackQueryHandler(handle_callback_query))
-        
-        # Добавляем обработчик ошибок
-        dispatcher.add_error_handler(error_handler)
-        
-        # Запуск бота
-        logger.info("Бот запущен")
-        updater.start_polling()
-        updater.idle()
-        
+        application = build_application()
+
+        # Запуск бота: вебхук, если включен в конфиге, иначе long polling
+        if WEBHOOK_CONFIG["enabled"]:
+            asyncio.run(run_webhook(application))
+        else:
+            logger.info("Бот запущен")
+            application.run_polling()
+
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
+    finally:
+        # Сбрасываем на диск отложенные изменения подписок
+        subscription_manager.close()
 
 if __name__ == "__main__":
     main()
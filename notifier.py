@@ -0,0 +1,201 @@
+import asyncio
+import time
+from telegram import InputMediaPhoto
+from telegram.error import RetryAfter
+from config import logger, NOTIFICATION_CONFIG, SUBSCRIPTION_CONFIG
+from utils import run_blocking
+
+class RateLimiter:
+    """Ограничение частоты событий (token bucket)"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    async def acquire(self):
+        """Дождаться разрешения на следующее событие"""
+        # Между проверкой и списанием нет await, поэтому в одном цикле событий блокировка не нужна
+        while True:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class NotificationSender:
+    """Рассылка сообщений пользователям с ограничением частоты"""
+
+    def __init__(self, rate: float = None, burst: int = None):
+        self._limiter = RateLimiter(
+            rate or NOTIFICATION_CONFIG["rate_per_second"],
+            burst or NOTIFICATION_CONFIG["burst"]
+        )
+        # Ссылки на фоновые рассылки, чтобы задачи не собрал сборщик мусора
+        self._tasks = set()
+
+    async def send(self, bot, chat_id, text=None, method: str = "send_message", **kwargs) -> bool:
+        """Отправить одно сообщение, соблюдая лимит и повторяя после RetryAfter
+
+        method - метод бота (send_message, send_photo, send_media_group...).
+        """
+        if text is not None:
+            kwargs["text"] = text
+        for attempt in range(NOTIFICATION_CONFIG["max_retries"] + 1):
+            await self._limiter.acquire()
+            try:
+                await getattr(bot, method)(chat_id=chat_id, **kwargs)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Лимит Telegram при отправке {chat_id}, пауза {e.retry_after} с")
+                await asyncio.sleep(float(e.retry_after))
+            except Exception as e:
+                logger.error(f"Ошибка уведомления пользователя {chat_id}: {e}")
+                return False
+
+        logger.error(f"Уведомление пользователю {chat_id} не отправлено: превышен лимит повторов")
+        return False
+
+    def send_many(self, bot, messages: list, on_done=None, on_batch=None) -> asyncio.Task:
+        """Разослать сообщения фоновой задачей текущего цикла событий
+
+        messages - список словарей с chat_id, text и параметрами send_message.
+        on_batch(delivered) получает доставленные сообщения порциями по batch_size
+        и выполняется в пуле потоков (например, сохраняет флаги на диск).
+        on_done(sent, total) вызывается после рассылки.
+        """
+        async def flush(delivered):
+            if on_batch is None or not delivered:
+                return
+            try:
+                await run_blocking(on_batch, delivered)
+            except Exception as e:
+                logger.error(f"Ошибка обработки доставленных сообщений: {e}")
+
+        async def run():
+            sent = 0
+            delivered = []
+            for message in messages:
+                if await self.send(bot, **message):
+                    sent += 1
+                    delivered.append(message)
+                    if len(delivered) >= NOTIFICATION_CONFIG["batch_size"]:
+                        await flush(delivered)
+                        delivered = []
+            await flush(delivered)
+            logger.info(f"Рассылка завершена: отправлено {sent} из {len(messages)}")
+            if on_done is not None:
+                try:
+                    on_done(sent, len(messages))
+                except Exception as e:
+                    logger.error(f"Ошибка обработки итогов рассылки: {e}")
+
+        task = asyncio.get_running_loop().create_task(run(), name="notification-fanout")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+class AdminNotifier:
+    """Очередь уведомлений админам
+
+    События отправляются фоновой задачей через NotificationSender. Первые
+    digest_threshold событий окна digest_window секунд уходят каждому админу
+    отдельно, остальные в конце окна собираются в одну сводку в admin_channel_id
+    (или админам, если канал не задан).
+    """
+
+    # Сколько событий перечислять в тексте сводки и сколько фото в одном альбоме
+    DIGEST_LINES = 30
+    ALBUM_SIZE = 10
+
+    def __init__(self, sender: NotificationSender, threshold: int = None, window: float = None):
+        self._sender = sender
+        self.threshold = threshold if threshold is not None else NOTIFICATION_CONFIG["admin_digest_threshold"]
+        self.window = window if window is not None else NOTIFICATION_CONFIG["admin_digest_window"]
+        self._queue = None
+        self._task = None
+
+    def notify(self, bot, event: dict):
+        """Поставить событие в очередь и сразу вернуться
+
+        Вызывается из цикла событий. event - параметры отправки (method, text
+        или photo с caption, reply_markup, parse_mode), summary - строка события для сводки.
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._queue.put_nowait((bot, event))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="admin-notifications")
+
+    async def _run(self):
+        """Разбирать очередь, отправляя события по отдельности или сводкой"""
+        bot = None
+        window_start = None
+        sent = 0
+        overflow = []
+
+        while True:
+            timeout = None
+            if window_start is not None:
+                timeout = max(0.0, window_start + self.window - time.monotonic())
+            try:
+                bot, event = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                # Окно закончилось без новых событий
+                await self._send_digest(bot, overflow)
+                window_start, sent, overflow = None, 0, []
+                continue
+
+            now = time.monotonic()
+            if window_start is None or now - window_start >= self.window:
+                await self._send_digest(bot, overflow)
+                window_start, sent, overflow = now, 0, []
+
+            if sent < self.threshold:
+                await self._deliver(bot, event)
+                sent += 1
+            else:
+                overflow.append(event)
+
+    async def _deliver(self, bot, event: dict):
+        """Отправить событие каждому админу"""
+        params = {key: value for key, value in event.items() if key != "summary"}
+        for admin_id in SUBSCRIPTION_CONFIG["admin_id"]:
+            try:
+                await self._sender.send(bot, admin_id, **params)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления админу {admin_id}: {e}")
+
+    async def _send_digest(self, bot, events: list):
+        """Отправить сводку событий и их фото альбомами"""
+        if not events:
+            return
+
+        lines = [event["summary"] for event in events[:self.DIGEST_LINES]]
+        text = f"📸 <b>Новых событий за {int(self.window)} с: {len(events)}</b>\n\n" + "\n".join(lines)
+        if len(events) > self.DIGEST_LINES:
+            text += f"\n\n... и еще {len(events) - self.DIGEST_LINES}"
+        text += "\n\nПолный список: /admin pending"
+
+        photos = [event for event in events if event.get("photo")]
+        chat_ids = [SUBSCRIPTION_CONFIG["admin_channel_id"]] if SUBSCRIPTION_CONFIG.get("admin_channel_id") \
+            else SUBSCRIPTION_CONFIG["admin_id"]
+
+        for chat_id in chat_ids:
+            if not await self._sender.send(bot, chat_id, text, parse_mode='HTML'):
+                continue
+            for start in range(0, len(photos), self.ALBUM_SIZE):
+                media = [
+                    InputMediaPhoto(event["photo"], caption=event["summary"], parse_mode='HTML')
+                    for event in photos[start:start + self.ALBUM_SIZE]
+                ]
+                await self._sender.send(bot, chat_id, method="send_media_group", media=media)
+
+        logger.info(f"Отправлена сводка уведомлений админам: {len(events)} событий")
+
+# Глобальный экземпляр
+notification_sender = NotificationSender()
+admin_notifier = AdminNotifier(notification_sender)
@@ -0,0 +1,155 @@
+import select
+import socket
+import threading
+from urllib.parse import urlparse
+
+class RedisError(Exception):
+    """Ошибка, которую вернул сервер Redis"""
+
+class RedisClient:
+    """Минимальный клиент протокола Redis (RESP2) без внешних зависимостей
+
+    Подходит для Redis и совместимых серверов (Valkey, KeyDB, Dragonfly).
+    Одно соединение на клиента; команды разных потоков выполняются по очереди.
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", timeout: float = 5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+
+    def execute(self, *args):
+        """Выполнить одну команду и вернуть ответ"""
+        reply = self.pipeline([args])[0]
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def pipeline(self, commands: list) -> list:
+        """Отправить несколько команд одним пакетом и вернуть их ответы
+
+        Ошибки отдельных команд возвращаются в списке как RedisError.
+        Пакет повторяется на новом соединении, только если ни один его байт
+        не ушел на сервер: после отправки команды (EVAL, HINCRBY, выборки из
+        очередей) могли выполниться, и повтор выполнил бы их второй раз.
+        """
+        payload = b"".join(self._encode(command) for command in commands)
+        with self._lock:
+            for attempt in range(2):
+                # Сервер мог закрыть простаивавшее соединение по таймауту
+                if self._sock is not None and self._is_stale():
+                    self._disconnect()
+                if self._sock is None:
+                    self._connect()
+                if self._send(payload):
+                    break
+                if attempt:
+                    raise ConnectionError("Не удалось отправить команды в Redis")
+
+            try:
+                return [self._read_reply() for _ in commands]
+            except (OSError, ConnectionError):
+                # Команды могли выполниться: решение о повторе остается за вызывающим
+                self._disconnect()
+                raise
+
+    def close(self):
+        """Закрыть соединение"""
+        with self._lock:
+            self._disconnect()
+
+    def _connect(self):
+        """Открыть соединение, авторизоваться и выбрать базу"""
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._reader = self._sock.makefile("rb")
+
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            self._sock.sendall(b"".join(self._encode(command) for command in setup))
+            for _ in setup:
+                reply = self._read_reply()
+                if isinstance(reply, RedisError):
+                    self._disconnect()
+                    raise reply
+
+    def _send(self, payload: bytes) -> bool:
+        """Отправить пакет; False, если соединение оборвалось до первого байта"""
+        view = memoryview(payload)
+        written = 0
+        try:
+            while written < len(view):
+                written += self._sock.send(view[written:])
+        except OSError:
+            self._disconnect()
+            if written:
+                raise
+            return False
+        return True
+
+    def _is_stale(self) -> bool:
+        """Проверить простаивающее соединение: в нем нечего читать, пока команда не отправлена"""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _disconnect(self):
+        """Закрыть сокет"""
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    @staticmethod
+    def _encode(command) -> bytes:
+        """Закодировать команду в формате RESP"""
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if isinstance(arg, bytes):
+                data = arg
+            else:
+                data = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        """Прочитать один ответ сервера"""
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Соединение с Redis закрыто")
+
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            return RedisError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            count = int(body)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise ConnectionError(f"Неизвестный ответ Redis: {line!r}")
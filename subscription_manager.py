@@ -1,26 +1,274 @@
+import bisect
+import copy
+import heapq
 import json
-import os
 import logging
+import math
+import os
+import threading
+import time
+from array import array
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
+from config import SUBSCRIPTION_CONFIG, SUBSCRIPTION_STORAGE_CONFIG, FREE_REQUESTS_CONFIG, RETENTION_CONFIG
+from subscription_storage import JSONSubscriptionStorage, create_storage, decode_times, decode_record, encode_record
+from user_table import UserTable, SubscriptionsView
 
 logger = logging.getLogger(__name__)
 
+class PendingPaymentIndex:
+    """Индексы ожидающих платежей: по пользователю и по времени отправки
+
+    Сами платежи хранятся в data["pending_payments"] по ID, индекс держит
+    только ID: словарь пользователь -> платежи и список (время, ID),
+    отсортированный по времени.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_user = {}
+        self._order = []
+
+    def rebuild(self, payments: dict):
+        """Построить индексы заново"""
+        by_user = {}
+        for payment_id, payment in payments.items():
+            by_user.setdefault(payment["user_id"], {})[payment_id] = None
+        order = sorted(self._key(payment_id, payment) for payment_id, payment in payments.items())
+        with self._lock:
+            self._by_user = by_user
+            self._order = order
+
+    def add(self, payment_id: str, payment: dict):
+        """Добавить платеж в индексы"""
+        with self._lock:
+            self._by_user.setdefault(payment["user_id"], {})[payment_id] = None
+            bisect.insort(self._order, self._key(payment_id, payment))
+
+    def remove(self, payment_id: str, payment: dict):
+        """Убрать платеж из индексов"""
+        with self._lock:
+            user_payments = self._by_user.get(payment["user_id"])
+            if user_payments is not None:
+                user_payments.pop(payment_id, None)
+                if not user_payments:
+                    del self._by_user[payment["user_id"]]
+
+            key = self._key(payment_id, payment)
+            position = bisect.bisect_left(self._order, key)
+            if position < len(self._order) and self._order[position] == key:
+                del self._order[position]
+
+    def user_payments(self, user_id) -> list:
+        """ID платежей пользователя"""
+        with self._lock:
+            return list(self._by_user.get(user_id, ()))
+
+    def page(self, after: tuple = None, limit: int = 10) -> list:
+        """До limit ключей (время, ID) по возрастанию времени, начиная после ключа after"""
+        with self._lock:
+            start = bisect.bisect_right(self._order, after) if after is not None else 0
+            return self._order[start:start + limit]
+
+    def older_than(self, timestamp: float) -> list:
+        """ID платежей, отправленных раньше timestamp"""
+        with self._lock:
+            end = bisect.bisect_left(self._order, (timestamp,))
+            return [payment_id for _, payment_id in self._order[:end]]
+
+    @staticmethod
+    def _key(payment_id: str, payment: dict) -> tuple:
+        """Ключ платежа в списке по времени"""
+        return (payment.get("timestamp") or 0, payment_id)
+
+class UserIndex:
+    """Индексы списка пользователей для админки
+
+    Ключи - числа UserTable.pack(значение, строка) в массивах array('q'):
+    подписчики упорядочены по сроку окончания, пользователи только с
+    бесплатными запросами - по номеру строки (порядку появления).
+    Страница берется через bisect за O(log N + страница).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_until = array('q')
+        self._free_only = array('q')
+
+    def rebuild(self, table: UserTable):
+        """Построить индексы заново по столбцам таблицы"""
+        by_until = []
+        free_only = array('q')
+        for row, (flags, until) in enumerate(zip(table.flags, table.until)):
+            if flags & UserTable.HAS_SUBSCRIPTION:
+                by_until.append((until << UserTable.ROW_BITS) | row)
+            elif flags & UserTable.HAS_FREE_REQUESTS:
+                free_only.append(row)
+        by_until.sort()
+        with self._lock:
+            self._by_until = array('q', by_until)
+            self._free_only = free_only
+
+    def update_subscription(self, row: int, previous_until: Optional[int], until: int):
+        """Перенести пользователя на новый срок окончания"""
+        with self._lock:
+            if previous_until is not None:
+                self._remove(self._by_until, UserTable.pack(previous_until, row))
+            bisect.insort(self._by_until, UserTable.pack(until, row))
+
+            # С подпиской пользователь больше не считается бесплатным
+            self._remove(self._free_only, row)
+
+    def add_free_user(self, row: int):
+        """Добавить пользователя без подписки, начавшего пользоваться бесплатными запросами"""
+        with self._lock:
+            position = bisect.bisect_left(self._free_only, row)
+            if position < len(self._free_only) and self._free_only[position] == row:
+                return
+            self._free_only.insert(position, row)
+
+    def prune(self, table: UserTable):
+        """Привести индексы в соответствие с таблицей после массового удаления записей
+
+        Из подписчиков убираются только устаревшие ключи, а список бесплатных
+        строится заново: изменения, идущие параллельно, при этом не теряются.
+        """
+        free_only = UserTable.HAS_FREE_REQUESTS
+        present = UserTable.HAS_SUBSCRIPTION | UserTable.HAS_FREE_REQUESTS
+        with self._lock:
+            self._by_until = array('q', [
+                key for key in self._by_until
+                if table.flags[key & UserTable.ROW_MASK] & UserTable.HAS_SUBSCRIPTION
+                and table.until[key & UserTable.ROW_MASK] == key >> UserTable.ROW_BITS
+            ])
+            self._free_only = array('q', [
+                row for row, flags in enumerate(table.flags) if flags & present == free_only
+            ])
+
+    def active_count(self, now: float) -> int:
+        """Количество подписок, срок которых еще не прошел (как у фильтра active)"""
+        with self._lock:
+            return len(self._by_until) - bisect.bisect_left(self._by_until, UserTable.pack(math.ceil(now), 0))
+
+    def free_only_count(self) -> int:
+        """Количество пользователей только с бесплатными запросами"""
+        return len(self._free_only)
+
+    def page(self, status: str, now: float, after: int = None, limit: int = 20):
+        """До limit ключей фильтра status после ключа after; вернуть (ключи, есть ли еще)
+
+        all и active идут от ближайших к окончанию, expired и free - от недавних.
+        """
+        with self._lock:
+            if status == "free":
+                keys, lo, hi, descending = self._free_only, 0, len(self._free_only), True
+            else:
+                keys = self._by_until
+                # Ключи до split истекли: subscription_until < now
+                split = bisect.bisect_left(keys, UserTable.pack(math.ceil(now), 0))
+                lo, hi, descending = {
+                    "all": (0, len(keys), False),
+                    "active": (split, len(keys), False),
+                    "expired": (0, split, True),
+                }[status]
+
+            if descending:
+                end = min(hi, bisect.bisect_left(keys, after)) if after is not None else hi
+                start = max(lo, end - limit)
+                return keys[start:end].tolist()[::-1], start > lo
+
+            start = max(lo, bisect.bisect_right(keys, after)) if after is not None else lo
+            end = min(hi, start + limit)
+            return keys[start:end].tolist(), end < hi
+
+    @staticmethod
+    def _remove(keys: array, key: int):
+        """Удалить ключ из отсортированного массива"""
+        position = bisect.bisect_left(keys, key)
+        if position < len(keys) and keys[position] == key:
+            del keys[position]
+
 class SubscriptionManager:
-    def __init__(self, db_file: str = "subscriptions.json"):
+    # Количество блокировок, между которыми распределяются пользователи
+    LOCK_STRIPES = 64
+    # Напоминания об окончании подписки: флаг в записи пользователя и за сколько секунд до конца
+    REMINDERS = (("notified_24h", 86400), ("notified_2h", 7200))
+    # Сколько записей очистка удаляет за одну транзакцию
+    RETENTION_BATCH = 1000
+
+    def __init__(self, db_file: str = "subscriptions.json", storage=None):
         self.db_file = db_file
+        self.storage = storage or JSONSubscriptionStorage(db_file)
         self.data = self.load_data()
+
+        # Общее хранилище нескольких процессов: записи перечитываются перед
+        # использованием, а изменения выполняются атомарно на стороне хранилища
+        self.shared = getattr(self.storage, "shared", False)
+        self._fetched = {}
+
+        self._pending_index = PendingPaymentIndex()
+        self._pending_index.rebuild(self.data["pending_payments"])
+        self._user_index = UserIndex()
+        self._user_index.rebuild(self.data["users"].table)
+
+        # Блокировки по пользователям и изменения текущей транзакции потока
+        self._locks = [threading.RLock() for _ in range(self.LOCK_STRIPES)]
+        self._tx = threading.local()
+        # Отложенная запись сохраняет согласованную копию, а не живые данные
+        if hasattr(self.storage, "snapshot_provider"):
+            self.storage.snapshot_provider = self.snapshot
+
+        # Очередь сроков подписок: (ближайший срок, ID пользователя). Сроком
+        # бывает неотправленное напоминание или окончание подписки, поэтому на
+        # каждого подписчика приходится одна запись
+        self._expiry_lock = threading.Lock()
+        self._expiry_heap = []
+        self._reminder_handler = None
+        self._sweeper_stop = threading.Event()
+        self._sweeper_thread = None
+        self._rebuild_expiry_heap()
+
+        # Счетчики статистики, которые обновляются при изменениях
+        self._stats_lock = threading.Lock()
+        self._active_count = 0
+        self._free_used_total = 0
+        self._last_reconcile = time.monotonic()
+        self.reconcile_statistics(report=False)
+
+        # Очистка устаревших данных: первый проход - при первом запуске фонового потока
+        self._last_retention = None
+        # Индекс архива: ID пользователя -> смещение его последней строки в файле;
+        # строится при первом поиске и дочитывает только новые строки
+        self._archive_lock = threading.Lock()
+        self._archive_offsets = {}
+        self._archive_scanned = 0
     
     def load_data(self) -> dict:
         """Загрузка данных о подписках"""
-        if os.path.exists(self.db_file):
-            try:
-                with open(self.db_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                logger.error(f"Ошибка загрузки подписок: {e}")
-                return self._default_data()
-        return self._default_data()
+        try:
+            data = self.storage.load()
+        except Exception as e:
+            logger.error(f"Ошибка загрузки подписок: {e}")
+            data = None
+
+        if data is None:
+            data = self._default_data()
+
+        # Недостающие разделы заполняем значениями по умолчанию
+        for key, value in self._default_data().items():
+            data.setdefault(key, value)
+
+        # Время хранится в памяти в секундах epoch, строки ISO только на диске
+        decode_times(data)
+
+        # Пользователи хранятся в компактной таблице, разделы становятся ее представлениями
+        # (бинарный снимок загружается сразу в таблицу)
+        if not isinstance(data["users"], SubscriptionsView):
+            table = UserTable.from_data(data["users"], data["free_requests"])
+            data["users"] = table.users
+            data["free_requests"] = table.free_requests
+        return data
     
     def _default_data(self) -> dict:
         """Структура данных по умолчанию"""
@@ -52,244 +300,957 @@ class SubscriptionManager:
                 "6_months": 180,
                 "1_year": 365,
             },
-            "free_requests": {}
+            "free_requests": {},
+            # Номер общего сброса бесплатных запросов: записи с меньшим
+            # номером считаются сброшенными при следующем обращении
+            "free_requests_epoch": 0
         }
     
     def save(self):
         """Сохранение данных"""
+        self._persist("save_all")
+
+    def export_json(self, json_file: str):
+        """Выгрузить все данные в JSON-файл (для любого хранилища)"""
+        JSONSubscriptionStorage(json_file)._write(self.data, indent=2)
+
+    def reload(self):
+        """Перечитать все данные из хранилища"""
+        self.data = self.load_data()
+        self._fetched.clear()
+        self._pending_index.rebuild(self.data["pending_payments"])
+        self._user_index.rebuild(self.data["users"].table)
+        self._rebuild_expiry_heap()
+
+    def close(self):
+        """Сохранить отложенные изменения и закрыть хранилище"""
+        self.stop_expiry_sweeper()
+        try:
+            self.storage.close()
+        except Exception as e:
+            logger.error(f"Ошибка закрытия хранилища подписок: {e}")
+
+    @contextmanager
+    def transaction(self, *user_ids):
+        """Выполнить изменения под блокировками пользователей с одним сохранением в конце
+
+        Вложенные транзакции входят во внешнюю: изменения сохраняются,
+        когда завершается самая внешняя транзакция потока.
+        """
+        # Блокировки берутся в порядке номеров, чтобы транзакции не ждали друг друга по кругу
+        stripes = sorted({hash(str(user_id)) % self.LOCK_STRIPES for user_id in user_ids})
+        for stripe in stripes:
+            self._locks[stripe].acquire()
+
+        outer = getattr(self._tx, "operations", None) is None
+        if outer:
+            self._tx.operations = {}
+        try:
+            yield self
+        finally:
+            try:
+                if outer:
+                    operations = list(self._tx.operations)
+                    self._tx.operations = None
+                    self._flush_operations(operations)
+            finally:
+                for stripe in reversed(stripes):
+                    self._locks[stripe].release()
+
+    def snapshot(self) -> dict:
+        """Согласованная копия данных для фоновой записи
+
+        Копия берется под блокировками всех пользователей, поэтому в нее не
+        попадает транзакция, выполненная наполовину. Под блокировками
+        копируются только столбцы таблицы и небольшие разделы; перевод в
+        формат файла идет уже без них.
+        """
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            columns = self.data["users"].table.columns()
+            data = {
+                key: copy.deepcopy(value) for key, value in self.data.items()
+                if key not in ("users", "free_requests")
+            }
+        finally:
+            for lock in reversed(self._locks):
+                lock.release()
+
+        table = UserTable.from_columns(columns)
+        data["users"] = table.users
+        data["free_requests"] = table.free_requests
+        return data
+
+    def _persist(self, operation: str, *args):
+        """Передать изменение в хранилище (в транзакции - отложить до ее конца)"""
+        operations = getattr(self._tx, "operations", None)
+        if operations is None:
+            self._flush_operations([(operation,) + args])
+            return
+
+        # Повторное изменение той же записи переносится в конец очереди
+        key = (operation,) + args
+        operations.pop(key, None)
+        operations[key] = None
+
+    def _refresh(self, section: str, key: str = None):
+        """Перечитать запись из общего хранилища, если прочитанная копия устарела"""
+        if not self.shared:
+            return
+
+        now = time.monotonic()
+        fetched_at = self._fetched.get((section, key))
+        if fetched_at is not None and now - fetched_at < SUBSCRIPTION_STORAGE_CONFIG["shared_cache_ttl"]:
+            return
+
+        try:
+            if section == "settings":
+                self.data.update(self.storage.fetch_settings())
+            elif section == "pending_payments":
+                self.data["pending_payments"] = self.storage.fetch_pending_payments()
+                self._pending_index.rebuild(self.data["pending_payments"])
+            else:
+                fetch = self.storage.fetch_user if section == "users" else self.storage.fetch_free_requests
+                record = fetch(key)
+                if record is None:
+                    self.data[section].pop(key, None)
+                else:
+                    self.data[section][key] = record
+        except Exception as e:
+            logger.error(f"Ошибка чтения общего хранилища подписок: {e}")
+            return
+
+        self._fetched[(section, key)] = now
+
+    def _flush_operations(self, operations: list):
+        """Сохранить накопленные изменения одним обращением к хранилищу"""
+        if not operations:
+            return
         try:
-            with open(self.db_file, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            if any(operation == "save_all" for operation, *_ in operations):
+                self.storage.save_all(self.data)
+            elif len(operations) == 1:
+                operation, *args = operations[0]
+                getattr(self.storage, operation)(self.data, *args)
+            else:
+                self.storage.save_batch(self.data, operations)
         except Exception as e:
             logger.error(f"Ошибка сохранения подписок: {e}")
     
+    def start_expiry_sweeper(self, interval: float = None):
+        """Запустить фоновый поток, обрабатывающий сроки подписок (истечение и напоминания)"""
+        if self._sweeper_thread is not None:
+            return
+        if interval is None:
+            interval = SUBSCRIPTION_CONFIG["expiry_sweep_interval"]
+
+        self._sweeper_stop.clear()
+        self._sweeper_thread = threading.Thread(
+            target=self._sweep_loop, args=(interval,), name="subscription-expiry", daemon=True
+        )
+        self._sweeper_thread.start()
+
+    def stop_expiry_sweeper(self):
+        """Остановить фоновый поток истечения подписок"""
+        if self._sweeper_thread is None:
+            return
+        self._sweeper_stop.set()
+        self._sweeper_thread.join()
+        self._sweeper_thread = None
+
+    def sweep_expired(self) -> int:
+        """Обработать наступившие сроки: снять флаг active с истекших подписок
+        и передать напоминания обработчику; вернуть количество истекших подписок"""
+        now = time.time()
+        expired = 0
+        reminders = []
+
+        while True:
+            with self._expiry_lock:
+                if not self._expiry_heap or UserTable.unpack(self._expiry_heap[0])[0] > now:
+                    break
+                deadline, row = UserTable.unpack(heapq.heappop(self._expiry_heap))
+
+            # Строку могли освободить или занять другим пользователем: запись сверяется ниже
+            table = self.data["users"].table
+            if row >= len(table.ids):
+                continue
+            user_id_str = str(table.ids[row])
+
+            with self.transaction(user_id_str):
+                # Запись могла устареть: подписку продлили после постановки в очередь
+                user = self.data["users"].get(user_id_str)
+                if not user or not user.get("active"):
+                    continue
+                until = user["subscription_until"]
+
+                if deadline != until:
+                    flag = self._reminder_flag(user, deadline)
+                    if flag is None:
+                        continue
+                    next_deadline = self._next_deadline(user, deadline)
+                    self._schedule_expiry(user_id_str, next_deadline)
+                    # Если следующий срок тоже прошел (бот был остановлен), напоминание уже неактуально
+                    if next_deadline > now:
+                        reminders.append({"user_id": int(user_id_str), "flag": flag, "subscription_until": until})
+                    continue
+
+                user["active"] = False
+                self.data["users"][user_id_str] = user
+                self._adjust_stats(active=-1)
+                # В общем хранилище флаг не пишется: запись могла продлить другая копия бота,
+                # а is_subscribed все равно сверяет срок
+                if not self.shared:
+                    self._persist("save_user", user_id_str)
+                expired += 1
+
+        if expired:
+            logger.info(f"Истекло подписок: {expired}")
+        if reminders:
+            self._dispatch_reminders(reminders)
+        return expired
+
+    def set_reminder_handler(self, handler):
+        """Задать обработчик напоминаний об окончании подписки
+
+        handler(reminders) получает список словарей user_id, flag, subscription_until
+        из фонового потока, не должен его задерживать и после отправки вызывает
+        mark_reminders_sent. Без обработчика напоминания пропускаются.
+        """
+        self._reminder_handler = handler
+
+    def mark_reminders_sent(self, reminders: list):
+        """Отметить отправленные напоминания одним сохранением"""
+        if not reminders:
+            return
+        with self.transaction(*[reminder["user_id"] for reminder in reminders]):
+            for reminder in reminders:
+                user_id_str = str(reminder["user_id"])
+                user = self.data["users"].get(user_id_str)
+                # Подписку могли продлить, пока уходило напоминание
+                if not user or user["subscription_until"] != reminder["subscription_until"]:
+                    continue
+                user[reminder["flag"]] = True
+                self.data["users"][user_id_str] = user
+                # В общем хранилище флаг уже поставил claim_notifications
+                if not self.shared:
+                    self._persist("save_user", user_id_str)
+
+    def _dispatch_reminders(self, reminders: list):
+        """Передать наступившие напоминания обработчику"""
+        if self._reminder_handler is None:
+            return
+
+        if self.shared:
+            # Напоминание отправляет только тот процесс, который первым отметил его в хранилище
+            try:
+                claimed = set(self.storage.claim_notifications([
+                    (str(reminder["user_id"]), reminder["flag"], reminder["subscription_until"])
+                    for reminder in reminders
+                ]))
+            except Exception as e:
+                logger.error(f"Ошибка отметки напоминаний в общем хранилище: {e}")
+                return
+            reminders = [
+                reminder for reminder in reminders
+                if (str(reminder["user_id"]), reminder["flag"], reminder["subscription_until"]) in claimed
+            ]
+            self.mark_reminders_sent(reminders)
+            if not reminders:
+                return
+
+        try:
+            self._reminder_handler(reminders)
+        except Exception as e:
+            logger.error(f"Ошибка отправки напоминаний об окончании подписки: {e}")
+
+    def _sweep_loop(self, interval: float):
+        """Периодически обрабатывать очередь истечения подписок и сверять статистику"""
+        while True:
+            try:
+                self.sweep_expired()
+                self.expire_pending_payments()
+                if time.monotonic() - self._last_reconcile >= SUBSCRIPTION_CONFIG["stats_reconcile_interval"]:
+                    # Изменения других процессов попадают в статистику при полной перезагрузке
+                    if self.shared:
+                        self.reload()
+                    self.reconcile_statistics()
+                if RETENTION_CONFIG["enabled"] and (
+                    self._last_retention is None
+                    or time.monotonic() - self._last_retention >= RETENTION_CONFIG["interval_hours"] * 3600
+                ):
+                    self._last_retention = time.monotonic()
+                    self.apply_retention()
+            except Exception as e:
+                logger.error(f"Ошибка обработки истекших подписок: {e}")
+            if self._sweeper_stop.wait(interval):
+                break
+
+    def _schedule_expiry(self, user_id_str: str, deadline: int):
+        """Поставить срок подписки в очередь"""
+        row = self.data["users"].table.row(user_id_str)
+        if row < 0:
+            return
+        with self._expiry_lock:
+            heapq.heappush(self._expiry_heap, UserTable.pack(deadline, row))
+
+    def _next_deadline(self, user: dict, after: float) -> int:
+        """Ближайший срок позже after: неотправленное напоминание или окончание подписки"""
+        until = user["subscription_until"]
+        for flag, before in self.REMINDERS:
+            if until - before > after and not user.get(flag):
+                return until - before
+        return until
+
+    def _reminder_flag(self, user: dict, deadline: int) -> Optional[str]:
+        """Флаг неотправленного напоминания со сроком deadline (None, если такого нет)"""
+        for flag, before in self.REMINDERS:
+            if user["subscription_until"] - before == deadline and not user.get(flag):
+                return flag
+        return None
+
+    def _rebuild_expiry_heap(self):
+        """Построить очередь сроков по загруженным данным"""
+        # Напоминания, срок которых прошел, пока бот не работал, не отправляются
+        now = time.time()
+        table = self.data["users"].table
+        active = UserTable.HAS_SUBSCRIPTION | UserTable.ACTIVE
+        reminders = [(before, UserTable.FLAG_BITS[flag]) for flag, before in self.REMINDERS]
+
+        # Тот же расчет, что в _next_deadline, но прямо по столбцам таблицы
+        heap = []
+        for row, (flags, until) in enumerate(zip(table.flags, table.until)):
+            if flags & active != active:
+                continue
+            deadline = until
+            for before, bit in reminders:
+                if until - before > now and not flags & bit:
+                    deadline = until - before
+                    break
+            heap.append((deadline << UserTable.ROW_BITS) | row)
+        heapq.heapify(heap)
+        with self._expiry_lock:
+            self._expiry_heap = heap
+
     def get_user(self, user_id: int) -> Optional[dict]:
         """Получить данные пользователя"""
+        self._refresh("users", str(user_id))
         return self.data["users"].get(str(user_id))
     
     def add_user(self, user_id: int, days: int) -> datetime:
         """Добавить/продлить подписку"""
-        user_id_str = str(user_id)
-        current_time = datetime.now()
+        with self.transaction(user_id):
+            user_id_str = str(user_id)
+            current_time = int(time.time())
+
+            if self.shared:
+                seconds = min(days * 86400, UserTable.MAX_UNTIL - current_time)
+                user, previous = self.storage.extend_subscription(user_id_str, seconds, current_time)
+                local = self.data["users"].get(user_id_str)
+                self.data["users"][user_id_str] = user
+                # Срок берется из таблицы: она ограничивает его значением MAX_UNTIL
+                user = self.data["users"][user_id_str]
+                self._user_index.update_subscription(
+                    self.data["users"].table.row(user_id_str),
+                    local["subscription_until"] if local else None, user["subscription_until"]
+                )
+                self._fetched[("users", user_id_str)] = time.monotonic()
+                if not (previous and previous.get("active")):
+                    self._adjust_stats(active=1)
+                self._schedule_expiry(user_id_str, self._next_deadline(user, current_time))
+                return datetime.fromtimestamp(user["subscription_until"])
+
+            was_active = self.data["users"].get(user_id_str, {}).get("active", False)
+            existing_until = None
         
-        if user_id_str in self.data["users"]:
-            existing_until = datetime.fromisoformat(
-                self.data["users"][user_id_str]["subscription_until"]
-            )
-            if existing_until > current_time:
-                new_until = existing_until + timedelta(days=days)
+            if user_id_str in self.data["users"]:
+                existing_until = self.data["users"][user_id_str]["subscription_until"]
+                if existing_until > current_time:
+                    new_until = existing_until + days * 86400
+                else:
+                    new_until = current_time + days * 86400
             else:
-                new_until = current_time + timedelta(days=days)
-        else:
-            new_until = current_time + timedelta(days=days)
+                new_until = current_time + days * 86400
+            # Слишком далекий срок не поместится в ключи индекса и очереди сроков
+            new_until = UserTable.clamp_until(new_until)
         
-        self.data["users"][user_id_str] = {
-            "subscription_until": new_until.isoformat(),
-            "active": True,
-            "notified_24h": False,
-            "notified_2h": False,
-        }
-        self.save()
-        return new_until
+            self.data["users"][user_id_str] = {
+                "subscription_until": new_until,
+                "active": True,
+                "notified_24h": False,
+                "notified_2h": False,
+            }
+            if not was_active:
+                self._adjust_stats(active=1)
+            self._user_index.update_subscription(self.data["users"].table.row(user_id_str), existing_until, new_until)
+            self._persist("save_user", user_id_str)
+            self._schedule_expiry(user_id_str, self._next_deadline(self.data["users"][user_id_str], current_time))
+            return datetime.fromtimestamp(new_until)
     
     def is_subscribed(self, user_id: int) -> bool:
         """Проверить активность подписки"""
-        user = self.get_user(user_id)
-        if not user or not user.get("active"):
+        # Срок и флаги читаются прямо из столбцов таблицы, без словаря записи
+        self._refresh("users", str(user_id))
+        state = self.data["users"].table.subscription(user_id)
+        if state is None or not state[1] & UserTable.ACTIVE:
             return False
         
-        subscription_until = datetime.fromisoformat(user["subscription_until"])
-        if subscription_until < datetime.now():
-            self.data["users"][str(user_id)]["active"] = False
-            self.save()
-            return False
-        return True
+        # Флаг active снимает фоновый поток, здесь только сравнение сроков
+        return state[0] >= time.time()
     
     def get_time_left(self, user_id: int) -> Optional[timedelta]:
         """Получить оставшееся время подписки"""
-        user = self.get_user(user_id)
-        if not user or not user.get("active"):
+        self._refresh("users", str(user_id))
+        state = self.data["users"].table.subscription(user_id)
+        if state is None or not state[1] & UserTable.ACTIVE:
             return None
         
-        subscription_until = datetime.fromisoformat(user["subscription_until"])
-        now = datetime.now()
-        
-        if subscription_until <= now:
-            self.data["users"][str(user_id)]["active"] = False
-            self.save()
+        seconds_left = state[0] - time.time()
+        if seconds_left <= 0:
             return None
         
-        return subscription_until - now
+        return timedelta(seconds=seconds_left)
     
     def get_prices_stars(self) -> dict:
         """Получить цены в звездах"""
+        self._refresh("settings")
         return self.data["prices"]["stars"]
     
     def get_prices_bank(self) -> dict:
         """Получить цены в рублях"""
+        self._refresh("settings")
         return self.data["prices"]["bank"]
     
     def get_bank_details(self) -> dict:
         """Получить реквизиты"""
+        self._refresh("settings")
         return self.data.get("bank_details", {})
     
     def get_subscription_durations(self) -> dict:
         """Получить длительности подписок"""
+        self._refresh("settings")
         return self.data["subscription_durations"]
+
+    def set_price(self, payment_type: str, period: str, price: int):
+        """Изменить цену подписки (payment_type: stars или bank)"""
+        with self.transaction():
+            self._refresh("settings")
+            self.data["prices"][payment_type][period] = price
+            self._persist("save_settings", "prices")
+
+    def set_bank_detail(self, field: str, value: str):
+        """Изменить реквизиты (field: card, bank или recipient)"""
+        with self.transaction():
+            self._refresh("settings")
+            self.data.setdefault("bank_details", {})[field] = value
+            self._persist("save_settings", "bank_details")
+
+    def set_setting(self, key: str, value):
+        """Изменить произвольную настройку"""
+        with self.transaction():
+            self.data[key] = value
+            self._persist("save_settings", key)
     
     def add_pending_payment(self, user_id: int, period: str, amount: int, 
                            screenshot_id: str = None, username: str = None) -> str:
         """Добавить ожидающий платеж"""
-        import uuid
-        payment_id = str(uuid.uuid4())
+        with self.transaction(user_id):
+            import uuid
+            payment_id = str(uuid.uuid4())
         
-        if "pending_payments" not in self.data:
-            self.data["pending_payments"] = {}
+            if "pending_payments" not in self.data:
+                self.data["pending_payments"] = {}
         
-        self.data["pending_payments"][payment_id] = {
-            "user_id": user_id,
-            "period": period,
-            "amount": amount,
-            "screenshot_id": screenshot_id,
-            "username": username,
-            "timestamp": datetime.now().isoformat(),
-            "status": "pending"
-        }
-        self.save()
-        return payment_id
+            payment = {
+                "user_id": user_id,
+                "period": period,
+                "amount": amount,
+                "screenshot_id": screenshot_id,
+                "username": username,
+                "timestamp": int(time.time()),
+                "status": "pending"
+            }
+            self.data["pending_payments"][payment_id] = payment
+            self._pending_index.add(payment_id, payment)
+            self._persist("save_pending_payment", payment_id)
+            return payment_id
     
     def get_pending_payment(self, payment_id: str) -> Optional[dict]:
         """Получить ожидающий платеж"""
+        self._refresh("pending_payments")
         return self.data.get("pending_payments", {}).get(payment_id)
     
+    def get_pending_payments(self) -> dict:
+        """Получить все ожидающие платежи"""
+        self._refresh("pending_payments")
+        return self.data.get("pending_payments", {})
+
+    def get_pending_payments_page(self, cursor: str = None, limit: int = 10):
+        """Страница ожидающих платежей от старых к новым
+
+        Возвращает список (ID, платеж) и курсор следующей страницы (None на
+        последней). Курсор - строка "время:ID" последнего платежа страницы.
+        """
+        self._refresh("pending_payments")
+        after = None
+        if cursor:
+            timestamp, _, payment_id = cursor.partition(":")
+            after = (int(timestamp), payment_id)
+
+        # Берем на один ключ больше, чтобы узнать, есть ли следующая страница
+        keys = self._pending_index.page(after, limit + 1)
+        pending = self.data["pending_payments"]
+        page = [(payment_id, pending[payment_id]) for _, payment_id in keys[:limit] if payment_id in pending]
+
+        next_cursor = None
+        if len(keys) > limit:
+            timestamp, payment_id = keys[limit - 1]
+            next_cursor = f"{timestamp}:{payment_id}"
+        return page, next_cursor
+
+    def get_user_pending_payments(self, user_id: int) -> list:
+        """Ожидающие платежи пользователя: список (ID, платеж)"""
+        self._refresh("pending_payments")
+        pending = self.data["pending_payments"]
+        return [
+            (payment_id, pending[payment_id])
+            for payment_id in self._pending_index.user_payments(user_id)
+            if payment_id in pending
+        ]
+
+    def expire_pending_payments(self, max_age: float = None) -> list:
+        """Удалить платежи, ожидающие дольше max_age секунд, одним сохранением; вернуть их"""
+        if max_age is None:
+            max_age = SUBSCRIPTION_CONFIG["pending_payment_ttl_days"] * 86400
+        if max_age <= 0:
+            return []
+
+        self._refresh("pending_payments")
+        payment_ids = self._pending_index.older_than(time.time() - max_age)
+        if not payment_ids:
+            return []
+
+        # Платеж могут одновременно подтвердить или отклонить: до блокировок запись читается через get
+        pending = self.data["pending_payments"]
+        payments = [pending.get(payment_id) for payment_id in payment_ids]
+        user_ids = [payment["user_id"] for payment in payments if payment is not None]
+        expired = []
+        with self.transaction(*user_ids):
+            for payment_id in payment_ids:
+                payment = self._take_pending_payment(payment_id)
+                if payment is not None:
+                    expired.append(dict(payment, payment_id=payment_id))
+
+        if expired:
+            logger.info(f"Удалено устаревших ожидающих платежей: {len(expired)}")
+        return expired
+
     def remove_pending_payment(self, payment_id: str):
         """Удалить ожидающий платеж"""
-        if payment_id in self.data.get("pending_payments", {}):
-            del self.data["pending_payments"][payment_id]
-            self.save()
+        payment = self.get_pending_payment(payment_id)
+        if payment is None:
+            return
+
+        with self.transaction(payment["user_id"]):
+            self._take_pending_payment(payment_id)
+
+    def _take_pending_payment(self, payment_id: str) -> Optional[dict]:
+        """Забрать ожидающий платеж (None, если его уже обработали)"""
+        local = self.data["pending_payments"].pop(payment_id, None)
+        if local is not None:
+            self._pending_index.remove(payment_id, local)
+
+        if self.shared:
+            # Из общего хранилища платеж забирает ровно одна копия бота
+            return self.storage.pop_pending_payment(payment_id)
+
+        if local is not None:
+            self._persist("delete_pending_payment", payment_id)
+        return local
     
+    def confirm_pending_payments(self, payment_ids: list = None) -> list:
+        """Подтвердить ожидающие платежи одной транзакцией (по умолчанию - все)
+
+        Возвращает результат по каждому платежу: success, payment_id, user_id,
+        days и subscription_until или error.
+        """
+        pending = self.get_pending_payments()
+        if payment_ids is None:
+            payment_ids = list(pending)
+
+        # Платеж могут одновременно подтвердить или отклонить: до блокировок запись читается через get
+        payments = [pending.get(pid) for pid in payment_ids]
+        user_ids = [payment["user_id"] for payment in payments if payment is not None]
+        durations = self.get_subscription_durations()
+        results = []
+
+        with self.transaction(*user_ids):
+            for payment_id in payment_ids:
+                try:
+                    payment = self._take_pending_payment(payment_id)
+                    if payment is None:
+                        results.append({"success": False, "payment_id": payment_id, "error": "Платеж не найден"})
+                        continue
+
+                    days = durations.get(payment["period"], 30)
+                    subscription_until = self.add_user(payment["user_id"], days)
+                    results.append({
+                        "success": True,
+                        "payment_id": payment_id,
+                        "user_id": payment["user_id"],
+                        "days": days,
+                        "subscription_until": subscription_until,
+                    })
+                except Exception as e:
+                    logger.error(f"Ошибка подтверждения платежа {payment_id}: {e}")
+                    results.append({"success": False, "payment_id": payment_id, "error": str(e)})
+
+        return results
+
     def get_all_users(self) -> dict:
         """Получить всех пользователей"""
         return self.data.get("users", {})
+
+    def get_users_page(self, status: str = "all", cursor: str = None, limit: int = 20):
+        """Страница пользователей для админки по фильтру all, active, expired или free
+
+        Строки читаются из столбцов таблицы без обращения к хранилищу: user_id,
+        subscription_until (None у бесплатных) и free_used. Возвращает строки
+        и курсор следующей страницы (None на последней) - ключ индекса строкой.
+        """
+        after = int(cursor) if cursor else None
+        keys, has_more = self._user_index.page(status, time.time(), after, limit)
+        table = self.data["users"].table
+        epoch = self.data.get("free_requests_epoch", 0)
+
+        rows = []
+        for key in keys:
+            row = UserTable.unpack(key)[1]
+            flags = table.flags[row]
+            # Счетчик записи, устаревшей после общего сброса, считается нулевым
+            free_used = 0
+            if flags & UserTable.HAS_FREE_REQUESTS and table.epoch[row] >= epoch:
+                free_used = table.used[row]
+            rows.append({
+                "user_id": table.ids[row],
+                "subscription_until": table.until[row] if flags & UserTable.HAS_SUBSCRIPTION else None,
+                "free_used": free_used,
+            })
+
+        next_cursor = str(keys[-1]) if has_more and keys else None
+        return rows, next_cursor
+
+    def get_users_summary(self) -> dict:
+        """Количество пользователей по фильтрам админки (из счетчиков, без прохода по данным)"""
+        stats = self.get_statistics()
+        return {
+            "all": stats["total"],
+            "active": stats["active"],
+            "expired": stats["expired"],
+            "free": self._user_index.free_only_count(),
+        }
     
     def get_statistics(self) -> dict:
         """Получить статистику"""
-        users = self.data.get("users", {})
-        now = datetime.now()
-        
-        total = len(users)
-        active = 0
-        expired = 0
-        
-        for user_data in users.values():
-            if user_data.get("active"):
-                subscription_until = datetime.fromisoformat(user_data["subscription_until"])
-                if subscription_until > now:
-                    active += 1
-                else:
-                    expired += 1
-            else:
-                expired += 1
-        
-        pending = len(self.data.get("pending_payments", {}))
-        
-        # Статистика по бесплатным запросам
-        free_users = len(self.data.get("free_requests", {}))
-        total_free_requests = sum(
-            user_data.get("used", 0) 
-            for user_data in self.data.get("free_requests", {}).values()
-        )
-        
+        total = len(self.data.get("users", {}))
+        # Флаг active фоновый поток снимает с опозданием, поэтому активные
+        # подписки считаются по сроку окончания в индексе
+        active = self._user_index.active_count(time.time())
+        with self._stats_lock:
+            total_free_requests = self._free_used_total
+
         return {
             "total": total,
             "active": active,
-            "expired": expired,
-            "pending": pending,
-            "free_users": free_users,
+            "expired": total - active,
+            "pending": len(self.data.get("pending_payments", {})),
+            "free_users": len(self.data.get("free_requests", {})),
             "total_free_requests": total_free_requests
         }
+
+    def apply_retention(self, free_idle_days: int = None, archive_after_days: int = None) -> dict:
+        """Удалить устаревшие данные и вернуть отчет
+
+        Удаляются счетчики бесплатных запросов без обращений дольше free_idle_days
+        и просроченные ожидающие платежи; подписки, истекшие больше archive_after_days
+        дней назад, переносятся в архивный файл (см. get_archived_user).
+        """
+        if free_idle_days is None:
+            free_idle_days = RETENTION_CONFIG["free_requests_idle_days"]
+        if archive_after_days is None:
+            archive_after_days = RETENTION_CONFIG["archive_expired_days"]
+
+        report = {"free_requests_removed": 0, "users_archived": 0, "pending_payments_expired": 0, "bytes_reclaimed": 0}
+        # Записи общего хранилища может в тот же момент менять другая копия бота
+        if self.shared:
+            logger.info("Очистка данных подписок пропущена: хранилище общее для нескольких процессов")
+            return report
+
+        now = int(time.time())
+        table = self.data["users"].table
+        # last_reset обновляется при первом обращении после периода сброса, поэтому
+        # счетчик старше периода - это счетчик без обращений, который все равно обнулился бы
+        free_before = now - max(free_idle_days, FREE_REQUESTS_CONFIG["requests_reset_days"]) * 86400
+        archive_before = now - archive_after_days * 86400
+        expired_flags = UserTable.HAS_SUBSCRIPTION | UserTable.ACTIVE
+
+        # Кандидаты отбираются по столбцам, каждая запись перепроверяется под блокировкой
+        idle_free, expired_users = [], []
+        for user_id, flags, until, last_reset in zip(table.ids, table.flags, table.until, table.last_reset):
+            if free_idle_days > 0 and flags & UserTable.HAS_FREE_REQUESTS and last_reset < free_before:
+                idle_free.append(str(user_id))
+            if archive_after_days > 0 and flags & expired_flags == UserTable.HAS_SUBSCRIPTION and until < archive_before:
+                expired_users.append(str(user_id))
+
+        # Архив пишется до удаления: при сбое запись останется и в данных, и в архиве
+        archive = {}
+        for user_id_str in expired_users:
+            user = self.data["users"].get(user_id_str)
+            if user is not None:
+                archive[user_id_str] = user
+        if archive:
+            self._append_archive(archive, now)
+
+        epoch = self.data.get("free_requests_epoch", 0)
+        for start in range(0, max(len(idle_free), len(expired_users)), self.RETENTION_BATCH):
+            batch_free = idle_free[start:start + self.RETENTION_BATCH]
+            batch_users = expired_users[start:start + self.RETENTION_BATCH]
+            # Одна транзакция на пачку: одно сохранение и ограниченное время блокировок
+            with self.transaction(*batch_free, *batch_users):
+                for user_id_str in batch_free:
+                    free = self.data["free_requests"].get(user_id_str)
+                    if free is None or free["last_reset"] >= free_before:
+                        continue
+                    del self.data["free_requests"][user_id_str]
+                    if free.get("epoch", 0) >= epoch:
+                        self._adjust_stats(free_used=-free["used"])
+                    report["free_requests_removed"] += 1
+                    report["bytes_reclaimed"] += self._record_size("free_requests", user_id_str, free)
+                    self._persist("save_free_requests", user_id_str)
+
+                for user_id_str in batch_users:
+                    # Подписку могли продлить после записи архива
+                    if self.data["users"].get(user_id_str) != archive.get(user_id_str):
+                        continue
+                    del self.data["users"][user_id_str]
+                    report["users_archived"] += 1
+                    report["bytes_reclaimed"] += self._record_size("users", user_id_str, archive[user_id_str])
+                    self._persist("save_user", user_id_str)
+
+        # Пользователи без подписки, но со счетчиком попадают в список бесплатных здесь же
+        self._user_index.prune(table)
+
+        for payment in self.expire_pending_payments():
+            payment_id = payment.pop("payment_id")
+            report["pending_payments_expired"] += 1
+            report["bytes_reclaimed"] += self._record_size("pending_payments", payment_id, payment)
+
+        logger.info(
+            f"Очистка данных подписок: удалено счетчиков бесплатных запросов {report['free_requests_removed']}, "
+            f"в архиве подписок {report['users_archived']}, просроченных платежей {report['pending_payments_expired']}, "
+            f"освобождено {report['bytes_reclaimed']} байт"
+        )
+        return report
+
+    def get_archived_user(self, user_id: int) -> Optional[dict]:
+        """Найти подписку пользователя в архиве (последнюю перенесенную запись)"""
+        archive_file = RETENTION_CONFIG["archive_file"]
+        if not os.path.exists(archive_file):
+            return None
+
+        with self._archive_lock:
+            self._scan_archive(archive_file)
+            offset = self._archive_offsets.get(str(user_id))
+        if offset is None:
+            return None
+
+        with open(archive_file, 'rb') as f:
+            f.seek(offset)
+            found = json.loads(f.readline())
+        return dict(decode_record("users", found["v"]), archived_at=found["archived_at"])
+
+    def _scan_archive(self, archive_file: str):
+        """Дочитать в индекс архива строки, добавленные после прошлого поиска"""
+        if os.path.getsize(archive_file) < self._archive_scanned:
+            # Архив заменили или обрезали: индекс строится заново
+            self._archive_offsets = {}
+            self._archive_scanned = 0
+
+        with open(archive_file, 'rb') as f:
+            f.seek(self._archive_scanned)
+            offset = self._archive_scanned
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Строка еще дописывается
+                try:
+                    entry = json.loads(line)
+                    self._archive_offsets[str(entry["id"])] = offset
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"Пропущена поврежденная строка архива со смещением {offset}")
+                offset += len(line)
+        self._archive_scanned = offset
+
+    def _append_archive(self, users: dict, now: int):
+        """Дописать подписки в архивный файл (одна строка JSON на пользователя)"""
+        archived_at = datetime.fromtimestamp(now).isoformat()
+        lines = "".join(
+            json.dumps(
+                {"id": user_id, "archived_at": archived_at, "v": encode_record("users", user)},
+                ensure_ascii=False, separators=(',', ':')
+            ) + "\n"
+            for user_id, user in users.items()
+        )
+        with open(RETENTION_CONFIG["archive_file"], 'a', encoding='utf-8') as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _record_size(section: str, key: str, record: dict) -> int:
+        """Размер записи в сохраненных данных (компактный JSON), байт"""
+        return len(json.dumps({key: encode_record(section, record)}, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    def reconcile_statistics(self, report: bool = True) -> dict:
+        """Пересчитать счетчики статистики полным проходом и вернуть расхождение"""
+        # Сначала снимаем флаг с уже истекших подписок, чтобы полный проход
+        # и счетчики считали активными одних и тех же пользователей
+        self.sweep_expired()
+
+        # Проход идет по столбцам таблицы, без создания словарей записей
+        now = time.time()
+        table = self.data["users"].table
+        subscribed = UserTable.HAS_SUBSCRIPTION | UserTable.ACTIVE
+        active = sum(
+            1 for flags, until in zip(table.flags, table.until)
+            if flags & subscribed == subscribed and until > now
+        )
+        epoch = self.data.get("free_requests_epoch", 0)
+        free_used = sum(
+            used for flags, used, row_epoch in zip(table.flags, table.used, table.epoch)
+            if flags & UserTable.HAS_FREE_REQUESTS and row_epoch >= epoch
+        )
+
+        with self._stats_lock:
+            drift = {
+                "active": active - self._active_count,
+                "total_free_requests": free_used - self._free_used_total,
+            }
+            self._active_count = active
+            self._free_used_total = free_used
+            self._last_reconcile = time.monotonic()
+
+        if report and any(drift.values()):
+            logger.warning(f"Расхождение счетчиков статистики исправлено: {drift}")
+        return drift
+
+    def _adjust_stats(self, active: int = 0, free_used: int = 0):
+        """Изменить счетчики статистики"""
+        with self._stats_lock:
+            self._active_count += active
+            self._free_used_total += free_used
     
     def can_make_free_request(self, user_id: int, max_free_requests: int = 10, reset_days: int = 30) -> dict:
         """Проверить, может ли пользователь сделать бесплатный запрос"""
-        user_id_str = str(user_id)
-        
-        # Если есть подписка - всегда разрешаем
-        if self.is_subscribed(user_id):
-            return {
-                "can_search": True,
-                "reason": "subscribed",
-                "remaining": "∞",
-                "total_used": 0
-            }
-        
-        # Инициализируем данные пользователя если нужно
-        if "free_requests" not in self.data:
-            self.data["free_requests"] = {}
+        with self.transaction(user_id):
+            user_id_str = str(user_id)
+            
+            # Если есть подписка - всегда разрешаем
+            if self.is_subscribed(user_id):
+                return {
+                    "can_search": True,
+                    "reason": "subscribed",
+                    "remaining": "∞",
+                    "total_used": 0
+                }
+            
+            # Инициализируем данные пользователя если нужно
+            if "free_requests" not in self.data:
+                self.data["free_requests"] = {}
+
+            if self.shared:
+                # Создание записи и сбросы счетчика выполняет хранилище атомарно
+                user_data = self._update_shared_free_requests(user_id_str, 0, reset_days)
+            else:
+                user_data = self.data["free_requests"].get(user_id_str)
+                if user_data is None:
+                    user_data = self._new_free_record(0)
+                    self.data["free_requests"][user_id_str] = user_data
+                    self._index_free_user(user_id_str)
+                    self._persist("save_free_requests", user_id_str)
+                
+                now = int(time.time())
+                
+                # Проверяем, нужно ли сбросить счетчик: общий сброс или истек период
+                if self._apply_free_requests_epoch(user_data):
+                    self.data["free_requests"][user_id_str] = user_data
+                    self._persist("save_free_requests", user_id_str)
+
+                days_since_reset = (now - user_data["last_reset"]) // 86400
+                if days_since_reset >= reset_days:
+                    self._adjust_stats(free_used=-user_data["used"])
+                    user_data["used"] = 0
+                    user_data["last_reset"] = now
+                    self.data["free_requests"][user_id_str] = user_data
+                    self._persist("save_free_requests", user_id_str)
+            
+            used = user_data["used"]
+            remaining = max_free_requests - used
+            
+            if remaining <= 0:
+                return {
+                    "can_search": False,
+                    "reason": "no_free_requests",
+                    "remaining": 0,
+                    "total_used": used,
+                    "message": "Бесплатные запросы закончились"
+                }
             
-        if user_id_str not in self.data["free_requests"]:
-            self.data["free_requests"][user_id_str] = {
-                "used": 0,
-                "first_request": datetime.now().isoformat(),
-                "last_reset": datetime.now().isoformat()
-            }
-            self.save()
-        
-        user_data = self.data["free_requests"][user_id_str]
-        last_reset = datetime.fromisoformat(user_data["last_reset"])
-        now = datetime.now()
-        
-        # Проверяем, нужно ли сбросить счетчик
-        days_since_reset = (now - last_reset).days
-        if days_since_reset >= reset_days:
-            user_data["used"] = 0
-            user_data["last_reset"] = now.isoformat()
-            self.save()
-        
-        used = user_data["used"]
-        remaining = max_free_requests - used
-        
-        if remaining <= 0:
             return {
-                "can_search": False,
-                "reason": "no_free_requests",
-                "remaining": 0,
-                "total_used": used,
-                "message": "Бесплатные запросы закончились"
+                "can_search": True,
+                "reason": "free_requests_available",
+                "remaining": remaining,
+                "total_used": used
             }
-        
-        return {
-            "can_search": True,
-            "reason": "free_requests_available",
-            "remaining": remaining,
-            "total_used": used
-        }
     
     def use_free_request(self, user_id: int) -> dict:
         """Использовать один бесплатный запрос"""
-        user_id_str = str(user_id)
-        
-        # Инициализируем если нужно
-        if "free_requests" not in self.data:
-            self.data["free_requests"] = {}
+        with self.transaction(user_id):
+            user_id_str = str(user_id)
             
-        if user_id_str not in self.data["free_requests"]:
-            self.data["free_requests"][user_id_str] = {
-                "used": 1,
-                "first_request": datetime.now().isoformat(),
-                "last_reset": datetime.now().isoformat()
-            }
-        else:
-            self.data["free_requests"][user_id_str]["used"] += 1
-        
-        self.save()
-        
-        return self.can_make_free_request(user_id)
+            # Инициализируем если нужно
+            if "free_requests" not in self.data:
+                self.data["free_requests"] = {}
+
+            if self.shared:
+                # Атомарное увеличение: запросы других копий бота не теряются
+                self._update_shared_free_requests(
+                    user_id_str, 1, FREE_REQUESTS_CONFIG["requests_reset_days"]
+                )
+            elif user_id_str not in self.data["free_requests"]:
+                self.data["free_requests"][user_id_str] = self._new_free_record(1)
+                self._index_free_user(user_id_str)
+            else:
+                user_data = self.data["free_requests"][user_id_str]
+                self._apply_free_requests_epoch(user_data)
+                user_data["used"] += 1
+                self.data["free_requests"][user_id_str] = user_data
+            
+            self._adjust_stats(free_used=1)
+            if not self.shared:
+                self._persist("save_free_requests", user_id_str)
+            
+            return self.can_make_free_request(user_id)
     
     def get_free_requests_info(self, user_id: int) -> dict:
         """Получить информацию о бесплатных запросах"""
         user_id_str = str(user_id)
+        self._refresh("settings")
+        self._refresh("free_requests", user_id_str)
+        user_data = self.data.get("free_requests", {}).get(user_id_str)
         
-        if "free_requests" not in self.data or user_id_str not in self.data["free_requests"]:
+        # Запись, сброшенная общим сбросом, показывается как новая
+        if user_data is None or user_data.get("epoch", 0) < self.data.get("free_requests_epoch", 0):
             return {
                 "used": 0,
                 "remaining": 10,
@@ -298,10 +1259,8 @@ class SubscriptionManager:
                 "has_subscription": self.is_subscribed(user_id)
             }
         
-        user_data = self.data["free_requests"][user_id_str]
-        last_reset = datetime.fromisoformat(user_data["last_reset"])
-        now = datetime.now()
-        days_since_reset = (now - last_reset).days
+        last_reset = datetime.fromtimestamp(user_data["last_reset"])
+        days_since_reset = int(time.time() - user_data["last_reset"]) // 86400
         
         days_to_reset = max(0, 30 - days_since_reset)
         
@@ -315,28 +1274,107 @@ class SubscriptionManager:
     
     def reset_free_requests(self, user_id: int):
         """Сбросить счетчик бесплатных запросов (админ)"""
-        user_id_str = str(user_id)
-        
-        if "free_requests" not in self.data:
-            self.data["free_requests"] = {}
-        
-        if user_id_str in self.data["free_requests"]:
-            self.data["free_requests"][user_id_str] = {
-                "used": 0,
-                "first_request": datetime.now().isoformat(),
-                "last_reset": datetime.now().isoformat()
-            }
-            self.save()
+        with self.transaction(user_id):
+            user_id_str = str(user_id)
+            
+            if "free_requests" not in self.data:
+                self.data["free_requests"] = {}
+            
+            user_data = self.data["free_requests"].get(user_id_str)
+            if user_data is not None and user_data.get("epoch", 0) >= self.data.get("free_requests_epoch", 0):
+                self._adjust_stats(free_used=-user_data.get("used", 0))
+            
+            self.data["free_requests"][user_id_str] = self._new_free_record(0)
+            self._index_free_user(user_id_str)
+            self._persist("save_free_requests", user_id_str)
             return True
-        
-        # Если записей не было, создаем
-        self.data["free_requests"][user_id_str] = {
-            "used": 0,
-            "first_request": datetime.now().isoformat(),
-            "last_reset": datetime.now().isoformat()
+
+    def reset_all_free_requests(self) -> int:
+        """Сбросить бесплатные запросы всем пользователям (админ), вернуть номер сброса
+
+        Записи пользователей не перебираются: каждая обнуляется при следующем обращении.
+        """
+        with self.transaction():
+            if self.shared:
+                epoch = self.storage.increment_setting("free_requests_epoch")
+            else:
+                epoch = self.data.get("free_requests_epoch", 0) + 1
+                self._persist("save_settings", "free_requests_epoch")
+            self.data["free_requests_epoch"] = epoch
+            with self._stats_lock:
+                self._free_used_total = 0
+
+        logger.info(f"Бесплатные запросы сброшены всем пользователям (сброс №{epoch})")
+        return epoch
+
+    def _update_shared_free_requests(self, user_id_str: str, increment: int, reset_days: int) -> dict:
+        """Атомарно обновить бесплатные запросы в общем хранилище"""
+        record = self.storage.update_free_requests(
+            user_id_str, int(time.time()), increment, reset_days * 86400
+        )
+        self.data["free_requests"][user_id_str] = record
+        self._fetched[("free_requests", user_id_str)] = time.monotonic()
+        self._index_free_user(user_id_str)
+        return record
+
+    def _index_free_user(self, user_id_str: str):
+        """Добавить в индекс пользователя без подписки с записью бесплатных запросов"""
+        if user_id_str not in self.data["users"]:
+            self._user_index.add_free_user(self.data["free_requests"].table.row(user_id_str))
+
+    def _new_free_record(self, used: int) -> dict:
+        """Новая запись бесплатных запросов"""
+        now = int(time.time())
+        return {
+            "used": used,
+            "first_request": now,
+            "last_reset": now,
+            "epoch": self.data.get("free_requests_epoch", 0)
         }
-        self.save()
+
+    def _apply_free_requests_epoch(self, user_data: dict) -> bool:
+        """Обнулить счетчик, если после его последнего сброса был общий сброс"""
+        epoch = self.data.get("free_requests_epoch", 0)
+        if user_data.get("epoch", 0) >= epoch:
+            return False
+
+        # Общий счетчик статистики обнулен при общем сбросе
+        user_data["used"] = 0
+        user_data["last_reset"] = int(time.time())
+        user_data["epoch"] = epoch
         return True
 
+class LazySubscriptionManager:
+    """Глобальный менеджер подписок, который создается при первом обращении
+
+    Хранилище (например, Redis) подключается не при импорте модулей бота,
+    а в main() или при первом использовании менеджера. Атрибуты и методы
+    передаются созданному SubscriptionManager.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def open(self) -> SubscriptionManager:
+        """Создать менеджер, если он еще не создан, и вернуть его"""
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def close(self):
+        """Закрыть менеджер, если он был создан"""
+        if self._instance is not None:
+            self._instance.close()
+
+    def __getattr__(self, name):
+        return getattr(self.open(), name)
+
 # Глобальный экземпляр
-subscription_manager = SubscriptionManager()
+subscription_manager = LazySubscriptionManager(lambda: SubscriptionManager(
+    SUBSCRIPTION_STORAGE_CONFIG["json_file"],
+    storage=create_storage(SUBSCRIPTION_STORAGE_CONFIG)
+))
@@ -0,0 +1,83 @@
+import json
+import struct
+import sys
+import zlib
+from array import array
+from user_table import UserTable
+
+# Бинарный снимок данных подписок
+#
+#   заголовок   MAGIC, VERSION, число строк таблицы, длина блока настроек
+#   столбцы     столбцы UserTable в порядке UserTable.COLUMNS, little-endian
+#   настройки   JSON: ожидающие платежи, цены и прочие настройки (время - секунды epoch)
+#   CRC32       контрольная сумма всего, что выше
+#
+# Столбцы читаются в массивы одним копированием, без разбора записей.
+
+MAGIC = b"VKSUBSNP"
+VERSION = 1
+
+HEADER = struct.Struct("<8sHQQ")
+CHECKSUM = struct.Struct("<I")
+
+# Разделы, которые лежат в столбцах таблицы, а не в JSON
+TABLE_SECTIONS = ("users", "free_requests")
+
+def dump_snapshot(data: dict) -> bytes:
+    """Сериализовать данные менеджера в бинарный снимок"""
+    users = data["users"]
+    table = users.table if hasattr(users, "table") else UserTable.from_data(users, data.get("free_requests", {}))
+    columns = table.columns()
+    if sys.byteorder != "little":
+        for column in columns:
+            column.byteswap()
+
+    # Словари копируются целиком, чтобы параллельные изменения не мешали json
+    settings = {
+        key: dict(value) if isinstance(value, dict) else value
+        for key, value in list(data.items()) if key not in TABLE_SECTIONS
+    }
+    meta = json.dumps(settings, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    body = b"".join([
+        HEADER.pack(MAGIC, VERSION, len(columns[0]), len(meta)),
+        *(column.tobytes() for column in columns),
+        meta,
+    ])
+    return body + CHECKSUM.pack(zlib.crc32(body))
+
+def load_snapshot(payload: bytes) -> dict:
+    """Разобрать бинарный снимок; разделы пользователей - представления новой таблицы"""
+    if len(payload) < HEADER.size + CHECKSUM.size:
+        raise ValueError("Снимок подписок обрезан")
+
+    magic, version, rows, meta_size = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError("Файл не является снимком подписок")
+    if version != VERSION:
+        raise ValueError(f"Неподдерживаемая версия снимка подписок: {version}")
+
+    body = memoryview(payload)[:-CHECKSUM.size]
+    (checksum,) = CHECKSUM.unpack_from(payload, len(body))
+    if zlib.crc32(body) != checksum:
+        raise ValueError("Снимок подписок поврежден: не совпадает контрольная сумма")
+
+    offset = HEADER.size
+    columns = []
+    for _, code in UserTable.COLUMNS:
+        column = array(code)
+        size = rows * column.itemsize
+        column.frombytes(body[offset:offset + size])
+        if sys.byteorder != "little":
+            column.byteswap()
+        columns.append(column)
+        offset += size
+
+    if offset + meta_size != len(body):
+        raise ValueError("Снимок подписок поврежден: неверный размер")
+
+    data = json.loads(bytes(body[offset:]).decode('utf-8'))
+    table = UserTable.from_columns(columns)
+    data["users"] = table.users
+    data["free_requests"] = table.free_requests
+    return data
@@ -0,0 +1,1276 @@
+import atexit
+import json
+import os
+import sqlite3
+import shutil
+import tempfile
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+from redis_client import RedisClient, RedisError
+from subscription_snapshot import dump_snapshot, load_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Разделы данных, которые хранятся построчно; остальное - настройки
+RECORD_SECTIONS = ("users", "free_requests", "pending_payments")
+
+# Поля со временем: в памяти - целые секунды epoch, на диске - строки ISO
+TIME_FIELDS = {
+    "users": ("subscription_until",),
+    "free_requests": ("first_request", "last_reset"),
+    "pending_payments": ("timestamp",),
+}
+
+def to_epoch(value):
+    """Перевести строку ISO в секунды epoch (числа и None не меняются)"""
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    return value
+
+def to_iso(value):
+    """Перевести секунды epoch в строку ISO (строки и None не меняются)"""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value).isoformat()
+    return value
+
+def decode_times(data: dict) -> dict:
+    """Разобрать время во всех записях загруженных данных (на месте)"""
+    for section in TIME_FIELDS:
+        records = data.get(section, {})
+        # Таблица пользователей из бинарного снимка уже хранит время числами
+        if not isinstance(records, dict):
+            continue
+        for record in records.values():
+            decode_record(section, record)
+    return data
+
+def decode_record(section: str, record: dict) -> dict:
+    """Разобрать время в записи (на месте)"""
+    for field in TIME_FIELDS.get(section, ()):
+        if field in record:
+            record[field] = to_epoch(record[field])
+    return record
+
+def apply_free_requests_update(free: Optional[dict], now: int, increment: int, window: int, epoch: int):
+    """Обновить запись бесплатных запросов; вернуть (запись, изменилась ли она)
+
+    Общая логика атомарных update_free_requests разделяемых хранилищ.
+    """
+    if free is None:
+        free = {"used": 0, "first_request": now, "last_reset": now, "epoch": epoch}
+        changed = True
+    else:
+        changed = False
+
+    if free.get("epoch", 0) < epoch or now - free["last_reset"] >= window:
+        free["used"] = 0
+        free["last_reset"] = now
+        free["epoch"] = epoch
+        changed = True
+
+    if increment:
+        free["used"] += increment
+        changed = True
+
+    return free, changed
+
+def encode_record(section: str, record: Optional[dict]) -> Optional[dict]:
+    """Копия записи со временем в формате ISO для сохранения"""
+    if record is None:
+        return None
+    encoded = dict(record)
+    for field in TIME_FIELDS.get(section, ()):
+        if field in encoded:
+            encoded[field] = to_iso(encoded[field])
+    return encoded
+
+def encode_data(data: dict) -> dict:
+    """Копия данных со временем в формате ISO для сохранения"""
+    # Вложенные словари настроек копируются, чтобы параллельные изменения не мешали json
+    encoded = {
+        key: dict(value) if isinstance(value, dict) else value
+        for key, value in list(data.items())
+    }
+    for section in TIME_FIELDS:
+        if section in data:
+            # Разделы пользователей - представления таблицы: обход идет по номерам
+            # строк, поэтому параллельные изменения не ломают его
+            encoded[section] = {
+                key: encode_record(section, record)
+                for key, record in list(data[section].items())
+            }
+    return encoded
+
+class SubscriptionStorage:
+    """Интерфейс хранилища подписок
+
+    Менеджер держит данные в памяти (время - в секундах epoch) и сообщает
+    хранилищу о каждом изменении через save_*/delete_*. Хранилище само
+    переводит данные в свой формат.
+
+    Хранилища с shared = True могут использоваться несколькими процессами бота
+    одновременно. Менеджер перечитывает из них записи через fetch_* и выполняет
+    изменения, зависящие от текущего значения, атомарными операциями хранилища:
+    extend_subscription, update_free_requests, pop_pending_payment, increment_setting,
+    claim_notifications. Записи, которые возвращают эти методы, - в формате памяти.
+    """
+
+    shared = False
+
+    def load(self) -> Optional[dict]:
+        """Загрузить данные (None, если хранилище пустое)"""
+        raise NotImplementedError
+
+    def save_all(self, data: dict):
+        """Сохранить все данные"""
+        raise NotImplementedError
+
+    def save_user(self, data: dict, user_id: str):
+        """Сохранить подписку пользователя"""
+        self.save_all(data)
+
+    def save_free_requests(self, data: dict, user_id: str):
+        """Сохранить бесплатные запросы пользователя"""
+        self.save_all(data)
+
+    def save_pending_payment(self, data: dict, payment_id: str):
+        """Сохранить ожидающий платеж"""
+        self.save_all(data)
+
+    def delete_pending_payment(self, data: dict, payment_id: str):
+        """Удалить ожидающий платеж"""
+        self.save_all(data)
+
+    def save_settings(self, data: dict, key: str = None):
+        """Сохранить настройки (цены, реквизиты, длительности); key - измененная настройка"""
+        self.save_all(data)
+
+    def save_batch(self, data: dict, operations: list):
+        """Сохранить несколько изменений: список кортежей (метод, аргументы...)"""
+        for operation, *args in operations:
+            getattr(self, operation)(data, *args)
+
+    def close(self):
+        """Закрыть хранилище"""
+
+    def fetch_user(self, user_id: str) -> Optional[dict]:
+        """Прочитать подписку пользователя"""
+        raise NotImplementedError
+
+    def fetch_free_requests(self, user_id: str) -> Optional[dict]:
+        """Прочитать бесплатные запросы пользователя"""
+        raise NotImplementedError
+
+    def fetch_pending_payments(self) -> dict:
+        """Прочитать все ожидающие платежи"""
+        raise NotImplementedError
+
+    def fetch_settings(self) -> dict:
+        """Прочитать настройки"""
+        raise NotImplementedError
+
+    def extend_subscription(self, user_id: str, seconds: int, now: int):
+        """Атомарно продлить подписку; вернуть (новая запись, предыдущая запись или None)"""
+        raise NotImplementedError
+
+    def update_free_requests(self, user_id: str, now: int, increment: int, window: int) -> dict:
+        """Атомарно обновить бесплатные запросы и вернуть запись
+
+        Создает запись, если ее нет; обнуляет счетчик после общего сброса
+        (free_requests_epoch) или если с last_reset прошло window секунд;
+        затем прибавляет increment.
+        """
+        raise NotImplementedError
+
+    def pop_pending_payment(self, payment_id: str) -> Optional[dict]:
+        """Атомарно забрать ожидающий платеж (None, если его уже забрали)"""
+        raise NotImplementedError
+
+    def increment_setting(self, key: str) -> int:
+        """Атомарно увеличить числовую настройку на 1 и вернуть новое значение"""
+        raise NotImplementedError
+
+    def claim_notifications(self, claims: list) -> list:
+        """Атомарно отметить напоминания об окончании подписки
+
+        claims - список кортежей (ID пользователя, флаг, subscription_until).
+        Флаг ставится, только если он еще не стоит и срок подписки не изменился;
+        возвращаются отмеченные этим вызовом кортежи.
+        """
+        raise NotImplementedError
+
+class JSONSubscriptionStorage(SubscriptionStorage):
+    """Хранение подписок в JSON-файле
+
+    В обычном режиме каждое изменение сразу перезаписывает файл. В режиме
+    write_behind изменения только помечают данные как измененные, а фоновый
+    поток записывает снимок не чаще раза в flush_interval секунд или после
+    flush_every изменений. Файл всегда заменяется атомарно.
+
+    snapshot_provider - функция, которая возвращает согласованную копию данных
+    для фоновой записи; ее подключает SubscriptionManager. Без нее пишутся
+    данные из последнего save_all.
+    """
+
+    snapshot_provider = None
+
+    def __init__(self, db_file: str = "subscriptions.json", write_behind: bool = False,
+                 flush_interval: float = 2.0, flush_every: int = 100):
+        self.db_file = db_file
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._data = None
+        self._dirty = 0
+        self._dirty_since = 0.0
+        self._closed = False
+        self._thread = None
+
+        if write_behind:
+            self._thread = threading.Thread(
+                target=self._flush_loop, name="subscriptions-flusher", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.close)
+
+    def load(self) -> Optional[dict]:
+        """Загрузить данные (None, если хранилище пустое)"""
+        if not os.path.exists(self.db_file):
+            return None
+        with open(self.db_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_all(self, data: dict):
+        """Сохранить все данные"""
+        if self.write_behind:
+            self._mark_dirty(data)
+        else:
+            self._write(data, indent=2)
+
+    def save_batch(self, data: dict, operations: list):
+        """Сохранить несколько изменений (файл записывается один раз)"""
+        self.save_all(data)
+
+    def flush(self):
+        """Записать накопленные изменения на диск"""
+        with self._cond:
+            if not self._dirty:
+                return
+            data = self._data
+            self._dirty = 0
+
+        try:
+            # Живые данные меняются транзакциями, поэтому пишется их согласованная копия
+            snapshot = data if self.snapshot_provider is None else self.snapshot_provider()
+            # Без indent json использует C-кодировщик и пишет компактный файл
+            self._write(snapshot, indent=None)
+        except Exception as e:
+            logger.error(f"Ошибка фоновой записи подписок: {e}")
+            self._mark_dirty(data)
+
+    def close(self):
+        """Остановить фоновую запись и сохранить оставшиеся изменения"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _mark_dirty(self, data: dict):
+        """Отметить данные как измененные"""
+        with self._cond:
+            self._data = data
+            if not self._dirty:
+                self._dirty_since = time.monotonic()
+            self._dirty += 1
+            self._cond.notify()
+
+    def _flush_loop(self):
+        """Фоновая запись: не чаще flush_interval или после flush_every изменений"""
+        while True:
+            with self._cond:
+                while not self._dirty and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+
+                deadline = self._dirty_since + self.flush_interval
+                while not self._closed and self._dirty < self.flush_every:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+
+            self.flush()
+
+    def _serialize(self, data: dict, indent=None) -> bytes:
+        """Содержимое файла для данных"""
+        return json.dumps(encode_data(data), ensure_ascii=False, indent=indent).encode('utf-8')
+
+    def _write(self, data: dict, indent=None):
+        """Атомарно записать файл: временный файл, fsync и os.replace"""
+        self._write_payload(self._serialize(data, indent))
+
+    def _write_payload(self, payload: bytes):
+        """Атомарно записать готовое содержимое файла"""
+        directory = os.path.dirname(os.path.abspath(self.db_file))
+
+        with self._write_lock:
+            fd, tmp_path = tempfile.mkstemp(prefix=".subscriptions.", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.db_file)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+
+class BinarySubscriptionStorage(JSONSubscriptionStorage):
+    """Хранение подписок в бинарном снимке (формат - в subscription_snapshot)
+
+    Запись и отложенная запись работают как у JSON-файла. Если снимка еще
+    нет, данные один раз импортируются из json_file; выгрузить их в JSON
+    можно через SubscriptionManager.export_json.
+    """
+
+    def __init__(self, db_file: str = "subscriptions.snap", json_file: str = None, **kwargs):
+        super().__init__(db_file, **kwargs)
+        self.json_file = json_file
+
+    def load(self) -> Optional[dict]:
+        """Загрузить снимок (или импортировать JSON, если снимка нет)"""
+        if os.path.exists(self.db_file):
+            with open(self.db_file, 'rb') as f:
+                return load_snapshot(f.read())
+
+        if self.json_file and os.path.exists(self.json_file):
+            logger.info(f"Бинарного снимка нет, данные подписок импортируются из {self.json_file}")
+            return JSONSubscriptionStorage(self.json_file).load()
+        return None
+
+    def _serialize(self, data: dict, indent=None) -> bytes:
+        """Содержимое файла для данных"""
+        return dump_snapshot(data)
+
+class JournalSubscriptionStorage(SubscriptionStorage):
+    """Снимок в JSON и журнал изменений, в который дописывается одна строка на изменение
+
+    Записи журнала содержат новое состояние записи целиком, поэтому повторное
+    применение безопасно. Когда журнал превышает compact_bytes, он в фоне
+    сворачивается в новый снимок. С binary = True снимок хранится в бинарном
+    формате, а json_file служит для первоначального импорта.
+    """
+
+    def __init__(self, snapshot_file: str = "subscriptions.json", journal_file: str = None,
+                 compact_bytes: int = 16 * 1024 * 1024, fsync: bool = False,
+                 binary: bool = False, json_file: str = None):
+        if binary:
+            self.snapshot = BinarySubscriptionStorage(snapshot_file, json_file=json_file)
+        else:
+            self.snapshot = JSONSubscriptionStorage(snapshot_file)
+        self.journal_file = journal_file or snapshot_file + ".journal"
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+
+        self._lock = threading.Lock()
+        # Сворачивания (фоновое и из save_all) выполняются по одному
+        self._compact_lock = threading.Lock()
+        self._data = None
+        self._compacting = False
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._size = self._journal.tell()
+
+    @property
+    def _rotated_journal_file(self):
+        return self.journal_file + ".old"
+
+    def load(self) -> Optional[dict]:
+        """Загрузить снимок и применить к нему журнал"""
+        data = self.snapshot.load()
+        journals = [
+            path for path in (self._rotated_journal_file, self.journal_file)
+            if os.path.exists(path) and os.path.getsize(path) > 0
+        ]
+        if data is None and not journals:
+            return None
+        if data is None:
+            data = {}
+
+        for section in RECORD_SECTIONS:
+            data.setdefault(section, {})
+
+        applied = 0
+        for path in journals:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Оборванная последняя строка после сбоя
+                        logger.warning(f"Пропущена поврежденная запись журнала {path}:{line_number}")
+                        continue
+                    self._apply(data, record)
+                    applied += 1
+
+        logger.info(f"Из журнала применено изменений: {applied}")
+        return data
+
+    def save_all(self, data: dict):
+        """Сохранить все данные (сразу сворачивает журнал в снимок)"""
+        self._data = data
+        self.compact()
+
+    def save_user(self, data: dict, user_id: str):
+        """Сохранить подписку пользователя"""
+        self._append(data, self._record(data, "save_user", user_id))
+
+    def save_free_requests(self, data: dict, user_id: str):
+        """Сохранить бесплатные запросы пользователя"""
+        self._append(data, self._record(data, "save_free_requests", user_id))
+
+    def save_pending_payment(self, data: dict, payment_id: str):
+        """Сохранить ожидающий платеж"""
+        self._append(data, self._record(data, "save_pending_payment", payment_id))
+
+    def delete_pending_payment(self, data: dict, payment_id: str):
+        """Удалить ожидающий платеж"""
+        self._append(data, self._record(data, "delete_pending_payment", payment_id))
+
+    def save_settings(self, data: dict, key: str = None):
+        """Сохранить настройки (цены, реквизиты, длительности)"""
+        self._append(data, self._record(data, "save_settings", key))
+
+    def save_batch(self, data: dict, operations: list):
+        """Сохранить несколько изменений одной записью в журнал"""
+        self._append(data, *[self._record(data, *operation) for operation in operations])
+
+    def compact(self):
+        """Свернуть журнал в новый снимок"""
+        with self._compact_lock:
+            try:
+                self._compact()
+            except Exception as e:
+                logger.error(f"Ошибка сворачивания журнала подписок: {e}")
+            finally:
+                with self._lock:
+                    self._compacting = False
+
+    def _compact(self):
+        """Ротировать журнал, сохранить снимок и удалить ротированный журнал"""
+        with self._lock:
+            data = self._data
+            if data is None:
+                return
+            # Новые изменения пишутся в свежий журнал, старый удаляется
+            # только после того, как снимок надежно записан
+            self._journal.close()
+            try:
+                self._rotate_journal()
+            finally:
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+                self._size = 0
+            # Снимок сериализуется под блокировкой: дописать журнал в это время
+            # нельзя, поэтому в снимке есть все изменения из ротированного журнала
+            payload = self.snapshot._serialize(data)
+
+        self.snapshot._write_payload(payload)
+        os.unlink(self._rotated_journal_file)
+        logger.info("Журнал подписок свернут в снимок")
+
+    def _rotate_journal(self):
+        """Перенести текущий журнал в ротированный"""
+        rotated = self._rotated_journal_file
+        if not os.path.exists(rotated):
+            os.replace(self.journal_file, rotated)
+            return
+
+        # Снимок после прошлой ротации не записался: ее журнал еще нужен,
+        # поэтому текущий дописывается к нему, а не заменяет его
+        with open(self.journal_file, 'rb') as src, open(rotated, 'ab+') as dst:
+            if dst.tell():
+                dst.seek(-1, os.SEEK_END)
+                if dst.read(1) != b"\n":
+                    dst.write(b"\n")  # Оборванная последняя строка после сбоя
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.unlink(self.journal_file)
+
+    def close(self):
+        """Закрыть журнал"""
+        with self._lock:
+            if not self._journal.closed:
+                self._journal.close()
+
+    def _append(self, data: dict, *records: dict):
+        """Дописать записи в журнал и при необходимости запустить сворачивание"""
+        lines = "".join(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+            for record in records
+        )
+        with self._lock:
+            self._journal.write(lines)
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._size += len(lines.encode('utf-8'))
+            self._data = data
+
+            start_compaction = self._size >= self.compact_bytes and not self._compacting
+            if start_compaction:
+                self._compacting = True
+
+        if start_compaction:
+            threading.Thread(target=self.compact, name="subscriptions-compaction", daemon=True).start()
+
+    @staticmethod
+    def _record(data: dict, operation: str, key: str = None) -> dict:
+        """Запись журнала для изменения, переданного менеджером"""
+        if operation == "save_user":
+            return {"op": "user", "id": key, "v": encode_record("users", data["users"].get(key))}
+        if operation == "save_free_requests":
+            record = encode_record("free_requests", data.get("free_requests", {}).get(key))
+            return {"op": "free", "id": key, "v": record}
+        if operation == "save_pending_payment":
+            record = encode_record("pending_payments", data["pending_payments"].get(key))
+            return {"op": "pending", "id": key, "v": record}
+        if operation == "delete_pending_payment":
+            return {"op": "pending", "id": key, "v": None}
+        if operation == "save_settings":
+            settings = {name: value for name, value in data.items() if name not in RECORD_SECTIONS}
+            return {"op": "settings", "v": settings}
+        raise ValueError(f"Неизвестное изменение: {operation}")
+
+    @staticmethod
+    def _apply(data: dict, record: dict):
+        """Применить запись журнала к данным"""
+        op = record.get("op")
+        if op == "settings":
+            data.update(record["v"])
+            return
+
+        section = {"user": "users", "free": "free_requests", "pending": "pending_payments"}.get(op)
+        if section is None:
+            logger.warning(f"Неизвестная запись журнала: {op}")
+            return
+
+        if record["v"] is None:
+            data[section].pop(record["id"], None)
+        else:
+            # Таблица из бинарного снимка принимает время только числами
+            data[section][record["id"]] = decode_record(section, record["v"])
+
+class SQLiteSubscriptionStorage(SubscriptionStorage):
+    """Хранение подписок в SQLite: каждое изменение обновляет одну строку
+
+    С shared = True одну базу могут использовать несколько процессов бота
+    на одной машине: атомарные операции выполняются в транзакциях BEGIN IMMEDIATE.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            subscription_until TEXT NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1,
+            notified_24h INTEGER NOT NULL DEFAULT 0,
+            notified_2h INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_users_until ON users (subscription_until);
+
+        CREATE TABLE IF NOT EXISTS free_requests (
+            user_id INTEGER PRIMARY KEY,
+            used INTEGER NOT NULL DEFAULT 0,
+            first_request TEXT,
+            last_reset TEXT,
+            epoch INTEGER NOT NULL DEFAULT 0
+        );
+
+        CREATE TABLE IF NOT EXISTS pending_payments (
+            payment_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            period TEXT,
+            amount INTEGER,
+            screenshot_id TEXT,
+            username TEXT,
+            timestamp TEXT,
+            status TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_pending_user ON pending_payments (user_id);
+        CREATE INDEX IF NOT EXISTS idx_pending_timestamp ON pending_payments (timestamp);
+
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_file: str = "subscriptions.db", shared: bool = False):
+        self.db_file = db_file
+        self.shared = shared
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Добавить столбцы, появившиеся после создания базы"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(free_requests)")}
+        if "epoch" not in columns:
+            self._conn.execute("ALTER TABLE free_requests ADD COLUMN epoch INTEGER NOT NULL DEFAULT 0")
+
+    def is_empty(self) -> bool:
+        """Проверить, что в базе еще нет данных"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM settings) OR EXISTS (SELECT 1 FROM users) "
+                "OR EXISTS (SELECT 1 FROM free_requests) OR EXISTS (SELECT 1 FROM pending_payments)"
+            ).fetchone()
+        return not row[0]
+
+    def load(self) -> Optional[dict]:
+        """Загрузить данные (None, если хранилище пустое)"""
+        if self.is_empty():
+            return None
+
+        with self._lock:
+            data = self._read_settings()
+            data["users"] = {
+                str(row[0]): self._user_from_row(row)
+                for row in self._conn.execute(self._USER_SELECT)
+            }
+            data["free_requests"] = {
+                str(row[0]): self._free_from_row(row)
+                for row in self._conn.execute(self._FREE_SELECT)
+            }
+            data["pending_payments"] = {
+                row[0]: self._pending_from_row(row)
+                for row in self._conn.execute(self._PENDING_SELECT)
+            }
+
+        return data
+
+    def fetch_user(self, user_id: str) -> Optional[dict]:
+        """Прочитать подписку пользователя"""
+        with self._lock:
+            row = self._conn.execute(self._USER_SELECT + " WHERE user_id = ?", (int(user_id),)).fetchone()
+        return decode_record("users", self._user_from_row(row)) if row else None
+
+    def fetch_free_requests(self, user_id: str) -> Optional[dict]:
+        """Прочитать бесплатные запросы пользователя"""
+        with self._lock:
+            row = self._conn.execute(self._FREE_SELECT + " WHERE user_id = ?", (int(user_id),)).fetchone()
+        return decode_record("free_requests", self._free_from_row(row)) if row else None
+
+    def fetch_pending_payments(self) -> dict:
+        """Прочитать все ожидающие платежи"""
+        with self._lock:
+            return {
+                row[0]: decode_record("pending_payments", self._pending_from_row(row))
+                for row in self._conn.execute(self._PENDING_SELECT)
+            }
+
+    def fetch_settings(self) -> dict:
+        """Прочитать настройки"""
+        with self._lock:
+            return self._read_settings()
+
+    def extend_subscription(self, user_id: str, seconds: int, now: int):
+        """Атомарно продлить подписку; вернуть (новая запись, предыдущая запись или None)"""
+        with self._immediate():
+            previous = self.fetch_user(user_id)
+            start = now
+            if previous and previous["subscription_until"] > now:
+                start = previous["subscription_until"]
+            user = {
+                "subscription_until": start + seconds,
+                "active": True,
+                "notified_24h": False,
+                "notified_2h": False,
+            }
+            self._conn.execute(self._USER_UPSERT, self._user_row(user_id, user))
+        return user, previous
+
+    def update_free_requests(self, user_id: str, now: int, increment: int, window: int) -> dict:
+        """Атомарно обновить бесплатные запросы и вернуть запись"""
+        with self._immediate():
+            row = self._conn.execute(
+                "SELECT value FROM settings WHERE key = 'free_requests_epoch'"
+            ).fetchone()
+            epoch = json.loads(row[0]) if row else 0
+
+            free = self.fetch_free_requests(user_id)
+            free, changed = apply_free_requests_update(free, now, increment, window, epoch)
+            if changed:
+                self._conn.execute(self._FREE_UPSERT, self._free_row(user_id, free))
+        return free
+
+    def pop_pending_payment(self, payment_id: str) -> Optional[dict]:
+        """Атомарно забрать ожидающий платеж (None, если его уже забрали)"""
+        with self._immediate():
+            row = self._conn.execute(
+                self._PENDING_SELECT + " WHERE payment_id = ?", (payment_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM pending_payments WHERE payment_id = ?", (payment_id,))
+        return decode_record("pending_payments", self._pending_from_row(row))
+
+    def increment_setting(self, key: str) -> int:
+        """Атомарно увеличить числовую настройку на 1 и вернуть новое значение"""
+        with self._immediate():
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+            value = (json.loads(row[0]) if row else 0) + 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+        return value
+
+    def claim_notifications(self, claims: list) -> list:
+        """Атомарно отметить напоминания об окончании подписки"""
+        claimed = []
+        with self._immediate():
+            for user_id, flag, until in claims:
+                # Имя столбца подставляется в запрос, поэтому допускаются только известные флаги
+                if flag not in self._NOTIFIED_COLUMNS:
+                    raise ValueError(f"Неизвестный флаг напоминания: {flag}")
+                # Срок сравнивается с точностью до секунды: в базах, импортированных
+                # из JSON до нормализации времени, строки могут содержать микросекунды
+                cursor = self._conn.execute(
+                    f"UPDATE users SET {flag} = 1 "
+                    f"WHERE user_id = ? AND strftime('%s', subscription_until) = strftime('%s', ?) "
+                    f"AND {flag} = 0",
+                    (int(user_id), to_iso(until))
+                )
+                if cursor.rowcount:
+                    claimed.append((user_id, flag, until))
+        return claimed
+
+    def save_all(self, data: dict):
+        """Сохранить все данные одной транзакцией"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM users")
+                self._conn.execute("DELETE FROM free_requests")
+                self._conn.execute("DELETE FROM pending_payments")
+                self._conn.executemany(
+                    self._USER_UPSERT,
+                    [self._user_row(uid, user) for uid, user in data.get("users", {}).items()]
+                )
+                self._conn.executemany(
+                    self._FREE_UPSERT,
+                    [self._free_row(uid, free) for uid, free in data.get("free_requests", {}).items()]
+                )
+                self._conn.executemany(
+                    self._PENDING_UPSERT,
+                    [self._pending_row(pid, payment) for pid, payment in data.get("pending_payments", {}).items()]
+                )
+                self._write_settings(data)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def save_user(self, data: dict, user_id: str):
+        """Сохранить подписку пользователя"""
+        user = data["users"].get(user_id)
+        with self._lock:
+            if user is None:
+                self._conn.execute("DELETE FROM users WHERE user_id = ?", (int(user_id),))
+            else:
+                self._conn.execute(self._USER_UPSERT, self._user_row(user_id, user))
+
+    def save_free_requests(self, data: dict, user_id: str):
+        """Сохранить бесплатные запросы пользователя"""
+        free = data.get("free_requests", {}).get(user_id)
+        with self._lock:
+            if free is None:
+                self._conn.execute("DELETE FROM free_requests WHERE user_id = ?", (int(user_id),))
+            else:
+                self._conn.execute(self._FREE_UPSERT, self._free_row(user_id, free))
+
+    def save_pending_payment(self, data: dict, payment_id: str):
+        """Сохранить ожидающий платеж"""
+        payment = data["pending_payments"].get(payment_id)
+        with self._lock:
+            if payment is None:
+                self._conn.execute("DELETE FROM pending_payments WHERE payment_id = ?", (payment_id,))
+            else:
+                self._conn.execute(self._PENDING_UPSERT, self._pending_row(payment_id, payment))
+
+    def delete_pending_payment(self, data: dict, payment_id: str):
+        """Удалить ожидающий платеж"""
+        with self._lock:
+            self._conn.execute("DELETE FROM pending_payments WHERE payment_id = ?", (payment_id,))
+
+    def save_settings(self, data: dict, key: str = None):
+        """Сохранить настройки (цены, реквизиты, длительности)"""
+        with self._lock:
+            self._write_settings(data, key)
+
+    def save_batch(self, data: dict, operations: list):
+        """Сохранить несколько изменений одной транзакцией"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for operation, *args in operations:
+                    getattr(self, operation)(data, *args)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def import_json(self, json_file: str) -> bool:
+        """Однократно импортировать данные из JSON-файла подписок"""
+        data = JSONSubscriptionStorage(json_file).load()
+        if data is None:
+            return False
+
+        # Время приводится к виду to_iso: строки из JSON могут содержать микросекунды,
+        # а claim_notifications и остальные запросы ищут срок в этом виде
+        self.save_all(decode_times(data))
+        logger.info(
+            f"Импортировано из {json_file}: {len(data.get('users', {}))} подписок, "
+            f"{len(data.get('free_requests', {}))} записей запросов, "
+            f"{len(data.get('pending_payments', {}))} платежей"
+        )
+        return True
+
+    def close(self):
+        """Закрыть соединение с базой"""
+        with self._lock:
+            self._conn.close()
+
+    _USER_UPSERT = (
+        "INSERT INTO users (user_id, subscription_until, active, notified_24h, notified_2h) "
+        "VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id) DO UPDATE SET subscription_until = excluded.subscription_until, "
+        "active = excluded.active, notified_24h = excluded.notified_24h, notified_2h = excluded.notified_2h"
+    )
+
+    _FREE_UPSERT = (
+        "INSERT INTO free_requests (user_id, used, first_request, last_reset, epoch) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id) DO UPDATE SET used = excluded.used, "
+        "first_request = excluded.first_request, last_reset = excluded.last_reset, epoch = excluded.epoch"
+    )
+
+    _PENDING_UPSERT = (
+        "INSERT OR REPLACE INTO pending_payments "
+        "(payment_id, user_id, period, amount, screenshot_id, username, timestamp, status) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    )
+
+    _NOTIFIED_COLUMNS = ("notified_24h", "notified_2h")
+    _USER_SELECT = "SELECT user_id, subscription_until, active, notified_24h, notified_2h FROM users"
+    _FREE_SELECT = "SELECT user_id, used, first_request, last_reset, epoch FROM free_requests"
+    _PENDING_SELECT = (
+        "SELECT payment_id, user_id, period, amount, screenshot_id, username, timestamp, status "
+        "FROM pending_payments"
+    )
+
+    @contextmanager
+    def _immediate(self):
+        """Транзакция с блокировкой записи в базе для всех процессов"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _read_settings(self) -> dict:
+        """Прочитать все разделы, кроме построчных"""
+        return {
+            key: json.loads(value)
+            for key, value in self._conn.execute("SELECT key, value FROM settings")
+        }
+
+    def _write_settings(self, data: dict, key: str = None):
+        """Записать одну настройку или все разделы, кроме построчных"""
+        keys = [key] if key is not None else [name for name in data if name not in RECORD_SECTIONS]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+            [(name, json.dumps(data[name], ensure_ascii=False)) for name in keys]
+        )
+
+    @staticmethod
+    def _user_from_row(row) -> dict:
+        _, until, active, notified_24h, notified_2h = row
+        return {
+            "subscription_until": until,
+            "active": bool(active),
+            "notified_24h": bool(notified_24h),
+            "notified_2h": bool(notified_2h),
+        }
+
+    @staticmethod
+    def _free_from_row(row) -> dict:
+        _, used, first_request, last_reset, epoch = row
+        return {"used": used, "first_request": first_request, "last_reset": last_reset, "epoch": epoch}
+
+    @staticmethod
+    def _pending_from_row(row) -> dict:
+        _, user_id, period, amount, screenshot_id, username, timestamp, status = row
+        return {
+            "user_id": user_id,
+            "period": period,
+            "amount": amount,
+            "screenshot_id": screenshot_id,
+            "username": username,
+            "timestamp": timestamp,
+            "status": status,
+        }
+
+    @staticmethod
+    def _user_row(user_id, user):
+        return (
+            int(user_id),
+            to_iso(user["subscription_until"]),
+            int(bool(user.get("active"))),
+            int(bool(user.get("notified_24h"))),
+            int(bool(user.get("notified_2h"))),
+        )
+
+    @staticmethod
+    def _free_row(user_id, free):
+        return (
+            int(user_id),
+            free.get("used", 0),
+            to_iso(free.get("first_request")),
+            to_iso(free.get("last_reset")),
+            free.get("epoch", 0),
+        )
+
+    @staticmethod
+    def _pending_row(payment_id, payment):
+        return (
+            payment_id,
+            payment["user_id"],
+            payment.get("period"),
+            payment.get("amount"),
+            payment.get("screenshot_id"),
+            payment.get("username"),
+            to_iso(payment.get("timestamp")),
+            payment.get("status", "pending"),
+        )
+
+class RedisSubscriptionStorage(SubscriptionStorage):
+    """Хранение подписок в Redis (или совместимом сервере), общее для нескольких процессов
+
+    Разделы хранятся в хешах {prefix}users, {prefix}free_requests,
+    {prefix}pending_payments и {prefix}settings; значения - JSON записей
+    в формате памяти. Изменения, зависящие от текущего значения,
+    выполняются Lua-скриптами на сервере и поэтому атомарны.
+    """
+
+    shared = True
+
+    _EXTEND_SCRIPT = """
+        local previous = redis.call('HGET', KEYS[1], ARGV[1])
+        local now = tonumber(ARGV[3])
+        local start = now
+        if previous then
+            local until_ts = cjson.decode(previous).subscription_until
+            if until_ts > now then start = until_ts end
+        end
+        local user = cjson.encode({
+            subscription_until = start + tonumber(ARGV[2]),
+            active = true, notified_24h = false, notified_2h = false
+        })
+        redis.call('HSET', KEYS[1], ARGV[1], user)
+        return {user, previous or false}
+    """
+
+    _FREE_SCRIPT = """
+        local now = tonumber(ARGV[2])
+        local increment = tonumber(ARGV[3])
+        local epoch = tonumber(redis.call('HGET', KEYS[2], 'free_requests_epoch') or '0')
+        local raw = redis.call('HGET', KEYS[1], ARGV[1])
+        local free
+        local changed = false
+        if raw then
+            free = cjson.decode(raw)
+        else
+            free = {used = 0, first_request = now, last_reset = now, epoch = epoch}
+            changed = true
+        end
+        if (free.epoch or 0) < epoch or now - free.last_reset >= tonumber(ARGV[4]) then
+            free.used = 0
+            free.last_reset = now
+            free.epoch = epoch
+            changed = true
+        end
+        if increment ~= 0 then
+            free.used = free.used + increment
+            changed = true
+        end
+        local encoded = cjson.encode(free)
+        if changed then redis.call('HSET', KEYS[1], ARGV[1], encoded) end
+        return encoded
+    """
+
+    _POP_SCRIPT = """
+        local payment = redis.call('HGET', KEYS[1], ARGV[1])
+        if payment then redis.call('HDEL', KEYS[1], ARGV[1]) end
+        return payment
+    """
+
+    _CLAIM_SCRIPT = """
+        local claimed = {}
+        for i = 1, #ARGV, 3 do
+            local raw = redis.call('HGET', KEYS[1], ARGV[i])
+            if raw then
+                local user = cjson.decode(raw)
+                local flag = ARGV[i + 1]
+                if user.subscription_until == tonumber(ARGV[i + 2]) and not user[flag] then
+                    user[flag] = true
+                    redis.call('HSET', KEYS[1], ARGV[i], cjson.encode(user))
+                    table.insert(claimed, (i - 1) / 3)
+                end
+            end
+        end
+        return claimed
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "vkbot:"):
+        self.url = url
+        self.prefix = prefix
+        self.client = RedisClient(url)
+        self._keys = {section: f"{prefix}{section}" for section in RECORD_SECTIONS + ("settings",)}
+
+    def is_empty(self) -> bool:
+        """Проверить, что в Redis еще нет данных бота"""
+        replies = self.client.pipeline([("EXISTS", key) for key in self._keys.values()])
+        return not any(replies)
+
+    def load(self) -> Optional[dict]:
+        """Загрузить данные (None, если хранилище пустое)"""
+        if self.is_empty():
+            return None
+
+        data = self.fetch_settings()
+        for section in RECORD_SECTIONS:
+            data[section] = self._hgetall(self._keys[section])
+        return data
+
+    def save_all(self, data: dict):
+        """Заменить все данные одной транзакцией MULTI/EXEC"""
+        commands = [("MULTI",)]
+        for section in RECORD_SECTIONS:
+            commands.append(("DEL", self._keys[section]))
+            items = list(data.get(section, {}).items())
+            # HSET большими порциями, чтобы не собирать одну огромную команду
+            for start in range(0, len(items), 1000):
+                command = ["HSET", self._keys[section]]
+                for key, record in items[start:start + 1000]:
+                    command += [key, self._dumps(record)]
+                commands.append(command)
+        commands.append(("DEL", self._keys["settings"]))
+        settings = self._settings_fields(data)
+        if settings:
+            commands.append(["HSET", self._keys["settings"]] + settings)
+        commands.append(("EXEC",))
+        self._check(self.client.pipeline(commands))
+
+    def save_user(self, data: dict, user_id: str):
+        """Сохранить подписку пользователя"""
+        self._check(self.client.pipeline([self._record_command("users", data, user_id)]))
+
+    def save_free_requests(self, data: dict, user_id: str):
+        """Сохранить бесплатные запросы пользователя"""
+        self._check(self.client.pipeline([self._record_command("free_requests", data, user_id)]))
+
+    def save_pending_payment(self, data: dict, payment_id: str):
+        """Сохранить ожидающий платеж"""
+        self._check(self.client.pipeline([self._record_command("pending_payments", data, payment_id)]))
+
+    def delete_pending_payment(self, data: dict, payment_id: str):
+        """Удалить ожидающий платеж"""
+        self.client.execute("HDEL", self._keys["pending_payments"], payment_id)
+
+    def save_settings(self, data: dict, key: str = None):
+        """Сохранить настройки (цены, реквизиты, длительности)"""
+        self.client.execute("HSET", self._keys["settings"], *self._settings_fields(data, key))
+
+    def save_batch(self, data: dict, operations: list):
+        """Сохранить несколько изменений одной транзакцией MULTI/EXEC"""
+        sections = {
+            "save_user": "users",
+            "save_free_requests": "free_requests",
+            "save_pending_payment": "pending_payments",
+            "delete_pending_payment": "pending_payments",
+        }
+        commands = [("MULTI",)]
+        for operation, *args in operations:
+            if operation == "save_settings":
+                commands.append(["HSET", self._keys["settings"]] + self._settings_fields(data, *args))
+            else:
+                commands.append(self._record_command(sections[operation], data, args[0]))
+        commands.append(("EXEC",))
+        self._check(self.client.pipeline(commands))
+
+    def close(self):
+        """Закрыть соединение"""
+        self.client.close()
+
+    def fetch_user(self, user_id: str) -> Optional[dict]:
+        """Прочитать подписку пользователя"""
+        return self._loads(self.client.execute("HGET", self._keys["users"], user_id))
+
+    def fetch_free_requests(self, user_id: str) -> Optional[dict]:
+        """Прочитать бесплатные запросы пользователя"""
+        return self._loads(self.client.execute("HGET", self._keys["free_requests"], user_id))
+
+    def fetch_pending_payments(self) -> dict:
+        """Прочитать все ожидающие платежи"""
+        return self._hgetall(self._keys["pending_payments"])
+
+    def fetch_settings(self) -> dict:
+        """Прочитать настройки"""
+        return self._hgetall(self._keys["settings"])
+
+    def extend_subscription(self, user_id: str, seconds: int, now: int):
+        """Атомарно продлить подписку; вернуть (новая запись, предыдущая запись или None)"""
+        user, previous = self.client.execute(
+            "EVAL", self._EXTEND_SCRIPT, 1, self._keys["users"], user_id, int(seconds), int(now)
+        )
+        return self._loads(user), self._loads(previous)
+
+    def update_free_requests(self, user_id: str, now: int, increment: int, window: int) -> dict:
+        """Атомарно обновить бесплатные запросы и вернуть запись"""
+        return self._loads(self.client.execute(
+            "EVAL", self._FREE_SCRIPT, 2, self._keys["free_requests"], self._keys["settings"],
+            user_id, int(now), int(increment), int(window)
+        ))
+
+    def pop_pending_payment(self, payment_id: str) -> Optional[dict]:
+        """Атомарно забрать ожидающий платеж (None, если его уже забрали)"""
+        return self._loads(self.client.execute(
+            "EVAL", self._POP_SCRIPT, 1, self._keys["pending_payments"], payment_id
+        ))
+
+    def increment_setting(self, key: str) -> int:
+        """Атомарно увеличить числовую настройку на 1 и вернуть новое значение"""
+        return self.client.execute("HINCRBY", self._keys["settings"], key, 1)
+
+    def claim_notifications(self, claims: list) -> list:
+        """Атомарно отметить напоминания об окончании подписки"""
+        if not claims:
+            return []
+        args = []
+        for user_id, flag, until in claims:
+            args += [user_id, flag, int(until)]
+        indexes = self.client.execute("EVAL", self._CLAIM_SCRIPT, 1, self._keys["users"], *args)
+        return [claims[index] for index in indexes]
+
+    def _record_command(self, section: str, data: dict, key: str) -> list:
+        """Команда сохранения или удаления одной записи"""
+        record = data.get(section, {}).get(key)
+        if record is None:
+            return ["HDEL", self._keys[section], key]
+        return ["HSET", self._keys[section], key, self._dumps(record)]
+
+    def _settings_fields(self, data: dict, key: str = None) -> list:
+        """Пары поле/значение для хеша настроек (одной настройки или всех)"""
+        if key is not None:
+            return [key, self._dumps(data[key])]
+        fields = []
+        for name, value in data.items():
+            if name not in RECORD_SECTIONS:
+                fields += [name, self._dumps(value)]
+        return fields
+
+    def _hgetall(self, key: str) -> dict:
+        """Прочитать хеш и разобрать значения JSON"""
+        reply = self.client.execute("HGETALL", key) or []
+        return {reply[i]: json.loads(reply[i + 1]) for i in range(0, len(reply), 2)}
+
+    @staticmethod
+    def _dumps(value) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+    @staticmethod
+    def _loads(value):
+        return json.loads(value) if value is not None else None
+
+    @staticmethod
+    def _check(replies: list):
+        """Поднять первую ошибку из ответов пакета команд"""
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+            if isinstance(reply, list):
+                RedisSubscriptionStorage._check(reply)
+
+def create_storage(config: dict):
+    """Создать хранилище подписок по настройкам"""
+    backend = config.get("backend", "json")
+
+    if backend == "redis":
+        storage = RedisSubscriptionStorage(config["redis_url"], prefix=config.get("redis_prefix", "vkbot:"))
+        # При первом запуске переносим данные из JSON-файла
+        if storage.is_empty() and os.path.exists(config["json_file"]):
+            data = JSONSubscriptionStorage(config["json_file"]).load()
+            storage.save_all(decode_times(data))
+            logger.info(f"Данные подписок импортированы в Redis из {config['json_file']}")
+        return storage
+
+    if backend == "sqlite":
+        storage = SQLiteSubscriptionStorage(config["sqlite_file"], shared=config.get("shared", False))
+        # При первом запуске переносим данные из JSON-файла
+        if storage.is_empty() and os.path.exists(config["json_file"]):
+            storage.import_json(config["json_file"])
+        return storage
+
+    # Снимок файловых хранилищ: JSON или бинарный (JSON тогда только для импорта)
+    binary = config.get("snapshot_format", "json") == "binary"
+
+    if backend == "journal":
+        return JournalSubscriptionStorage(
+            config["binary_file"] if binary else config["json_file"],
+            journal_file=config.get("journal_file"),
+            compact_bytes=int(config.get("journal_compact_mb", 16) * 1024 * 1024),
+            fsync=config.get("journal_fsync", False),
+            binary=binary,
+            json_file=config["json_file"]
+        )
+
+    if backend != "json":
+        logger.error(f"Неизвестное хранилище подписок '{backend}', используется JSON")
+
+    if binary:
+        return BinarySubscriptionStorage(
+            config["binary_file"],
+            json_file=config["json_file"],
+            write_behind=config.get("write_behind", False),
+            flush_interval=config.get("flush_interval", 2.0),
+            flush_every=config.get("flush_every", 100)
+        )
+
+    return JSONSubscriptionStorage(
+        config["json_file"],
+        write_behind=config.get("write_behind", False),
+        flush_interval=config.get("flush_interval", 2.0),
+        flush_every=config.get("flush_every", 100)
+    )
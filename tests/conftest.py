@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Модули бота создают глобальные экземпляры с файлами данных в текущей
+# директории, поэтому тесты работают во временной директории
+os.chdir(tempfile.mkdtemp(prefix="vk-bot-tests-"))
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:TEST")
+
+@pytest.fixture
+def stub_server():
+    """Запустить локальный HTTP-сервер с обработчиком handler; вернуть его адрес"""
+    servers = []
+
+    def start(handler) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
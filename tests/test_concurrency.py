@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+import subscription_storage
+from subscription_manager import SubscriptionManager
+
+THREADS = 16
+ITERATIONS = 200
+
+STORAGES = {
+    "json": lambda path: subscription_storage.JSONSubscriptionStorage(str(path / "subs.json"), write_behind=True),
+    "journal": lambda path: subscription_storage.JournalSubscriptionStorage(str(path / "subs.json"), compact_bytes=64 * 1024),
+    "sqlite": lambda path: subscription_storage.SQLiteSubscriptionStorage(str(path / "subs.db")),
+}
+
+def run_threads(worker):
+    errors = []
+
+    def guarded(k):
+        try:
+            worker(k)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=guarded, args=(k,)) for k in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+@pytest.mark.parametrize("backend", sorted(STORAGES))
+def test_no_lost_updates_under_contention(backend, tmp_path):
+    manager = SubscriptionManager(str(tmp_path / "subs.json"), storage=STORAGES[backend](tmp_path))
+
+    def worker(k):
+        for _ in range(ITERATIONS):
+            # Один пользователь на все потоки и свой пользователь у каждого потока
+            manager.use_free_request(1)
+            manager.use_free_request(100 + k)
+            # Несколько изменений одной транзакцией
+            with manager.transaction(2, 3):
+                manager.add_user(2, 1)
+                manager.use_free_request(3)
+
+    run_threads(worker)
+
+    expected = THREADS * ITERATIONS
+    assert manager.get_free_requests_info(1)["used"] == expected
+    assert all(manager.get_free_requests_info(100 + k)["used"] == ITERATIONS for k in range(THREADS))
+    assert manager.get_free_requests_info(3)["used"] == expected
+    assert manager.get_time_left(2).days >= expected - 1
+    # Инкрементальная статистика совпадает с полным пересчетом
+    assert manager.reconcile_statistics(report=False) == {"active": 0, "total_free_requests": 0}
+    manager.close()
+
+    # Все изменения сохранены
+    reloaded = SubscriptionManager(str(tmp_path / "subs.json"), storage=STORAGES[backend](tmp_path))
+    assert reloaded.get_free_requests_info(1)["used"] == expected
+    assert reloaded.get_free_requests_info(3)["used"] == expected
+    reloaded.close()
+
+def test_concurrent_confirmations_take_each_payment_once(tmp_path):
+    manager = SubscriptionManager(str(tmp_path / "subs.json"), storage=STORAGES["sqlite"](tmp_path))
+    payment_ids = [manager.add_pending_payment(1000 + i, "1_month", 100) for i in range(50)]
+    confirmed = []
+
+    def worker(k):
+        for payment_id in payment_ids:
+            result = manager.confirm_pending_payments([payment_id])[0]
+            if result["success"]:
+                confirmed.append(payment_id)
+
+    run_threads(worker)
+
+    assert sorted(confirmed) == sorted(payment_ids)
+    assert manager.get_pending_payments() == {}
+    assert manager.get_statistics()["active"] == len(payment_ids)
+    manager.close()
+
+def test_write_behind_flush_never_sees_half_a_transaction(tmp_path):
+    storage = STORAGES["json"](tmp_path)
+    manager = SubscriptionManager(str(tmp_path / "subs.json"), storage=storage)
+    payment_id = manager.add_pending_payment(7, "1_month", 100)
+    storage.flush()
+    inside, resume = threading.Event(), threading.Event()
+
+    def confirm():
+        # Платеж уже снят, подписка еще не выдана
+        with manager.transaction(7):
+            manager._take_pending_payment(payment_id)
+            inside.set()
+            resume.wait()
+            manager.add_user(7, 30)
+
+    worker = threading.Thread(target=confirm)
+    worker.start()
+    inside.wait()
+    flusher = threading.Thread(target=storage.flush)
+    storage._mark_dirty(manager.data)
+    flusher.start()
+    flusher.join(timeout=0.2)
+    # Снимок ждет конца транзакции
+    assert flusher.is_alive()
+    resume.set()
+    worker.join()
+    flusher.join()
+
+    saved = storage.load()
+    assert payment_id not in saved["pending_payments"]
+    assert "7" in saved["users"]
+    manager.close()
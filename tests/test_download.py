@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from callbacks import leaves_track
+from config import DOWNLOAD_CONFIG
+from download_manager import DownloadManager, DownloadProgress, ProgressMessage
+from utils import run_cancellable
+from vk_manager import vk_manager
+
+BODY = bytes(range(256)) * 400
+
+class TrackServer(BaseHTTPRequestHandler):
+    """Заглушка сервера аудиозаписей
+
+    mode задает поведение: drop - первый ответ обрывается на середине,
+    ignore_range - на запрос с Range приходит 206 с начала файла,
+    stale_range - первый ответ обрывается, на запрос с Range приходит 416,
+    flaky - первые два ответа 503, missing - всегда 404,
+    slow - файл отдается маленькими блоками с паузами.
+    """
+
+    mode = None
+    ranges = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        requested = self.headers.get("Range")
+        self.ranges.append(requested)
+
+        if self.mode == "missing" or (self.mode == "flaky" and len(self.ranges) <= 2):
+            self._send(404 if self.mode == "missing" else 503, b"", {})
+        elif requested and self.mode == "stale_range":
+            self._send(416, b"", {"Content-Range": f"bytes */{len(BODY)}"})
+        elif requested and self.mode == "ignore_range":
+            self._send(206, BODY, {"Content-Range": f"bytes 0-{len(BODY) - 1}/{len(BODY)}"})
+        elif requested:
+            start = int(requested.split("=")[1].rstrip("-"))
+            self._send(206, BODY[start:], {"Content-Range": f"bytes {start}-{len(BODY) - 1}/{len(BODY)}"})
+        elif self.mode in ("drop", "ignore_range", "stale_range") and len(self.ranges) == 1:
+            self._send(200, BODY, {"ETag": '"v1"'}, cut=len(BODY) // 3)
+        else:
+            self._send(200, BODY, {"ETag": '"v1"'})
+
+    def _send(self, status, body, headers, cut=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.mode == "slow":
+            for offset in range(0, len(body), 4096):
+                self.wfile.write(body[offset:offset + 4096])
+                self.wfile.flush()
+                time.sleep(0.02)
+            return
+        self.wfile.write(body[:cut])
+        self.wfile.flush()
+        if cut is not None:
+            self.connection.close()
+
+@pytest.fixture
+def track_server(stub_server, monkeypatch):
+    monkeypatch.setitem(DOWNLOAD_CONFIG, "resume_delay", 0)
+    TrackServer.ranges = []
+
+    def start(mode=None) -> str:
+        TrackServer.mode = mode
+        return stub_server(TrackServer) + "/track.mp3"
+
+    return start
+
+def test_download_completes(track_server, tmp_path):
+    target = tmp_path / "track.mp3"
+    progress = DownloadProgress()
+
+    assert vk_manager.download_audio(track_server(), str(target), progress=progress)
+    assert target.read_bytes() == BODY
+    assert progress.downloaded == progress.total == len(BODY)
+
+def test_download_resumes_after_drop(track_server, tmp_path):
+    target = tmp_path / "track.mp3"
+
+    assert vk_manager.download_audio(track_server("drop"), str(target))
+    assert target.read_bytes() == BODY
+    # Вторая попытка продолжает файл с уже скачанного байта
+    assert TrackServer.ranges[0] is None
+    assert TrackServer.ranges[1].startswith("bytes=")
+    assert int(TrackServer.ranges[1][6:-1]) > 0
+
+def test_download_restarts_when_range_is_ignored(track_server, tmp_path):
+    target = tmp_path / "track.mp3"
+
+    assert vk_manager.download_audio(track_server("ignore_range"), str(target))
+    # Ответ 206 не с того байта не дописывается, файл скачивается заново
+    assert target.read_bytes() == BODY
+    assert TrackServer.ranges[-1] is None
+
+def test_download_retries_transient_server_errors(track_server, tmp_path):
+    target = tmp_path / "track.mp3"
+
+    assert vk_manager.download_audio(track_server("flaky"), str(target))
+    assert target.read_bytes() == BODY
+    assert len(TrackServer.ranges) == 3
+
+def test_download_restarts_after_rejected_range(track_server, tmp_path):
+    target = tmp_path / "track.mp3"
+
+    assert vk_manager.download_audio(track_server("stale_range"), str(target))
+    # После 416 файл скачивается с нуля, без Range
+    assert target.read_bytes() == BODY
+    assert TrackServer.ranges[1].startswith("bytes=")
+    assert TrackServer.ranges[2] is None
+
+def test_failed_download_removes_partial_file(track_server, tmp_path):
+    target = tmp_path / "track.mp3"
+    target.write_bytes(b"partial")
+
+    assert not vk_manager.download_audio(track_server("missing"), str(target))
+    assert not target.exists()
+    assert len(TrackServer.ranges) == 1
+
+def test_cancel_stops_download_and_removes_file(track_server, tmp_path):
+    target = tmp_path / "track.mp3"
+    manager = DownloadManager()
+    token = manager.start(42)
+    progress = DownloadProgress()
+    result = {}
+
+    worker = threading.Thread(target=lambda: result.update(
+        ok=vk_manager.download_audio(track_server("slow"), str(target), cancel_event=token, progress=progress)
+    ))
+    worker.start()
+    while progress.downloaded == 0:
+        time.sleep(0.01)
+
+    # Навигация пользователя отменяет его загрузку
+    assert manager.cancel(42)
+    worker.join(timeout=10)
+
+    assert result["ok"] is False
+    assert not target.exists()
+    assert progress.downloaded < len(BODY)
+
+def test_new_download_cancels_previous():
+    manager = DownloadManager()
+    first = manager.start(42)
+    second = manager.start(42)
+
+    assert first.is_set()
+    assert not second.is_set()
+    manager.finish(42, second)
+    assert not manager.cancel(42)
+
+def test_cancel_aborts_started_upload():
+    token = threading.Event()
+    finished = []
+
+    async def upload():
+        await asyncio.sleep(5)
+        finished.append(True)
+
+    async def scenario():
+        threading.Timer(0.05, token.set).start()
+        return await run_cancellable(upload(), token, poll_interval=0.01)
+
+    started = time.monotonic()
+    assert asyncio.run(scenario()) is None
+    assert time.monotonic() - started < 1
+    assert not finished
+
+class Context:
+    user_data = {"audio_source": "playlist_5"}
+
+@pytest.mark.parametrize("data, cancels", [
+    ("main_menu", True),
+    ("playlist_5", True),
+    ("play_audio_3", True),
+    ("play_audio_page_10", False),
+    ("admin_stats", False),
+    ("noop", False),
+])
+def test_only_leaving_the_track_cancels_download(data, cancels):
+    assert leaves_track(data, Context()) is cancels
+
+def test_progress_edits_do_not_overlap_or_outlive_close():
+    class Message:
+        def __init__(self):
+            self.edits = []
+            self.in_flight = 0
+
+        async def edit_text(self, text):
+            self.in_flight += 1
+            assert self.in_flight == 1
+            await asyncio.sleep(0.05)
+            self.in_flight -= 1
+            self.edits.append(text)
+
+    message = Message()
+
+    async def scenario():
+        progress_message = ProgressMessage(message, asyncio.get_running_loop())
+        worker = threading.Thread(target=lambda: [progress_message.update(f"{i}%") for i in range(100)])
+        worker.start()
+        worker.join()
+        await asyncio.sleep(0.01)
+        await progress_message.close()
+        # Прогресс, пришедший после закрытия, сообщение уже не меняет
+        progress_message.update("late")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert message.edits[-1] == "99%"
+    assert len(message.edits) <= 2
@@ -0,0 +1,87 @@
+import asyncio
+import json
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import pytest
+from telegram import Bot
+
+import utils
+from config import TELEGRAM_API_CONFIG
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Заглушка сервера Bot API: запоминает запросы и отвечает успехом"""
+
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[1]
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.requests.append((method, self.headers.get("Content-Type", ""), body))
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bot", "username": "bot"}
+        else:
+            result = {
+                "message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"},
+                "audio": {"file_id": "a", "file_unique_id": "a", "duration": 1},
+            }
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+@pytest.fixture
+def bot_api(stub_server):
+    FakeBotAPI.requests = []
+    return stub_server(FakeBotAPI)
+
+@pytest.fixture
+def track(tmp_path):
+    path = tmp_path / "track.mp3"
+    path.write_bytes(b"ID3" + bytes(range(256)) * 64)
+    return path
+
+def send_track(base_url: str, local_mode: bool, track):
+    """Отправить трек так же, как send_audio в обработчике загрузки"""
+    async def send():
+        bot = Bot("123:TEST", base_url=f"{base_url}/bot", local_mode=local_mode)
+        async with bot:
+            audio = await utils.load_upload_file(str(track))
+            await bot.send_audio(chat_id=42, audio=audio, filename=track.name, title="T", performer="A")
+
+    asyncio.run(send())
+    return [request for request in FakeBotAPI.requests if request[0] == "sendAudio"][0]
+
+def test_local_mode_passes_file_path(bot_api, track, monkeypatch):
+    monkeypatch.setitem(TELEGRAM_API_CONFIG, "local_mode", True)
+
+    _, content_type, body = send_track(bot_api, True, track)
+
+    # Локальный сервер получает путь к файлу, а не содержимое
+    assert "multipart" not in content_type
+    params = json.loads(body) if "json" in content_type else {k: v[0] for k, v in parse_qs(body.decode()).items()}
+    assert params["audio"] == track.absolute().as_uri()
+    assert len(body) < track.stat().st_size
+
+def test_default_mode_uploads_file_content(bot_api, track, monkeypatch):
+    monkeypatch.setitem(TELEGRAM_API_CONFIG, "local_mode", False)
+
+    _, content_type, body = send_track(bot_api, False, track)
+
+    assert content_type.startswith("multipart/form-data")
+    assert track.read_bytes() in body
+    assert b'filename="track.mp3"' in body
+
+def test_upload_limit_depends_on_mode(monkeypatch):
+    monkeypatch.setitem(TELEGRAM_API_CONFIG, "local_mode", False)
+    assert utils.get_upload_limit_bytes() == 50 * 1024 * 1024
+
+    monkeypatch.setitem(TELEGRAM_API_CONFIG, "local_mode", True)
+    assert utils.get_upload_limit_bytes() == 2000 * 1024 * 1024
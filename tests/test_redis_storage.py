@@ -0,0 +1,189 @@
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import uuid
+
+import pytest
+
+from config import SUBSCRIPTION_STORAGE_CONFIG
+from redis_client import RedisClient
+from subscription_manager import LazySubscriptionManager, SubscriptionManager
+from subscription_storage import RedisSubscriptionStorage, create_storage
+
+# Тесты хранилища идут на сервере из TEST_REDIS_URL; без него запускается временный
+# redis-server (REDIS_SERVER или из PATH), иначе пробуется локальный Redis на 6379
+REDIS_URL = os.getenv("TEST_REDIS_URL")
+PROCESSES = 4
+ITERATIONS = 50
+
+def ping(url: str) -> bool:
+    client = RedisClient(url, timeout=1)
+    try:
+        client.execute("PING")
+        return True
+    except OSError:
+        return False
+    finally:
+        client.close()
+
+@pytest.fixture(scope="module")
+def redis_url():
+    if REDIS_URL:
+        yield REDIS_URL
+        return
+
+    binary = os.getenv("REDIS_SERVER") or shutil.which("redis-server")
+    if binary is None:
+        url = "redis://localhost:6379/15"
+        if not ping(url):
+            pytest.skip("Redis недоступен: задайте TEST_REDIS_URL или REDIS_SERVER")
+        yield url
+        return
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [binary, "--port", str(port), "--bind", "127.0.0.1", "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"redis://127.0.0.1:{port}/0"
+    try:
+        deadline = time.monotonic() + 10
+        while not ping(url):
+            if process.poll() is not None or time.monotonic() > deadline:
+                pytest.fail(f"Не удалось запустить {binary}")
+            time.sleep(0.05)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+@pytest.fixture
+def redis_target(redis_url):
+    client = RedisClient(redis_url, timeout=1)
+    prefix = f"test:{uuid.uuid4().hex}:"
+    yield redis_url, prefix
+    client.execute("DEL", *[f"{prefix}{section}" for section in
+                            ("users", "free_requests", "pending_payments", "settings")])
+    client.close()
+
+def make_manager(url: str, prefix: str) -> SubscriptionManager:
+    return SubscriptionManager("unused.json", storage=RedisSubscriptionStorage(url, prefix=prefix))
+
+def process_worker(url: str, prefix: str, payment_ids: list, results):
+    manager = make_manager(url, prefix)
+    taken = []
+    for _ in range(ITERATIONS):
+        manager.use_free_request(1)
+        manager.add_user(2, 1)
+    for payment_id in payment_ids:
+        if manager.confirm_pending_payments([payment_id])[0]["success"]:
+            taken.append(payment_id)
+    manager.close()
+    results.put(taken)
+
+def test_processes_share_state_atomically(redis_target):
+    manager = make_manager(*redis_target)
+    manager.save()
+    payment_ids = [manager.add_pending_payment(1000 + i, "1_month", 100) for i in range(20)]
+    manager.close()
+
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [
+        context.Process(target=process_worker, args=(*redis_target, payment_ids, results))
+        for _ in range(PROCESSES)
+    ]
+    for process in processes:
+        process.start()
+    taken = [payment_id for _ in processes for payment_id in results.get(timeout=60)]
+    for process in processes:
+        process.join(timeout=10)
+
+    manager = make_manager(*redis_target)
+    # Ни одно увеличение счетчика и продление не потеряно, каждый платеж подтвержден один раз
+    assert manager.get_free_requests_info(1)["used"] == PROCESSES * ITERATIONS
+    assert manager.get_time_left(2).days >= PROCESSES * ITERATIONS - 1
+    assert sorted(taken) == sorted(payment_ids)
+    assert manager.get_pending_payments() == {}
+    manager.close()
+
+def test_reminder_is_claimed_by_one_manager(redis_target):
+    first = make_manager(*redis_target)
+    until = first.add_user(5, 1).timestamp()
+    second = make_manager(*redis_target)
+
+    claims = [("5", "notified_24h", int(until))]
+    assert first.storage.claim_notifications(claims) == claims
+    assert second.storage.claim_notifications(claims) == []
+    first.close()
+    second.close()
+
+class FakeRedis:
+    """Сервер RESP для проверки повторов: считает полученные команды
+
+    mode: silent - не отвечает, close_after_reply - отвечает и закрывает соединение.
+    """
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.commands = 0
+        self.sock = socket.create_server(("127.0.0.1", 0))
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.sock.getsockname()[1]}/0"
+
+    def _serve(self):
+        while True:
+            conn, _ = self.sock.accept()
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            data = conn.recv(65536)
+            if not data:
+                return
+            self.commands += data.count(b"*")
+            if self.mode == "close_after_reply":
+                conn.sendall(b":1\r\n")
+                return
+            time.sleep(2)
+
+def test_pipeline_is_not_resent_after_send():
+    server = FakeRedis("silent")
+    client = RedisClient(server.url, timeout=0.2)
+
+    with pytest.raises(OSError):
+        client.execute("HINCRBY", "counter", "field", 1)
+    time.sleep(0.1)
+    # Команда могла выполниться, поэтому клиент не отправляет ее второй раз
+    assert server.commands == 1
+
+def test_stale_connection_is_replaced_before_send():
+    server = FakeRedis("close_after_reply")
+    client = RedisClient(server.url, timeout=1)
+
+    assert client.execute("HINCRBY", "counter", "field", 1) == 1
+    time.sleep(0.1)
+    # Сервер закрыл соединение: новая команда уходит по новому соединению один раз
+    assert client.execute("HINCRBY", "counter", "field", 1) == 1
+    assert server.commands == 2
+
+def test_global_manager_connects_on_first_use():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        dead_url = f"redis://127.0.0.1:{sock.getsockname()[1]}/0"
+    config = dict(SUBSCRIPTION_STORAGE_CONFIG, backend="redis", redis_url=dead_url)
+    manager = LazySubscriptionManager(lambda: SubscriptionManager("unused.json", storage=create_storage(config)))
+
+    # Пока менеджер не нужен, к Redis никто не подключается
+    manager.close()
+    with pytest.raises(OSError):
+        manager.open()
@@ -0,0 +1,57 @@
+import time
+
+from subscription_manager import SubscriptionManager
+
+def make_manager(tmp_path) -> SubscriptionManager:
+    return SubscriptionManager(str(tmp_path / "subs.json"))
+
+def test_statistics_count_lapsed_subscriptions_before_sweep(tmp_path, monkeypatch):
+    manager = make_manager(tmp_path)
+    manager.add_user(1, 30)
+    manager.add_user(2, 1)
+    assert manager.get_statistics()["active"] == 2
+
+    # Фоновый поток еще не снял флаг active, но срок второй подписки уже прошел
+    later = time.time() + 2 * 86400
+    monkeypatch.setattr(time, "time", lambda: later)
+    stats = manager.get_statistics()
+    assert stats["active"] == 1
+    assert stats["expired"] == 1
+    manager.close()
+
+class VanishingPayments(dict):
+    """Ожидающие платежи, которые другой администратор удаляет сразу после проверки"""
+
+    def __contains__(self, key):
+        found = super().__contains__(key)
+        self.pop(key, None)
+        return found
+
+def test_confirmation_skips_payment_removed_concurrently(tmp_path):
+    manager = make_manager(tmp_path)
+    payment_id = manager.add_pending_payment(1, "1_month", 100)
+    manager.data["pending_payments"] = VanishingPayments(manager.data["pending_payments"])
+
+    results = manager.confirm_pending_payments([payment_id])
+    assert len(results) == 1
+    manager.close()
+
+def test_sweeper_skips_payment_removed_concurrently(tmp_path, monkeypatch):
+    manager = make_manager(tmp_path)
+    manager.add_pending_payment(1, "1_month", 100)
+    manager.data["pending_payments"] = VanishingPayments(manager.data["pending_payments"])
+
+    later = time.time() + 10
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert len(manager.expire_pending_payments(max_age=1)) <= 1
+    manager.close()
+
+def test_reset_creates_user_visible_under_free_filter(tmp_path):
+    manager = make_manager(tmp_path)
+    manager.use_free_request(1)
+    manager.reset_free_requests(2)
+
+    rows, _ = manager.get_users_page("free", limit=10)
+    assert sorted(row["user_id"] for row in rows) == [1, 2]
+    assert manager.get_users_summary()["free"] == 2
+    manager.close()
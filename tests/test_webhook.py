@@ -0,0 +1,147 @@
+import asyncio
+import json
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import httpx
+import pytest
+
+import main
+import webhook_server
+from config import TELEGRAM_API_CONFIG, WEBHOOK_CONFIG
+
+SECRET = "s3cret"
+
+class FakeTelegram(BaseHTTPRequestHandler):
+    """Заглушка Bot API: запоминает вызовы, sendMessage отвечает с задержкой delay"""
+
+    protocol_version = "HTTP/1.1"
+    calls = []
+    delay = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[1]
+        raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "json" in self.headers.get("Content-Type", ""):
+            params = json.loads(raw)
+        else:
+            params = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+        self.calls.append((method, params))
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bot", "username": "bot"}
+        elif method == "sendMessage":
+            time.sleep(self.delay)
+            result = {"message_id": 1, "date": 0, "chat": {"id": int(params["chat_id"]), "type": "private"}}
+        else:
+            result = True
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/start",
+            "chat": {"id": update_id, "type": "private"},
+            "from": {"id": update_id, "is_bot": False, "first_name": "u"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+@pytest.fixture
+def telegram(stub_server, monkeypatch):
+    FakeTelegram.calls = []
+    FakeTelegram.delay = 0.0
+    monkeypatch.setitem(TELEGRAM_API_CONFIG, "base_url", stub_server(FakeTelegram) + "/bot")
+    return FakeTelegram
+
+async def start_webhook(config: dict):
+    """Запустить бота на вебхуке; вернуть (сервер, задачу, событие остановки)"""
+    started = []
+    original = webhook_server.WebhookServer.start
+
+    async def start(self):
+        await original(self)
+        started.append(self)
+
+    webhook_server.WebhookServer.start = start
+    try:
+        stop = asyncio.Event()
+        runner = asyncio.create_task(webhook_server.run_webhook(main.build_application(), config, stop))
+        while not started:
+            assert not runner.done(), runner.exception()
+            await asyncio.sleep(0.01)
+    finally:
+        webhook_server.WebhookServer.start = original
+    return started[0], runner, stop
+
+def test_updates_are_delivered_end_to_end(telegram):
+    config = dict(WEBHOOK_CONFIG, listen="127.0.0.1", port=0, url="https://example.test/telegram",
+                  secret_token=SECRET, queue_size=5, workers=2)
+
+    async def scenario():
+        server, runner, stop = await start_webhook(config)
+        url = f"http://127.0.0.1:{server.port}/telegram"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+        async with httpx.AsyncClient() as client:
+            while "setWebhook" not in [method for method, _ in telegram.calls]:
+                await asyncio.sleep(0.01)
+
+            # Запросы без секрета, не по адресу и некорректные отклоняются
+            assert (await client.post(url, json=start_update(1))).status_code == 403
+            bad_secret = {"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+            assert (await client.post(url, json=start_update(1), headers=bad_secret)).status_code == 403
+            assert (await client.post(url + "x", json=start_update(1), headers=headers)).status_code == 404
+            assert (await client.get(url, headers=headers)).status_code == 405
+            assert (await client.post(url, content=b"{oops", headers=headers)).status_code == 400
+            assert (await client.post(url, content=b"x" * (2 * 1024 * 1024), headers=headers)).status_code == 413
+
+            # Всплеск при медленном Bot API: очередь заполняется и часть запросов получает 503,
+            # Telegram повторяет их, пока не получит 200
+            telegram.delay = 0.02
+            statuses = []
+
+            async def deliver(update_id):
+                while True:
+                    response = await client.post(url, json=start_update(update_id), headers=headers)
+                    statuses.append(response.status_code)
+                    if response.status_code == 200:
+                        return
+                    await asyncio.sleep(0.02)
+
+            await asyncio.gather(*(deliver(1000 + i) for i in range(40)))
+
+        # Остановка дообрабатывает очередь
+        stop.set()
+        await runner
+        return server, statuses
+
+    server, statuses = asyncio.run(scenario())
+
+    set_webhook = [params for method, params in telegram.calls if method == "setWebhook"][0]
+    assert set_webhook["url"] == "https://example.test/telegram"
+    assert set_webhook["secret_token"] == SECRET
+    assert 503 in statuses
+    replied = {int(params["chat_id"]) for method, params in telegram.calls if method == "sendMessage"}
+    assert replied >= {1000 + i for i in range(40)}
+    assert server.stats["processed"] == server.stats["accepted"] == 40
+    assert server.stats["failed"] == 0
+
+def test_webhook_without_url_requires_secret():
+    config = dict(WEBHOOK_CONFIG, url=None, secret_token=None)
+    with pytest.raises(ValueError):
+        webhook_server.WebhookServer(None, config)
+
+    # Со своим адресом бот сам передает случайный секрет в setWebhook
+    server = webhook_server.WebhookServer(None, dict(config, url="https://example.test/telegram"))
+    assert server.config["secret_token"]
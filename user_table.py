@@ -0,0 +1,295 @@
+import threading
+from array import array
+from collections.abc import MutableMapping
+
+class UserTable:
+    """Компактная таблица пользователей для большого числа подписчиков
+
+    Подписка и бесплатные запросы пользователя хранятся в одной строке
+    параллельных типизированных массивов; строку по ID находит словарь.
+    Разделы data["users"] и data["free_requests"] - представления таблицы
+    со словарным интерфейсом: чтение возвращает новый словарь записи,
+    а изменить запись можно только присваиванием.
+    """
+
+    # Биты столбца flags
+    HAS_SUBSCRIPTION = 1
+    ACTIVE = 2
+    NOTIFIED_24H = 4
+    NOTIFIED_2H = 8
+    HAS_FREE_REQUESTS = 16
+    # Биты флагов напоминаний и активности по именам полей записи
+    FLAG_BITS = {"active": ACTIVE, "notified_24h": NOTIFIED_24H, "notified_2h": NOTIFIED_2H}
+
+    # Ключ индекса: значение (время в секундах epoch) в старших битах, номер строки - в младших.
+    # 28 бит дают до 268 млн строк, а на время остается 35 бит - до 3058 года, поэтому
+    # срок подписки ограничен MAX_UNTIL (2999-12-31 UTC) и ключ всегда помещается в array('q')
+    ROW_BITS = 28
+    ROW_MASK = (1 << ROW_BITS) - 1
+    MAX_UNTIL = 32503593600
+
+    # Столбцы в порядке записи в бинарный снимок: (имя, код типа array)
+    COLUMNS = (
+        ("ids", 'q'), ("until", 'q'), ("flags", 'B'), ("used", 'i'),
+        ("first_request", 'q'), ("last_reset", 'q'), ("epoch", 'i'),
+    )
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rows = {}
+        self._free_rows = []
+
+        self.ids = array('q')
+        self.until = array('q')
+        self.flags = array('B')
+        self.used = array('i')
+        self.first_request = array('q')
+        self.last_reset = array('q')
+        self.epoch = array('i')
+
+        self.users = SubscriptionsView(self)
+        self.free_requests = FreeRequestsView(self)
+
+    @classmethod
+    def from_data(cls, users: dict, free_requests: dict) -> "UserTable":
+        """Построить таблицу из загруженных словарей разделов"""
+        table = cls()
+        for user_id, record in users.items():
+            table.users[user_id] = record
+        for user_id, record in free_requests.items():
+            table.free_requests[user_id] = record
+        return table
+
+    @classmethod
+    def from_columns(cls, columns: list) -> "UserTable":
+        """Построить таблицу из столбцов снимка (массивы в порядке COLUMNS)"""
+        table = cls()
+        for (name, _), column in zip(cls.COLUMNS, columns):
+            setattr(table, name, column)
+        table._rows = dict(zip(table.ids, range(len(table.ids))))
+
+        # Записи считаются по байтам столбца flags без обхода строк в Python
+        flags = table.flags.tobytes()
+        for view in (table.users, table.free_requests):
+            present = bytes(1 if value & view.PRESENCE else 0 for value in range(256))
+            view._count = flags.translate(present).count(1)
+        return table
+
+    def columns(self) -> list:
+        """Согласованные копии столбцов без освободившихся строк (для снимка)"""
+        with self._lock:
+            columns = [array(code, getattr(self, name)) for name, code in self.COLUMNS]
+            free_rows = set(self._free_rows)
+
+        if free_rows:
+            rows = [row for row in range(len(columns[0])) if row not in free_rows]
+            columns = [array(column.typecode, [column[row] for row in rows]) for column in columns]
+        return columns
+
+    @classmethod
+    def pack(cls, value: int, row: int) -> int:
+        """Упаковать значение и номер строки в одно число, упорядоченное по значению"""
+        return (int(value) << cls.ROW_BITS) | row
+
+    @classmethod
+    def clamp_until(cls, until) -> int:
+        """Ограничить срок подписки значением, которое помещается в ключ индекса"""
+        return min(int(until), cls.MAX_UNTIL)
+
+    @classmethod
+    def unpack(cls, key: int):
+        """Разобрать ключ на (значение, номер строки)"""
+        return key >> cls.ROW_BITS, key & cls.ROW_MASK
+
+    def row(self, user_id) -> int:
+        """Номер строки пользователя (-1, если его нет)"""
+        try:
+            return self._rows.get(int(user_id), -1)
+        except (TypeError, ValueError):
+            return -1
+
+    def subscription(self, user_id):
+        """Срок окончания и флаги подписки без создания словаря (None, если подписки нет)"""
+        row = self.row(user_id)
+        if row < 0:
+            return None
+        flags = self.flags[row]
+        if not flags & self.HAS_SUBSCRIPTION:
+            return None
+        return self.until[row], flags
+
+    def memory_usage(self) -> int:
+        """Приблизительный объем массивов и индекса в байтах"""
+        columns = (self.ids, self.until, self.flags, self.used, self.first_request, self.last_reset, self.epoch)
+        size = sum(column.buffer_info()[1] * column.itemsize for column in columns)
+        return size + self._rows.__sizeof__()
+
+    def _acquire_row(self, user_id: int) -> int:
+        """Строка пользователя; новая строка создается или берется из освободившихся"""
+        row = self._rows.get(user_id)
+        if row is not None:
+            return row
+
+        if self._free_rows:
+            row = self._free_rows.pop()
+            self.ids[row] = user_id
+            self.flags[row] = 0
+        else:
+            row = len(self.ids)
+            if row > self.ROW_MASK:
+                # Проверка до изменения таблицы: номер строки не поместится в ключ индекса
+                raise OverflowError(f"В таблице пользователей не больше {self.ROW_MASK + 1} строк")
+            self.until.append(0)
+            self.flags.append(0)
+            self.used.append(0)
+            self.first_request.append(0)
+            self.last_reset.append(0)
+            self.epoch.append(0)
+            # ids дополняется последним: обход по len(ids) видит только заполненные строки
+            self.ids.append(user_id)
+        self._rows[user_id] = row
+        return row
+
+    def _release_row(self, user_id: int, row: int):
+        """Освободить строку, если в ней не осталось ни одного раздела"""
+        if self.flags[row] & (self.HAS_SUBSCRIPTION | self.HAS_FREE_REQUESTS):
+            return
+        del self._rows[user_id]
+        self._free_rows.append(row)
+
+class _SectionView(MutableMapping):
+    """Раздел таблицы пользователей со словарным интерфейсом (ключи - строки ID)"""
+
+    PRESENCE = 0
+    # Все биты flags, относящиеся к разделу (снимаются при удалении записи)
+    BITS = 0
+
+    def __init__(self, table: UserTable):
+        self.table = table
+        self._count = 0
+
+    def _row(self, key) -> int:
+        """Строка записи раздела (-1, если записи нет)"""
+        row = self.table.row(key)
+        if row >= 0 and self.table.flags[row] & self.PRESENCE:
+            return row
+        return -1
+
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row < 0:
+            raise KeyError(key)
+        return self._record(row)
+
+    def get(self, key, default=None):
+        row = self._row(key)
+        return self._record(row) if row >= 0 else default
+
+    def __contains__(self, key):
+        return self._row(key) >= 0
+
+    def __setitem__(self, key, record: dict):
+        table = self.table
+        with table._lock:
+            row = table._acquire_row(int(key))
+            if not table.flags[row] & self.PRESENCE:
+                self._count += 1
+            self._store(row, record)
+
+    def __delitem__(self, key):
+        table = self.table
+        with table._lock:
+            row = self._row(key)
+            if row < 0:
+                raise KeyError(key)
+            table.flags[row] &= ~self.BITS & 0xFF
+            self._count -= 1
+            table._release_row(int(key), row)
+
+    def __iter__(self):
+        table = self.table
+        # Длина берется один раз: строки, добавленные во время обхода, в него не попадают
+        for row in range(len(table.ids)):
+            if table.flags[row] & self.PRESENCE:
+                yield str(table.ids[row])
+
+    def rows(self):
+        """Пары (номер строки, запись) одним проходом по строкам"""
+        table = self.table
+        for row in range(len(table.ids)):
+            if table.flags[row] & self.PRESENCE:
+                yield row, self._record(row)
+
+    def items(self):
+        """Пары (ID, запись) одним проходом по строкам"""
+        ids = self.table.ids
+        for row, record in self.rows():
+            yield str(ids[row]), record
+
+    def values(self):
+        """Записи раздела одним проходом по строкам"""
+        for _, record in self.items():
+            yield record
+
+    def __len__(self):
+        return self._count
+
+    def __repr__(self):
+        return f"<{type(self).__name__}: {self._count} записей>"
+
+    def _record(self, row: int) -> dict:
+        raise NotImplementedError
+
+    def _store(self, row: int, record: dict):
+        raise NotImplementedError
+
+class SubscriptionsView(_SectionView):
+    """Раздел users: subscription_until, active, notified_24h, notified_2h"""
+
+    PRESENCE = UserTable.HAS_SUBSCRIPTION
+    BITS = UserTable.HAS_SUBSCRIPTION | UserTable.ACTIVE | UserTable.NOTIFIED_24H | UserTable.NOTIFIED_2H
+
+    def _record(self, row: int) -> dict:
+        table = self.table
+        flags = table.flags[row]
+        return {
+            "subscription_until": table.until[row],
+            "active": bool(flags & UserTable.ACTIVE),
+            "notified_24h": bool(flags & UserTable.NOTIFIED_24H),
+            "notified_2h": bool(flags & UserTable.NOTIFIED_2H),
+        }
+
+    def _store(self, row: int, record: dict):
+        table = self.table
+        flags = (table.flags[row] & UserTable.HAS_FREE_REQUESTS) | UserTable.HAS_SUBSCRIPTION
+        if record.get("active"):
+            flags |= UserTable.ACTIVE
+        if record.get("notified_24h"):
+            flags |= UserTable.NOTIFIED_24H
+        if record.get("notified_2h"):
+            flags |= UserTable.NOTIFIED_2H
+        table.until[row] = UserTable.clamp_until(record["subscription_until"])
+        table.flags[row] = flags
+
+class FreeRequestsView(_SectionView):
+    """Раздел free_requests: used, first_request, last_reset, epoch"""
+
+    PRESENCE = UserTable.HAS_FREE_REQUESTS
+    BITS = UserTable.HAS_FREE_REQUESTS
+
+    def _record(self, row: int) -> dict:
+        table = self.table
+        return {
+            "used": table.used[row],
+            "first_request": table.first_request[row],
+            "last_reset": table.last_reset[row],
+            "epoch": table.epoch[row],
+        }
+
+    def _store(self, row: int, record: dict):
+        table = self.table
+        table.used[row] = record.get("used", 0)
+        table.first_request[row] = int(record.get("first_request") or 0)
+        table.last_reset[row] = int(record.get("last_reset") or 0)
+        table.epoch[row] = record.get("epoch", 0)
+        table.flags[row] |= UserTable.HAS_FREE_REQUESTS
@@ -1,7 +1,17 @@
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, LabeledPrice
-from config import logger, PAGE_SIZE, SUBSCRIPTION_CONFIG, FREE_REQUESTS_CONFIG
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputFile, LabeledPrice
+from config import logger, PAGE_SIZE, SUBSCRIPTION_CONFIG, FREE_REQUESTS_CONFIG, TELEGRAM_API_CONFIG, RUNTIME_CONFIG
 from subscription_manager import subscription_manager
 
+# Пул для блокирующих вызовов из обработчиков: загрузки треков занимают поток
+# на все время скачивания, поэтому пул больше пула цикла событий по умолчанию
+_blocking_executor = ThreadPoolExecutor(
+    max_workers=RUNTIME_CONFIG["blocking_workers"], thread_name_prefix="blocking"
+)
+
 def get_audio_info_text(audio_list, start_index=0, page_size=PAGE_SIZE):
     """Получить текст с информацией об аудиозаписях"""
     if not audio_list:
@@ -128,6 +138,71 @@ def get_time_left_text(time_left):
     
     return ", ".join(parts)
 
+def get_download_progress_text(artist, title, progress):
+    """Получить текст с прогрессом загрузки трека"""
+    text = f"📥 Загружаю: {artist} - {title}...\n\n"
+
+    downloaded_mb = progress.downloaded / (1024 * 1024)
+    rate_kb = progress.rate / 1024
+
+    if progress.percent is not None:
+        filled = progress.percent // 10
+        total_mb = progress.total / (1024 * 1024)
+        text += f"{'▓' * filled}{'░' * (10 - filled)} {progress.percent}%\n"
+        text += f"💾 {downloaded_mb:.1f}/{total_mb:.1f} МБ • ⚡ {rate_kb:.0f} КБ/с"
+    else:
+        text += f"💾 {downloaded_mb:.1f} МБ • ⚡ {rate_kb:.0f} КБ/с"
+
+    return text
+
+def get_upload_limit_bytes() -> int:
+    """Получить максимальный размер отправляемого файла"""
+    if TELEGRAM_API_CONFIG["local_mode"]:
+        return TELEGRAM_API_CONFIG["local_upload_limit_mb"] * 1024 * 1024
+    return TELEGRAM_API_CONFIG["upload_limit_mb"] * 1024 * 1024
+
+async def run_blocking(func, *args, **kwargs):
+    """Выполнить блокирующий вызов (VK API, файлы, ffmpeg) в пуле потоков, не останавливая цикл событий"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_executor, functools.partial(func, *args, **kwargs))
+
+async def run_cancellable(coro, cancel_event, poll_interval: float = 0.2):
+    """Выполнить корутину в отдельной задаче и отменить ее, как только выставлен cancel_event
+
+    Возвращает результат корутины или None, если она была отменена.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=poll_interval)
+            if cancel_event.is_set() and not task.done():
+                task.cancel()
+    except asyncio.CancelledError:
+        # Отмена снаружи (остановка бота) прерывает и вложенную задачу
+        task.cancel()
+        raise
+
+    if task.cancelled():
+        return None
+    return task.result()
+
+async def load_upload_file(filename):
+    """Подготовить файл к отправке в Telegram
+
+    В локальном режиме сервер Bot API читает файл сам, поэтому передается
+    file:// URI без копирования содержимого в тело запроса. Иначе InputFile
+    строится из открытого файла в пуле потоков: PTB 20 читает файл целиком
+    при создании InputFile, и это чтение не должно занимать цикл событий.
+    """
+    if TELEGRAM_API_CONFIG["local_mode"]:
+        return Path(filename).absolute().as_uri()
+    return await run_blocking(_open_input_file, filename)
+
+def _open_input_file(filename) -> InputFile:
+    """Прочитать файл в InputFile и сразу закрыть его"""
+    with open(filename, "rb") as file:
+        return InputFile(file, filename=Path(filename).name)
+
 async def create_invoice(bot, chat_id: int, period: str, price: int):
     """Создать инвойс для оплаты звездами"""
     durations = subscription_manager.get_subscription_durations()
@@ -1,7 +1,9 @@
 import os
+import time
 import requests
 import random
-from config import logger, VK_API_VERSION, KATE_USER_AGENT, TOKEN_FILE
+from config import logger, VK_API_VERSION, KATE_USER_AGENT, TOKEN_FILE, DOWNLOAD_CONFIG
+from download_manager import DownloadProgress, download_metrics
 
 class VKMusicManager:
     def __init__(self):
@@ -531,34 +533,154 @@ class VKMusicManager:
         
         return self.search_audio(query)
 
-    def download_audio(self, audio_url, filename):
-        """Скачать аудиозапись"""
+    def download_audio(self, audio_url, filename, cancel_event=None, progress=None):
+        """Скачать аудиозапись с докачкой после обрыва соединения
+
+        cancel_event прерывает загрузку, progress получает счетчики байт.
+        """
+        if progress is None:
+            progress = DownloadProgress()
+
+        headers = self.headers.copy()
+        headers.update({
+            'Referer': 'https://vk.com/',
+            'Origin': 'https://vk.com'
+        })
+
+        status = "failed"
+        downloaded = 0
+        expected_total = None
+        validator = None
+        max_attempts = DOWNLOAD_CONFIG["max_resume_attempts"] + 1
+
         try:
-            headers = self.headers.copy()
-            headers.update({
-                'Referer': 'https://vk.com/',
-                'Origin': 'https://vk.com'
-            })
-            
-            response = requests.get(audio_url, stream=True, headers=headers, 
-                                 timeout=(10, 30))
-            
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                logger.info(f"Аудио успешно скачано: {filename}")
-                return True
-            else:
-                logger.error(f"Ошибка скачивания: статус {response.status_code}")
-                return False
-        except requests.exceptions.Timeout:
-            logger.error("Таймаут при скачивании аудио")
+            for attempt in range(1, max_attempts + 1):
+                if attempt > 1:
+                    delay = DOWNLOAD_CONFIG["resume_delay"] * (attempt - 1)
+                    if cancel_event is not None and cancel_event.wait(delay):
+                        status = "cancelled"
+                        self._remove_partial_file(filename)
+                        return False
+                    if cancel_event is None:
+                        time.sleep(delay)
+
+                request_headers = headers.copy()
+                if downloaded:
+                    request_headers['Range'] = f'bytes={downloaded}-'
+                    if validator:
+                        request_headers['If-Range'] = validator
+
+                try:
+                    response = requests.get(audio_url, stream=True, headers=request_headers,
+                                         timeout=(10, 30))
+
+                    if downloaded and response.status_code == 206:
+                        # Докачиваем только если файл на сервере не изменился и ответ
+                        # начинается с запрошенного байта (прокси может проигнорировать смещение)
+                        start, total = self._parse_content_range(response.headers.get('Content-Range'))
+                        if total != expected_total or start != downloaded:
+                            logger.warning(
+                                f"Ответ не продолжает файл (байт {start} из {total} вместо "
+                                f"{downloaded} из {expected_total}), загрузка начнется заново"
+                            )
+                            response.close()
+                            downloaded = 0
+                            progress.restart()
+                            continue
+                        mode = 'ab'
+                        logger.info(f"Докачка с {downloaded} из {expected_total} байт (попытка {attempt})")
+                    elif response.status_code == 200:
+                        if downloaded:
+                            logger.warning("Сервер не поддерживает докачку, загрузка начнется заново")
+                            downloaded = 0
+                            progress.restart()
+                        mode = 'wb'
+                        expected_total = int(response.headers.get('Content-Length', 0) or 0) or None
+                        validator = response.headers.get('ETag') or response.headers.get('Last-Modified')
+                        progress.set_total(expected_total)
+                    elif response.status_code == 416 and downloaded:
+                        # Сохраненное смещение больше не подходит к файлу на сервере
+                        logger.warning("Сервер отклонил диапазон докачки (416), загрузка начнется заново")
+                        response.close()
+                        downloaded = 0
+                        progress.restart()
+                        continue
+                    elif response.status_code >= 500 or response.status_code == 429:
+                        # Временная ошибка CDN: повторяем с той же паузой, что и после обрыва
+                        logger.warning(
+                            f"Временная ошибка скачивания: статус {response.status_code} "
+                            f"(попытка {attempt}/{max_attempts})"
+                        )
+                        response.close()
+                        continue
+                    else:
+                        logger.error(f"Ошибка скачивания: статус {response.status_code}")
+                        response.close()
+                        self._remove_partial_file(filename)
+                        return False
+
+                    with open(filename, mode) as f:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CONFIG["chunk_size"]):
+                            if cancel_event is not None and cancel_event.is_set():
+                                break
+                            if chunk:
+                                f.write(chunk)
+                                downloaded += len(chunk)
+                                progress.add(len(chunk))
+
+                    if cancel_event is not None and cancel_event.is_set():
+                        status = "cancelled"
+                        response.close()
+                        self._remove_partial_file(filename)
+                        logger.info(f"Загрузка отменена пользователем: {filename}")
+                        return False
+
+                    if expected_total and downloaded < expected_total:
+                        logger.warning(f"Соединение закрыто на {downloaded} из {expected_total} байт")
+                        continue
+
+                    status = "success"
+                    logger.info(f"Аудио успешно скачано: {filename}")
+                    return True
+
+                except requests.exceptions.RequestException as e:
+                    logger.warning(f"Обрыв загрузки на {downloaded} байт (попытка {attempt}/{max_attempts}): {e}")
+
+                # Без известного размера нельзя проверить, что файл не изменился
+                if downloaded and not expected_total:
+                    downloaded = 0
+                    progress.restart()
+
+            logger.error(f"Не удалось скачать аудио за {max_attempts} попыток")
+            self._remove_partial_file(filename)
             return False
         except Exception as e:
             logger.error(f"Ошибка при скачивании: {e}")
+            self._remove_partial_file(filename)
             return False
+        finally:
+            download_metrics.record(progress, status)
+
+    def _parse_content_range(self, content_range):
+        """Получить начало диапазона и полный размер файла из заголовка Content-Range"""
+        # Формат: "bytes 1000-9999/10000"; нераспознанные части - None
+        if not content_range or '/' not in content_range:
+            return None, None
+        byte_range, total = content_range.rsplit('/', 1)
+        total = total.strip()
+        start = byte_range.strip().removeprefix('bytes').strip().split('-', 1)[0].strip()
+        return (
+            int(start) if start.isdigit() else None,
+            int(total) if total.isdigit() else None,
+        )
+
+    def _remove_partial_file(self, filename):
+        """Удалить недокачанный файл"""
+        try:
+            if os.path.exists(filename):
+                os.unlink(filename)
+        except Exception as e:
+            logger.error(f"Ошибка удаления недокачанного файла: {e}")
 
 # Глобальный экземпляр менеджера
 vk_manager = VKMusicManager()
@@ -0,0 +1,241 @@
+import asyncio
+import hmac
+import json
+import secrets
+import signal
+import ssl
+from http import HTTPStatus
+from telegram import Update
+from config import logger, WEBHOOK_CONFIG
+
+class WebhookServer:
+    """Минимальный HTTP-сервер вебхука Telegram на asyncio без внешних зависимостей
+
+    Принимает POST с обновлением на config["path"], проверяет заголовок
+    X-Telegram-Bot-Api-Secret-Token и сразу отвечает 200, поставив обновление
+    в ограниченную очередь. Очередь разбирают config["workers"] задач через
+    Application.process_update. Когда очередь заполнена, сервер отвечает 503:
+    Telegram повторит доставку позже, а бот не копит обновления без предела.
+    """
+
+    SECRET_HEADER = "x-telegram-bot-api-secret-token"
+    MAX_HEADER_SIZE = 16 * 1024
+
+    def __init__(self, application, config: dict = None):
+        self.application = application
+        self.config = dict(WEBHOOK_CONFIG if config is None else config)
+        if not self.config.get("secret_token"):
+            # Случайный секрет годится, только если бот сам передает его в setWebhook:
+            # вебхук, зарегистрированный заранее, шлет другой секрет и получал бы 403
+            if not self.config.get("url"):
+                raise ValueError(
+                    "Не задан WEBHOOK_SECRET_TOKEN: без WEBHOOK_URL бот не регистрирует вебхук сам, "
+                    "и секрет должен совпадать с переданным в setWebhook"
+                )
+            # Без общего секрета несколько экземпляров бота не смогут проверять друг за другом
+            self.config["secret_token"] = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET_TOKEN не задан, используется случайный секрет этого процесса")
+        self._secret = self.config["secret_token"].encode()
+        self._max_body = self.config["max_body_kb"] * 1024
+
+        self.queue = None
+        self._server = None
+        self._workers = []
+        self._writers = set()
+        self.stats = {"accepted": 0, "rejected": 0, "dropped": 0, "processed": 0, "failed": 0}
+
+    @property
+    def port(self) -> int:
+        """Фактический порт сервера (при port=0 его выбирает система)"""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        """Запустить обработчики очереди и начать принимать соединения"""
+        self.queue = asyncio.Queue(maxsize=self.config["queue_size"])
+        self._workers = [
+            asyncio.create_task(self._work(), name=f"webhook-worker-{i}")
+            for i in range(self.config["workers"])
+        ]
+
+        ssl_context = None
+        if self.config.get("cert_file") and self.config.get("key_file"):
+            ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_context.load_cert_chain(self.config["cert_file"], self.config["key_file"])
+
+        self._server = await asyncio.start_server(
+            self._serve, self.config["listen"], self.config["port"],
+            ssl=ssl_context, limit=self.MAX_HEADER_SIZE
+        )
+        logger.info(
+            f"Вебхук слушает {self.config['listen']}:{self.port}{self.config['path']} "
+            f"(очередь {self.config['queue_size']}, обработчиков {self.config['workers']})"
+        )
+
+    async def set_webhook(self):
+        """Зарегистрировать вебхук в Telegram, если задан публичный адрес"""
+        if not self.config.get("url"):
+            logger.info("WEBHOOK_URL не задан, адрес вебхука должен быть зарегистрирован заранее")
+            return
+        await self.application.bot.set_webhook(
+            url=self.config["url"],
+            secret_token=self.config["secret_token"],
+            max_connections=self.config["max_connections"],
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"Вебхук зарегистрирован: {self.config['url']}")
+
+    async def stop(self):
+        """Перестать принимать обновления и дообработать очередь"""
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        if self.queue is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), self.config["drain_timeout_sec"])
+            except asyncio.TimeoutError:
+                logger.warning(f"Не дообработано обновлений вебхука: {self.queue.qsize()}")
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info(f"Вебхук остановлен: {self.stats}")
+
+    async def _work(self):
+        """Разбирать очередь обновлений"""
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.application.process_update(update)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Ошибка обработки обновления из вебхука: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Обслужить одно соединение (Telegram держит соединения открытыми между запросами)"""
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    return  # Клиент закрыл соединение
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, close=True)
+                    return
+
+                method, path, headers = self._parse_head(head)
+                if method is None:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, close=True)
+                    return
+
+                try:
+                    length = int(headers.get("content-length", "0"))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > self._max_body:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, close=True)
+                    return
+                body = await reader.readexactly(length) if length else b""
+
+                close = headers.get("connection", "").lower() == "close"
+                status = self._accept(method, path, headers, body)
+                await self._respond(writer, status, close=close)
+                if close:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _accept(self, method: str, path: str, headers: dict, body: bytes) -> HTTPStatus:
+        """Проверить запрос и поставить обновление в очередь"""
+        if path.split("?", 1)[0] != self.config["path"]:
+            return HTTPStatus.NOT_FOUND
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED
+        if not hmac.compare_digest(headers.get(self.SECRET_HEADER, "").encode(), self._secret):
+            self.stats["rejected"] += 1
+            return HTTPStatus.FORBIDDEN
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception as e:
+            logger.error(f"Некорректное обновление в вебхуке: {e}")
+            return HTTPStatus.BAD_REQUEST
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return HTTPStatus.SERVICE_UNAVAILABLE
+        self.stats["accepted"] += 1
+        return HTTPStatus.OK
+
+    @staticmethod
+    def _parse_head(head: bytes):
+        """Разобрать строку запроса и заголовки (имена в нижнем регистре)"""
+        lines = head.decode("latin-1").split("\r\n")
+        parts = lines[0].split(" ")
+        if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+            return None, None, None
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return parts[0], parts[1], headers
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: HTTPStatus, close: bool = False):
+        """Отправить пустой ответ с кодом status"""
+        response = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Length: 0\r\n"
+        )
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            response += "Retry-After: 1\r\n"
+        if close:
+            response += "Connection: close\r\n"
+        writer.write((response + "\r\n").encode("latin-1"))
+        await writer.drain()
+
+async def run_webhook(application, config: dict = None, stop_event: asyncio.Event = None):
+    """Запустить приложение на вебхуке до сигнала остановки
+
+    Повторяет порядок Application.run_polling: initialize, post_init, прием
+    обновлений, start; при остановке - stop, post_stop, shutdown, post_shutdown.
+    """
+    server = WebhookServer(application, config)
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    await application.initialize()
+    try:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await server.set_webhook()
+        await application.start()
+        logger.info("Бот запущен (вебхук)")
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)